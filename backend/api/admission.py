@@ -0,0 +1,293 @@
+"""
+Admission control for the API.
+
+Two independent guards keep a traffic spike on the Gemini path from starving
+everything else:
+
+* ``rate_limit(endpoint)`` — a token bucket per endpoint and client (the
+  authenticated ``user_id``, else the client IP). A request that finds its
+  bucket empty gets an immediate 429 with ``Retry-After``. Rates and bursts
+  are configured per endpoint in ``settings.ADMISSION["RATE_LIMITS"]``.
+* ``llm_gate`` — caps concurrent Gemini generations in this worker at
+  ``LLM_CONCURRENCY``, with at most ``LLM_QUEUE`` callers waiting (for up to
+  ``LLM_QUEUE_TIMEOUT`` seconds) for a slot. Anything beyond that is shed at
+  once with ``Overloaded`` (503 + ``Retry-After``) instead of tying up a
+  worker thread. Rule-based and cached replies, doctor search and the other
+  cheap endpoints never touch the gate, so they stay fast while it is full.
+
+Both are per worker process. Keep ``LLM_CONCURRENCY + LLM_QUEUE`` below the
+worker's thread count so some threads are always free for cheap requests.
+``stats()`` reports the gate's occupancy and rejection counts; it is shown on
+``/api/triage/stats/`` and ``/api/metrics``.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+from . import metrics
+from .codec import JsonResponse
+
+DEFAULTS = {
+    "ENABLED": True,
+    # endpoint -> {"RATE": tokens per second, "BURST": bucket size}
+    "RATE_LIMITS": {
+        "default": {"RATE": 5.0, "BURST": 30},
+    },
+    "LLM_CONCURRENCY": 8,
+    "LLM_QUEUE": 16,
+    "LLM_QUEUE_TIMEOUT": 5.0,
+    "MAX_BUCKETS": 50000,
+    # Proxies in front of the app that append to X-Forwarded-For (1 behind
+    # Render's); 0 ignores the header, which clients can set to anything
+    "TRUSTED_PROXY_COUNT": 0,
+}
+config = {**DEFAULTS, **getattr(settings, "ADMISSION", {})}
+
+# Weight of the newest sample in the smoothed generation time
+HOLD_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    """Request refused; ``status`` is 429 or 503."""
+
+    def __init__(self, message, retry_after, status):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status = status
+
+
+class Overloaded(Rejected):
+    def __init__(self, retry_after):
+        super().__init__("Too many symptom analyses in progress, please retry shortly", retry_after, 503)
+
+
+def rejection_response(error):
+    response = JsonResponse({"error": str(error), "retry_after": error.retry_after}, status=error.status)
+    response["Retry-After"] = str(error.retry_after)
+    return response
+
+
+# -----------------------------
+# Token buckets
+# -----------------------------
+class RateLimiter:
+    """Token buckets keyed by ``(endpoint, client)``; the least recently used are dropped."""
+
+    def __init__(self, limits, max_buckets):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # (endpoint, client) -> [tokens, updated_at]
+        self._lock = threading.Lock()
+        self.rejected = {}  # endpoint -> count
+
+    def limit_for(self, endpoint):
+        limit = self.limits.get(endpoint) or self.limits["default"]
+        return float(limit["RATE"]), float(limit["BURST"])
+
+    def take(self, endpoint, client):
+        """Spend one token; returns 0 or the seconds until one is available."""
+        rate, burst = self.limit_for(endpoint)
+        if rate <= 0:
+            return 0.0
+        key = (endpoint, client)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            self.rejected[endpoint] = self.rejected.get(endpoint, 0) + 1
+        metrics.admission_rejected.inc(endpoint, "429")
+        return (1 - bucket[0]) / rate
+
+    def stats(self):
+        with self._lock:
+            return {"buckets": len(self._buckets), "rejected": dict(self.rejected)}
+
+
+# -----------------------------
+# LLM concurrency gate
+# -----------------------------
+class LLMGate:
+    def __init__(self, limit, max_waiting, timeout):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self.in_use = 0
+        self.waiting = 0
+        self.hold = None  # smoothed seconds a slot is held
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0}
+
+    def _retry_after(self):
+        # Time for the queue ahead to drain through the available slots
+        hold = self.hold or self.timeout
+        return hold * (self.waiting / max(1, self.limit) + 1)
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting in the bounded queue (at most ``timeout``); raises ``Overloaded``."""
+        with self._condition:
+            if self.in_use < self.limit and not self.waiting:
+                self.in_use += 1
+                self.counters["admitted"] += 1
+                return time.monotonic()
+            if self.waiting >= self.max_waiting:
+                self.counters["shed"] += 1
+                metrics.admission_rejected.inc("llm", "503")
+                raise Overloaded(self._retry_after())
+            self.waiting += 1
+            self.counters["queued"] += 1
+            try:
+                deadline = time.monotonic() + min(self.timeout, timeout if timeout is not None else self.timeout)
+                while self.in_use >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._condition.wait(remaining):
+                        if self.in_use >= self.limit:
+                            self.counters["timed_out"] += 1
+                            metrics.admission_rejected.inc("llm", "503")
+                            raise Overloaded(self._retry_after())
+            finally:
+                self.waiting -= 1
+            self.in_use += 1
+            self.counters["admitted"] += 1
+            return time.monotonic()
+
+    def release(self, acquired_at):
+        with self._condition:
+            self.in_use -= 1
+            held = time.monotonic() - acquired_at
+            self.hold = held if self.hold is None else self.hold + HOLD_ALPHA * (held - self.hold)
+            self._condition.notify()
+
+    def run(self, fn, timeout=None):
+        """``fn()`` inside a slot."""
+        if not config["ENABLED"]:
+            return fn()
+        acquired_at = self.acquire(timeout)
+        try:
+            return fn()
+        finally:
+            self.release(acquired_at)
+
+    async def run_async(self, coro_fn, timeout=None):
+        """``await coro_fn()`` inside a slot; waiting happens off the event loop."""
+        if not config["ENABLED"]:
+            return await coro_fn()
+        with self._condition:
+            free = self.in_use < self.limit and not self.waiting
+            if free:
+                self.in_use += 1
+                self.counters["admitted"] += 1
+        acquired_at = time.monotonic() if free else await self._acquire_off_loop(timeout)
+        try:
+            return await coro_fn()
+        finally:
+            self.release(acquired_at)
+
+    async def _acquire_off_loop(self, timeout):
+        waiter = asyncio.ensure_future(asyncio.to_thread(self.acquire, timeout))
+        try:
+            return await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The thread may still get a slot after we gave up; hand it back
+            waiter.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or self.release(f.result())
+            )
+            raise
+
+    def stats(self):
+        with self._condition:
+            return {
+                "limit": self.limit,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "hold_seconds": round(self.hold, 3) if self.hold is not None else None,
+                **self.counters,
+            }
+
+
+rate_limiter = RateLimiter(
+    {**DEFAULTS["RATE_LIMITS"], **config["RATE_LIMITS"]}, int(config["MAX_BUCKETS"]),
+)
+llm_gate = LLMGate(
+    int(config["LLM_CONCURRENCY"]), int(config["LLM_QUEUE"]), float(config["LLM_QUEUE_TIMEOUT"]),
+)
+
+
+def stats():
+    return {"llm": llm_gate.stats(), "rate_limits": rate_limiter.stats()}
+
+
+# -----------------------------
+# View decorator
+# -----------------------------
+def client_id(request):
+    user_id = getattr(request, "user_id", None)
+    if user_id:
+        return f"user:{user_id}"
+    return "ip:" + client_ip(request)
+
+
+def client_ip(request):
+    """The address the nearest trusted proxy saw, or ``REMOTE_ADDR``.
+
+    Each proxy appends the address it received the request from, so with
+    ``TRUSTED_PROXY_COUNT`` = n the client is the n-th entry from the right.
+    Anything to the left of it was sent by the client and may be forged.
+    """
+    proxies = int(config["TRUSTED_PROXY_COUNT"])
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "") if proxies > 0 else ""
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    if len(hops) >= proxies > 0:
+        return hops[-proxies]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def forwarding_warning(request):
+    """A warning if ``request`` came through a proxy whose header is ignored."""
+    if int(config["TRUSTED_PROXY_COUNT"]) > 0 or not request.META.get("HTTP_X_FORWARDED_FOR"):
+        return None
+    return (
+        "X-Forwarded-For is set but TRUSTED_PROXY_COUNT is 0: clients behind the proxy "
+        "share its address and its rate-limit buckets"
+    )
+
+
+def _check(endpoint, request):
+    if not config["ENABLED"]:
+        return None
+    wait = rate_limiter.take(endpoint, client_id(request))
+    if wait:
+        return rejection_response(Rejected("Too many requests, please slow down", wait, 429))
+    return None
+
+
+def rate_limit(endpoint):
+    """Token-bucket limit for a view; apply below ``require_auth`` so users are known."""
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                return _check(endpoint, request) or await view_func(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            return _check(endpoint, request) or view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
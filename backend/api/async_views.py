@@ -0,0 +1,181 @@
+"""
+Async variant of the analyze-symptoms endpoint.
+
+Served through ``userapp.asgi`` (e.g. ``gunicorn userapp.asgi:application -k
+uvicorn.workers.UvicornWorker``) the view never holds a thread while it waits
+on Gemini or Supabase. The session record goes to the write-behind queue in
+``sessions.py``, so the patient lookup and insert are off the request path.
+"""
+import asyncio
+
+from django.views.decorators.csrf import csrf_exempt
+
+from . import admission, codec, db, gemini, metrics, rules, streaming, triage
+from .admission import llm_gate, rate_limit
+from .auth import require_auth
+from .batch import BatchTriage, parse_batch
+from .cache import triage_cache
+from .codec import JsonResponse
+from .directory import directory
+from .schema import error_body
+from .sessions import session_writer
+from .singleflight import flights
+from .warmup import warmup
+
+async def generate_reply(info, deadline=None):
+    deadline = deadline or gemini.Deadline()
+    prompt = triage.build_prompt(info)
+    response, _ = await llm_gate.run_async(
+        lambda: gemini.registry.generate_async(prompt, deadline), deadline.remaining(),
+    )
+    reply_json = triage.parse_reply(response.text, info["bmi"])
+    reply_json["source"] = "llm"
+    triage_cache.set(info, reply_json)
+    return reply_json
+
+
+async def run_triage(info, deadline=None):
+    # High-confidence common cases never reach the model
+    with metrics.span("rules"):
+        reply_json = rules.local_triage(info)
+    if reply_json is not None:
+        metrics.triage_sources.inc("rules")
+        return reply_json
+    with metrics.span("cache"):
+        reply_json = triage_cache.get(info)
+    if reply_json is not None:
+        metrics.triage_sources.inc("cache")
+        return reply_json
+    with metrics.span("llm"):
+        # Shares the generation of an identical request in flight
+        reply_json = await flights.do_async(
+            triage.triage_flight_key(info), lambda: generate_reply(info, deadline),
+        )
+    metrics.triage_sources.inc("llm")
+    return reply_json
+
+
+async def fetch_doctors(recommended_specialty, info):
+    if not recommended_specialty:
+        return []
+    with metrics.span("doctors"):
+        return await flights.do_async(
+            triage.doctors_flight_key(recommended_specialty, info),
+            lambda: lookup_doctors(recommended_specialty, info),
+        )
+
+
+async def lookup_doctors(recommended_specialty, info):
+    search_term = triage.search_term_for(recommended_specialty)
+    latitude, longitude = triage.patient_location(info)
+    try:
+        if not directory.loaded:
+            # First load is a bulk fetch; keep it off the event loop
+            await asyncio.to_thread(directory.ensure_loaded)
+        return directory.search(
+            recommended_specialty, limit=triage.DOCTOR_LIMIT, latitude=latitude, longitude=longitude,
+        )
+    except Exception as e:
+        metrics.swallowed("doctor_directory", f"Doctor directory unavailable: {e}")
+    metrics.fallbacks.inc("doctor_query")
+    try:
+        client = await db.get_async_supabase()
+        doctors_data = await db.execute_async(triage.doctor_query(client, search_term))
+        return triage.format_doctors(doctors_data.data)
+    except Exception as e:
+        metrics.swallowed("doctor_query", f"Error fetching doctors: {e}")
+        return []
+
+
+@csrf_exempt
+@require_auth
+@rate_limit("analyze")
+async def analyze_symptoms_async(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST requests allowed"}, status=405)
+
+    deadline = gemini.Deadline()
+    try:
+        data = codec.loads(request.body)
+
+        with metrics.span("validate"):
+            info, errors = triage.extract_patient_info(data)
+        if errors:
+            return JsonResponse(error_body(errors), status=400)
+
+        try:
+            reply_json = await run_triage(info, deadline)
+        except admission.Rejected as e:
+            return admission.rejection_response(e)
+        except gemini.AllModelsFailed as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
+        warmup.record_triage()
+
+        recommended_specialty = reply_json.get("doctor_recommendation")
+        doctors_list = await fetch_doctors(recommended_specialty, info)
+        triage.attach_doctors(reply_json, recommended_specialty, doctors_list)
+
+        # Non-blocking: the writer thread resolves patient_id and inserts
+        with metrics.span("session"):
+            session_writer.enqueue(
+                getattr(request, "user_id", None),
+                triage.session_record(None, info, reply_json, doctors_list),
+            )
+
+        return JsonResponse(reply_json, safe=False)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+async def batch_events(results):
+    """SSE ``result`` per patient as it completes, then ``done``."""
+    count = failed = 0
+    async for result in results:
+        count += 1
+        failed += "error" in result
+        yield streaming.sse_event("result", result)
+    yield streaming.sse_event("done", {"count": count, "failed": failed})
+
+
+@csrf_exempt
+@require_auth
+@rate_limit("batch")
+async def analyze_symptoms_batch(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST requests allowed"}, status=405)
+
+    try:
+        data = codec.loads(request.body)
+    except codec.DecodeError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # Nothing runs unless every patient in the batch is valid
+    patients, errors = parse_batch(data)
+    if errors:
+        return JsonResponse({"errors": errors}, status=400)
+
+    if (getattr(request, "auth_claims", None) or {}).get("role") != "service_role":
+        # Only a service-role caller may file sessions under other patients' auth_ids
+        user_id = getattr(request, "user_id", None)
+        foreign = [
+            {"index": index, "error": "Only a service-role caller may set auth_id"}
+            for index, (_, auth_id) in enumerate(patients)
+            if auth_id is not None and auth_id != user_id
+        ]
+        if foreign:
+            return JsonResponse({"errors": foreign}, status=403)
+    results = BatchTriage(generate_reply, fetch_doctors).results(patients, getattr(request, "user_id", None))
+    if streaming.wants_event_stream(request):
+        return streaming.event_stream_response(batch_events(results))
+
+    try:
+        collected = [result async for result in results]
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    collected.sort(key=lambda result: result["index"])
+    return JsonResponse({
+        "count": len(collected),
+        "failed": sum("error" in result for result in collected),
+        "results": collected,
+    })
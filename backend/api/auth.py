@@ -0,0 +1,338 @@
+"""
+Supabase JWT authentication for the API views.
+
+``require_auth`` verifies the ``Authorization: Bearer <access token>`` the
+frontend sends and sets ``request.user_id`` (the token's ``sub``, i.e. the
+Supabase ``auth_id``) and ``request.auth_claims``.
+
+Keys: projects using the legacy shared secret sign with HS256
+(``SUPABASE_AUTH["JWT_SECRET"]``); projects with asymmetric signing keys
+publish them at ``<SUPABASE_URL>/auth/v1/.well-known/jwks.json``. The JWKS
+is fetched once, re-fetched in the background every ``JWKS_REFRESH``
+seconds, and re-fetched straight away (at most every ``JWKS_MIN_REFRESH``
+seconds) when a token names a key id we have not seen, so key rotation needs
+no restart.
+
+Verified tokens are remembered in an LRU keyed by the token's SHA-256 digest
+until the token expires (capped at ``CACHE_TTL``), so the repeat requests of
+a session cost a hash and a dict lookup instead of a signature check.
+
+``require_admin`` (applied below ``require_auth``) further limits a view to
+service-role tokens and users whose ``app_metadata.role`` is one of
+``ADMIN_ROLES``. Only the service role can set ``app_metadata``, so users
+cannot grant it to themselves.
+
+Every API view is wrapped by ``require_auth`` except the ones in
+``PUBLIC_VIEWS``; the tests check the URL patterns against that list.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from functools import wraps
+
+import httpx
+import jwt
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+from . import metrics
+from .cache import LocalBackend
+from .codec import JsonResponse
+
+DEFAULTS = {
+    "REQUIRED": True,
+    "JWT_SECRET": None,
+    "JWKS_URL": None,
+    "AUDIENCE": "authenticated",
+    "ISSUER": None,
+    "ALGORITHMS": ["HS256", "RS256", "ES256"],
+    "LEEWAY": 30,
+    "JWKS_REFRESH": 600,
+    "JWKS_MIN_REFRESH": 30,
+    "JWKS_TIMEOUT": 3.0,
+    "CACHE_SIZE": 10000,
+    "CACHE_TTL": 300,
+    "ADMIN_ROLES": ["admin"],
+}
+config = {**DEFAULTS, **getattr(settings, "SUPABASE_AUTH", {})}
+
+# API views served without a token, on purpose: the public doctor listing
+# (no patient data), the platform health check and the Prometheus scrape
+PUBLIC_VIEWS = frozenset({
+    "api.views.list_doctors",
+    "api.views.readiness",
+    "api.views.prometheus_metrics",
+})
+
+
+class AuthError(Exception):
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
+
+
+# -----------------------------
+# Signing keys
+# -----------------------------
+class KeyProvider:
+    def __init__(self, secret=None, jwks_url=None, refresh_interval=600, min_refresh=30, timeout=3.0):
+        self.secret = secret
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.min_refresh = min_refresh
+        self.timeout = timeout
+        self._keys = {}  # kid -> PyJWK
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._background_lock = threading.Lock()
+
+    def _fetch(self):
+        response = httpx.get(self.jwks_url, timeout=self.timeout)
+        response.raise_for_status()
+        keys = {}
+        for data in response.json().get("keys", []):
+            try:
+                key = jwt.PyJWK(data)
+            except jwt.PyJWTError:
+                # Key types this PyJWT build cannot use are skipped, not fatal
+                continue
+            keys[key.key_id] = key
+        return keys
+
+    def refresh(self, force=False):
+        """Fetch the JWKS unless another thread just did."""
+        if not self.jwks_url:
+            return
+        with self._lock:
+            if not force and self._fetched_at is not None and (
+                time.monotonic() - self._fetched_at < self.min_refresh
+            ):
+                return
+            self._keys = self._fetch()
+            self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh(force=True)
+        except Exception as e:
+            # Keep verifying with the current keys; the next request retries
+            metrics.swallowed("jwks_refresh", f"JWKS refresh failed: {e}")
+        finally:
+            self._background_lock.release()
+
+    def key_for(self, header):
+        if header.get("alg") == "HS256":
+            if not self.secret:
+                raise AuthError("Invalid token")
+            return self.secret
+        if not self.jwks_url:
+            raise AuthError("Invalid token")
+        try:
+            if self._fetched_at is None:
+                self.refresh()
+            elif time.monotonic() - self._fetched_at >= self.refresh_interval:
+                if self._background_lock.acquire(blocking=False):
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+            key = self._keys.get(header.get("kid"))
+            if key is None:
+                # Possibly a freshly rotated key
+                self.refresh()
+                key = self._keys.get(header.get("kid"))
+        except (httpx.HTTPError, ValueError) as e:
+            raise AuthError(f"Authentication keys unavailable: {e}", status=503)
+        if key is None:
+            raise AuthError("Invalid token")
+        return key.key
+
+    def stats(self):
+        return {
+            "jwks_keys": len(self._keys),
+            "jwks_age_seconds": (
+                round(time.monotonic() - self._fetched_at, 1) if self._fetched_at is not None else None
+            ),
+        }
+
+
+# -----------------------------
+# Verification
+# -----------------------------
+class Authenticator:
+    def __init__(self, keys, config):
+        self.keys = keys
+        self.config = config
+        self._verified = LocalBackend(int(config["CACHE_SIZE"]))
+        self._lock = threading.Lock()
+        self.counters = {"cache_hits": 0, "verified": 0, "rejected": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def cached(self, token):
+        """Claims of a token verified earlier and not yet expired, or ``None``."""
+        claims = self._verified.get(self.digest(token))
+        if claims is not None:
+            self._count("cache_hits")
+        return claims
+
+    def verify(self, token):
+        """Check the signature and claims; raises ``AuthError``."""
+        try:
+            try:
+                header = jwt.get_unverified_header(token)
+            except jwt.InvalidTokenError:
+                raise AuthError("Invalid token")
+            algorithm = header.get("alg")
+            if algorithm not in self.config["ALGORITHMS"]:
+                raise AuthError("Invalid token")
+            audience = self.config["AUDIENCE"]
+            try:
+                claims = jwt.decode(
+                    token,
+                    self.keys.key_for(header),
+                    algorithms=[algorithm],
+                    audience=audience,
+                    issuer=self.config["ISSUER"],
+                    leeway=self.config["LEEWAY"],
+                    options={"require": ["exp", "sub"], "verify_aud": audience is not None},
+                )
+            except jwt.ExpiredSignatureError:
+                raise AuthError("Token expired")
+            except jwt.InvalidTokenError:
+                raise AuthError("Invalid token")
+        except AuthError:
+            self._count("rejected")
+            raise
+        self._count("verified")
+        ttl = min(float(self.config["CACHE_TTL"]), claims["exp"] - time.time())
+        if ttl > 0:
+            self._verified.set(self.digest(token), claims, ttl)
+        return claims
+
+    def authenticate(self, token):
+        return self.cached(token) or self.verify(token)
+
+    def clear(self):
+        self._verified.clear()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "cached_tokens": len(self._verified), **self.keys.stats()}
+
+
+def _jwks_url():
+    if config["JWKS_URL"]:
+        return config["JWKS_URL"]
+    supabase_url = getattr(settings, "SUPABASE_URL", None)
+    return f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json" if supabase_url else None
+
+
+authenticator = Authenticator(
+    KeyProvider(
+        secret=config["JWT_SECRET"],
+        jwks_url=_jwks_url(),
+        refresh_interval=float(config["JWKS_REFRESH"]),
+        min_refresh=float(config["JWKS_MIN_REFRESH"]),
+        timeout=float(config["JWKS_TIMEOUT"]),
+    ),
+    config,
+)
+
+
+# -----------------------------
+# View decorator
+# -----------------------------
+def bearer_token(request):
+    scheme, _, token = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    return token.strip() if scheme == "Bearer" and token.strip() else None
+
+
+def _reject(error):
+    response = JsonResponse({"error": str(error)}, status=error.status)
+    if error.status == 401:
+        response["WWW-Authenticate"] = 'Bearer realm="api"'
+    return response
+
+
+def _attach(request, claims):
+    request.auth_claims = claims
+    request.user_id = claims.get("sub") if claims else None
+
+
+def is_admin(claims):
+    if not claims:
+        return False
+    if claims.get("role") == "service_role":
+        return True
+    return (claims.get("app_metadata") or {}).get("role") in config["ADMIN_ROLES"]
+
+
+def require_admin(view_func):
+    """Allow only admins through; apply below ``require_auth``."""
+    forbidden = AuthError("Admin access required", status=403)
+
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            if not is_admin(getattr(request, "auth_claims", None)):
+                return _reject(forbidden)
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not is_admin(getattr(request, "auth_claims", None)):
+            return _reject(forbidden)
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def require_auth(view_func):
+    """Verify the bearer token before running the view.
+
+    Sets ``request.user_id`` and ``request.auth_claims``. When
+    ``SUPABASE_AUTH["REQUIRED"]`` is off, requests without a token are let
+    through anonymously (``user_id`` None); a token that is sent must still
+    verify. Works on sync and async views.
+    """
+    missing = AuthError("Authorization header missing or invalid")
+
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            token = bearer_token(request)
+            claims = None
+            try:
+                if token:
+                    # A cache miss may have to fetch the JWKS; keep that off the loop
+                    claims = authenticator.cached(token) or await asyncio.to_thread(authenticator.verify, token)
+                elif config["REQUIRED"]:
+                    raise missing
+            except AuthError as e:
+                return _reject(e)
+            _attach(request, claims)
+            return await view_func(request, *args, **kwargs)
+        async_wrapper.requires_auth = True
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        token = bearer_token(request)
+        claims = None
+        try:
+            if token:
+                claims = authenticator.authenticate(token)
+            elif config["REQUIRED"]:
+                raise missing
+        except AuthError as e:
+            return _reject(e)
+        _attach(request, claims)
+        return view_func(request, *args, **kwargs)
+    wrapper.requires_auth = True
+    return wrapper
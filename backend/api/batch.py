@@ -0,0 +1,143 @@
+"""
+Batch triage for partner-clinic intake queues.
+
+``/api/analyze-symptoms/batch/`` takes a list of analyze-symptoms payloads.
+Everything is validated before any work starts; then each patient goes
+through the same steps as the single endpoint (rules, cache, Gemini, doctors,
+session) with these differences:
+
+* at most ``CONCURRENCY`` Gemini generations run at once, and patients whose
+  requests share a cache key (in this batch or in flight elsewhere) share
+  one generation;
+* doctors are looked up once per recommended specialty for the whole batch
+  (patients with a location still get their own nearest-first list, which
+  the in-memory directory answers without a query);
+* session records are handed to the write-behind queue together and written
+  in bulk.
+"""
+import asyncio
+
+from django.conf import settings
+
+from . import metrics, rules, triage
+from .cache import triage_cache
+from .directory import directory
+from .schema import error_body
+from .sessions import session_writer
+from .singleflight import flights
+
+DEFAULTS = {
+    "MAX_ITEMS": 500,
+    "CONCURRENCY": 8,
+}
+config = {**DEFAULTS, **getattr(settings, "BATCH_TRIAGE", {})}
+
+
+def parse_batch(data):
+    """Validate a batch payload.
+
+    Accepts a list of patients or ``{"patients": [...]}``; a patient may
+    carry the ``auth_id`` its session is stored under (the view refuses
+    other users' ids unless the caller is the service role). Returns
+    ``([(info, auth_id), ...], None)`` or ``(None, errors)`` where
+    ``errors`` lists every invalid item as ``{"index": i, "error": message,
+    "errors": {field: message}}``.
+    """
+    items = data.get("patients") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return None, [{"index": None, "error": "Please provide a non-empty list of patients"}]
+    if len(items) > config["MAX_ITEMS"]:
+        return None, [{"index": None, "error": f"At most {config['MAX_ITEMS']} patients per batch"}]
+    patients, errors = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "error": "Each patient must be an object"})
+            continue
+        info, item_errors = triage.extract_patient_info(item)
+        if item_errors:
+            errors.append({"index": index, **error_body(item_errors)})
+        else:
+            patients.append((info, item.get("auth_id")))
+    return (None, errors) if errors else (patients, None)
+
+
+class BatchTriage:
+    """Runs one batch; holds the per-batch generation and doctor-list sharing."""
+
+    def __init__(self, generate_reply, fetch_doctors, concurrency=None):
+        self._generate_reply = generate_reply
+        self._fetch_doctors = fetch_doctors
+        self._llm_slots = asyncio.Semaphore(int(concurrency or config["CONCURRENCY"]))
+        self._doctor_lists = {}  # search term -> Task
+        self.sessions = []  # (auth_id, record) to enqueue once the batch is done
+
+    async def _generate(self, info):
+        async with self._llm_slots:
+            return await self._generate_reply(info)
+
+    async def triage(self, info):
+        with metrics.span("rules"):
+            reply_json = rules.local_triage(info)
+        if reply_json is not None:
+            metrics.triage_sources.inc("rules")
+            return reply_json
+        with metrics.span("cache"):
+            reply_json = triage_cache.get(info)
+        if reply_json is not None:
+            metrics.triage_sources.inc("cache")
+            return reply_json
+        with metrics.span("llm"):
+            # Patients sharing a generation each get their own copy to attach doctors to
+            reply_json = await flights.do_async(triage.triage_flight_key(info), lambda: self._generate(info))
+        metrics.triage_sources.inc("llm")
+        return reply_json
+
+    async def doctors(self, recommended_specialty, info):
+        if not recommended_specialty:
+            return []
+        latitude, longitude = triage.patient_location(info)
+        if latitude is not None and directory.loaded:
+            return directory.search(
+                recommended_specialty, limit=triage.DOCTOR_LIMIT,
+                latitude=latitude, longitude=longitude,
+            )
+        term = triage.search_term_for(recommended_specialty)
+        task = self._doctor_lists.get(term)
+        if task is None:
+            task = self._doctor_lists[term] = asyncio.ensure_future(
+                self._fetch_doctors(recommended_specialty, {"latitude": None, "longitude": None})
+            )
+        return list(await asyncio.shield(task))
+
+    async def run_one(self, index, info, auth_id):
+        try:
+            reply_json = await self.triage(info)
+            recommended_specialty = reply_json.get("doctor_recommendation")
+            doctors_list = await self.doctors(recommended_specialty, info)
+        except Exception as e:
+            # One patient's failure does not fail the batch
+            return {"index": index, "error": str(e)}
+        triage.attach_doctors(reply_json, recommended_specialty, doctors_list)
+        self.sessions.append((auth_id, triage.session_record(None, info, reply_json, doctors_list)))
+        return {"index": index, **reply_json}
+
+    async def results(self, patients, default_auth_id=None):
+        """Per-patient results in completion order."""
+        if not directory.loaded:
+            try:
+                await asyncio.to_thread(directory.ensure_loaded)
+            except Exception as e:
+                metrics.swallowed("doctor_directory", f"Doctor directory unavailable: {e}")
+        # Patients run concurrently; their spans feed the histograms only
+        with metrics.without_server_timing():
+            tasks = [
+                asyncio.ensure_future(self.run_one(index, info, auth_id or default_auth_id))
+                for index, (info, auth_id) in enumerate(patients)
+            ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            session_writer.enqueue_many(self.sessions)
@@ -0,0 +1,667 @@
+"""
+Benchmark harness for the API.
+
+Runs the real Django application, through its WSGI and ASGI handlers,
+against in-process stand-ins for Gemini (``genai.GenerativeModel``) and the
+Supabase table API. Latency and failure rates of both can be configured, so
+the numbers measure our own code paths: validation, rules, cache,
+coalescing, doctor directory, session queue.
+
+Driven by ``python manage.py benchmark``; see that command for the options.
+Each run is written as JSON (config, commit, per scenario and concurrency:
+throughput, latency percentiles, status codes and a per-stage breakdown) so
+runs from different commits can be compared offline.
+"""
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import wraps
+
+import jwt
+
+SPECIALTY_NAMES = [
+    "General Physician", "Cardiologist", "Neurologist", "Pulmonologist", "ENT",
+    "Gastroenterologist", "Dermatologist", "Orthopedic", "Endocrinologist",
+    "Psychiatrist", "Gynecologist", "Urologist",
+]
+
+# Requests are signed with this key; long enough to satisfy PyJWT's HS256 check
+BENCH_JWT_KEY = "bookmydoc-benchmark-signing-key-0001"
+
+# Complaints the rule engine answers locally and ones that need the model
+RULE_SYMPTOMS = ["fever, cough", "skin rash, itching", "acidity", "back pain", "ear pain"]
+LLM_SYMPTOMS = [
+    "tingling in fingers", "swollen ankles", "blurred vision", "palpitations at night",
+    "weight loss", "hair loss and dry skin", "ringing in ears", "night sweats",
+]
+
+
+# -----------------------------
+# Latency / failure model
+# -----------------------------
+class Profile:
+    """Log-normal latency around ``median_ms`` and an independent failure rate."""
+
+    def __init__(self, median_ms=0.0, sigma=0.0, error_rate=0.0, seed=None):
+        self.median_ms = float(median_ms)
+        self.sigma = float(sigma)
+        self.error_rate = float(error_rate)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """``(delay_seconds, fail)`` for one call."""
+        with self._lock:
+            delay = self.median_ms / 1000 * (
+                math.exp(self._random.gauss(0, self.sigma)) if self.sigma else 1
+            )
+            return delay, self._random.random() < self.error_rate
+
+    def as_dict(self):
+        return {"median_ms": self.median_ms, "sigma": self.sigma, "error_rate": self.error_rate}
+
+
+class FakeServiceError(Exception):
+    pass
+
+
+# -----------------------------
+# Gemini stand-in
+# -----------------------------
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModelInfo:
+    def __init__(self, name):
+        self.name = name
+        self.display_name = name
+        self.description = "benchmark stand-in"
+        self.supported_generation_methods = ["generateContent"]
+
+
+def _fake_reply(prompt):
+    specialist = SPECIALTY_NAMES[hash(prompt) % len(SPECIALTY_NAMES)]
+    return json.dumps({
+        "possible_diseases": ["Condition A", "Condition B"],
+        "severity": "mild",
+        "doctor_recommendation": specialist,
+        "advice": f"Consult a {specialist}.",
+    })
+
+
+def fake_model_class(profile):
+    class FakeGenerativeModel:
+        def __init__(self, model_name, *args, **kwargs):
+            self.model_name = model_name
+
+        def generate_content(self, prompt, **kwargs):
+            delay, fail = profile.draw()
+            time.sleep(delay)
+            if fail:
+                raise FakeServiceError("503 fake Gemini overload")
+            return _FakeResponse(_fake_reply(prompt))
+
+        async def generate_content_async(self, prompt, **kwargs):
+            delay, fail = profile.draw()
+            await asyncio.sleep(delay)
+            if fail:
+                raise FakeServiceError("503 fake Gemini overload")
+            return _FakeResponse(_fake_reply(prompt))
+
+    return FakeGenerativeModel
+
+
+# -----------------------------
+# Supabase stand-in
+# -----------------------------
+def fake_roster(size, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(size):
+        rows.append({
+            "id": i + 1,
+            "full_name": f"Dr. Bench {i + 1}",
+            "clinic_name": f"Clinic {i % 97}",
+            "experience": rng.randint(1, 35),
+            "phone": "0000000000",
+            "consultation_fee": rng.choice([300, 500, 800, 1200]),
+            "latitude": round(rng.uniform(8.0, 30.0), 5),
+            "longitude": round(rng.uniform(70.0, 88.0), 5),
+            "created_at": "2025-01-01T00:00:00",
+            "doctor_specialties": [{"specialties": {"name": SPECIALTY_NAMES[i % len(SPECIALTY_NAMES)]}}],
+        })
+    return rows
+
+
+class _FakeResult:
+    def __init__(self, data):
+        self.data = data
+        self.count = None
+
+
+class FakeQuery:
+    """Chainable stand-in for a postgrest request builder."""
+
+    def __init__(self, store, table):
+        self._store = store
+        self._table = table
+        self._range = None
+        self._filters = []
+        self._single = False
+        self._insert = None
+
+    def _chain(self, *args, **kwargs):
+        return self
+
+    select = order = limit = ilike = eq = _chain
+
+    def in_(self, column, values):
+        self._filters.append((column, set(values)))
+        return self
+
+    def gte(self, column, value):
+        self._filters.append((column, lambda v: v is not None and v >= value))
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def maybe_single(self):
+        self._single = True
+        return self
+
+    def insert(self, rows, **options):
+        self._insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    upsert = insert
+
+    def _rows(self):
+        if self._insert is not None:
+            self._store.inserted += len(self._insert)
+            return self._insert
+        rows = self._store.tables.get(self._table, [])
+        for column, test in self._filters:
+            if isinstance(test, set):
+                rows = [row for row in rows if row.get(column) in test]
+            else:
+                rows = [row for row in rows if test(row.get(column))]
+        if self._range is not None:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._single:
+            return rows[0] if rows else None
+        return rows
+
+    def execute(self):
+        delay, fail = self._store.profile.draw()
+        time.sleep(delay)
+        if fail:
+            raise FakeServiceError("fake Supabase error")
+        return _FakeResult(self._rows())
+
+
+class FakeAsyncQuery(FakeQuery):
+    async def execute(self):
+        delay, fail = self._store.profile.draw()
+        await asyncio.sleep(delay)
+        if fail:
+            raise FakeServiceError("fake Supabase error")
+        return _FakeResult(self._rows())
+
+
+class FakeSupabase:
+    def __init__(self, profile, roster_size, auth_ids):
+        self.profile = profile
+        self.inserted = 0
+        self.tables = {
+            "doctors": fake_roster(roster_size),
+            "patients": [{"id": i + 1, "auth_id": auth_id} for i, auth_id in enumerate(auth_ids)],
+        }
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeAsyncSupabase(FakeSupabase):
+    def __init__(self, store):
+        self.__dict__ = store.__dict__
+
+    def table(self, name):
+        return FakeAsyncQuery(self, name)
+
+
+# -----------------------------
+# Stage timings
+# -----------------------------
+class StageRecorder:
+    """Collects durations of the wrapped pipeline stages."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+    def wrap(self, stage, fn):
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.add(stage, time.perf_counter() - start)
+            return timed_async
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        with self._lock:
+            return {stage: summarize(samples) for stage, samples in sorted(self.samples.items())}
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "count": len(ordered),
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else None,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else None,
+    }
+
+
+# -----------------------------
+# Environment setup
+# -----------------------------
+def install_fakes(llm_profile, db_profile, roster_size=2000, auth_ids=(), models=2):
+    """Point the API modules at the stand-ins; returns the fake Supabase store."""
+    import google.generativeai as genai
+    from . import admission, auth, db, gemini
+
+    genai.GenerativeModel = fake_model_class(llm_profile)
+    names = [f"models/bench-{i}" for i in range(models)]
+    gemini.registry._list_models = lambda: [_FakeModelInfo(name) for name in names]
+    gemini.registry.refresh(force=True)
+
+    # Tokens are signed with BENCH_JWT_KEY, so verification runs for real
+    auth.authenticator.keys.secret = BENCH_JWT_KEY
+
+    # Synthetic users send far more than a patient would; the LLM gate still applies
+    admission.rate_limiter.limits = {"default": {"RATE": 0, "BURST": 0}}
+
+    store = FakeSupabase(db_profile, roster_size, auth_ids)
+    db._client = store
+    db._client_pid = os.getpid()
+
+    async def fake_async_supabase():
+        return FakeAsyncSupabase(store)
+    db.get_async_supabase = fake_async_supabase
+    return store
+
+
+def instrument(recorder):
+    """Time the pipeline stages of the sync and async views."""
+    from . import async_views, rules, triage, views
+    from .cache import triage_cache
+    from .sessions import session_writer
+
+    triage.extract_patient_info = recorder.wrap("validate", triage.extract_patient_info)
+    rules.local_triage = recorder.wrap("rules", rules.local_triage)
+    triage_cache.get = recorder.wrap("cache_get", triage_cache.get)
+    views.generate_reply = recorder.wrap("llm", views.generate_reply)
+    async_views.generate_reply = recorder.wrap("llm", async_views.generate_reply)
+    views.lookup_doctors = recorder.wrap("doctors", views.lookup_doctors)
+    async_views.lookup_doctors = recorder.wrap("doctors", async_views.lookup_doctors)
+    session_writer.enqueue = recorder.wrap("session_enqueue", session_writer.enqueue)
+
+
+def reset_state():
+    from .auth import authenticator
+    from .cache import triage_cache
+    from .singleflight import flights
+
+    authenticator.clear()
+    triage_cache.backend.clear()
+    triage_cache.hits = triage_cache.misses = 0
+    flights.counters.clear()
+
+
+# -----------------------------
+# Workloads
+# -----------------------------
+class Workload:
+    """Request generator for one scenario: ``next()`` -> (method, path, body, headers)."""
+
+    def __init__(self, scenario, distinct, rule_share, seed, auth_ids):
+        self.scenario = scenario
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._auth_ids = auth_ids
+        # One token per user, reused across requests like a real session
+        expires = int(time.time()) + 3600
+        self._tokens = {
+            auth_id: jwt.encode(
+                {"sub": auth_id, "aud": "authenticated", "role": "authenticated", "exp": expires},
+                BENCH_JWT_KEY, algorithm="HS256",
+            )
+            for auth_id in auth_ids
+        }
+        self._payloads = [self._payload(i, rule_share) for i in range(max(1, distinct))]
+
+    def _payload(self, i, rule_share):
+        rng = self._random
+        symptoms = rng.choice(RULE_SYMPTOMS if rng.random() < rule_share else LLM_SYMPTOMS)
+        return {
+            "symptoms": symptoms,
+            "age": rng.randint(18, 60),
+            "gender": rng.choice(["male", "female"]),
+            "height": rng.randint(150, 190),
+            "weight": rng.randint(50, 95),
+            "location": rng.choice(["Pune", "Mumbai", "Delhi", "Bengaluru"]),
+            "latitude": round(rng.uniform(8.0, 30.0), 4),
+            "longitude": round(rng.uniform(70.0, 88.0), 4),
+        }
+
+    def next(self):
+        with self._lock:
+            payload = self._random.choice(self._payloads)
+            auth_id = self._random.choice(self._auth_ids) if self._auth_ids else None
+        headers = {}
+        if auth_id:
+            headers["authorization"] = f"Bearer {self._tokens[auth_id]}"
+        if self.scenario == "analyze":
+            return "POST", "/api/analyze-symptoms/", payload, headers
+        if self.scenario == "analyze_async":
+            return "POST", "/api/analyze-symptoms/async/", payload, headers
+        if self.scenario == "recommend":
+            disease = self._random.choice(["asthma", "migraine", "diabetes", "unknown"])
+            return "POST", "/api/recommend-doctor/", {"disease": disease}, headers
+        if self.scenario == "doctors":
+            return "GET", (
+                f"/api/doctors/search/?specialty=Cardiologist"
+                f"&latitude={payload['latitude']}&longitude={payload['longitude']}"
+            ), None, headers
+        if self.scenario == "auth":
+            return "AUTH", None, None, headers
+        raise ValueError(f"Unknown scenario: {self.scenario}")
+
+
+SCENARIOS = ["analyze", "analyze_async", "recommend", "doctors", "auth"]
+
+
+# -----------------------------
+# Servers
+# -----------------------------
+def _auth_probe():
+    """``require_auth`` around a trivial view; the auth path is not routed."""
+    from django.http import JsonResponse
+    from django.test import RequestFactory
+    from .auth import require_auth
+
+    view = require_auth(lambda request: JsonResponse({"user": request.user_id}))
+    factory = RequestFactory()
+
+    def call(headers):
+        request = factory.get("/auth-probe", HTTP_AUTHORIZATION=headers.get("authorization", ""))
+        return view(request).status_code
+    return call
+
+
+class WSGIServer:
+    name = "wsgi"
+
+    def __init__(self):
+        from django.core.wsgi import get_wsgi_application
+        self.app = get_wsgi_application()
+        self.auth = _auth_probe()
+
+    def request(self, method, path, body, headers):
+        if method == "AUTH":
+            return self.auth(headers)
+        path, _, query = path.partition("?")
+        raw = json.dumps(body).encode() if body is not None else b""
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(raw)),
+            "wsgi.input": io.BytesIO(raw),
+            "wsgi.errors": sys.stderr,
+            "wsgi.url_scheme": "http",
+            "wsgi.version": (1, 0),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers.items():
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+        status = []
+        chunks = self.app(environ, lambda s, h, exc_info=None: status.append(s))
+        try:
+            for _ in chunks:
+                pass
+        finally:
+            getattr(chunks, "close", lambda: None)()
+        return int(status[0].split()[0])
+
+    def run(self, workload, total, concurrency):
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+
+        def one(_):
+            method, path, body, headers = workload.next()
+            start = time.perf_counter()
+            try:
+                status = self.request(method, path, body, headers)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(total)))
+        return time.perf_counter() - start, latencies, statuses
+
+
+class ASGIServer:
+    name = "asgi"
+
+    def __init__(self):
+        from django.core.asgi import get_asgi_application
+        self.app = get_asgi_application()
+        self.auth = _auth_probe()
+
+    async def request(self, method, path, body, headers):
+        if method == "AUTH":
+            return self.auth(headers)
+        path, _, query = path.partition("?")
+        raw = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "headers": [(b"content-type", b"application/json"), (b"host", b"localhost")]
+            + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("localhost", 80),
+        }
+        sent = False
+        status = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": raw, "more_body": False}
+            # Park until the response is done, as a connected client would
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        await self.app(scope, receive, send)
+        return status[0]
+
+    def run(self, workload, total, concurrency):
+        return asyncio.run(self._run(workload, total, concurrency))
+
+    async def _run(self, workload, total, concurrency):
+        latencies, statuses = [], {}
+        remaining = iter(range(total))
+
+        async def worker():
+            for _ in remaining:
+                method, path, body, headers = workload.next()
+                start = time.perf_counter()
+                try:
+                    status = await self.request(method, path, body, headers)
+                except Exception as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies, statuses
+
+
+SERVERS = {"wsgi": WSGIServer, "asgi": ASGIServer}
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(servers, scenarios, concurrency_levels, requests, llm_profile, db_profile,
+                  distinct=50, rule_share=0.3, roster_size=2000, users=100, seed=0, log=print):
+    """Run every server x scenario x concurrency combination; returns the report dict."""
+    from . import singleflight
+    from .cache import triage_cache
+    from .directory import directory
+
+    auth_ids = [f"bench-user-{i}" for i in range(users)]
+    install_fakes(llm_profile, db_profile, roster_size, auth_ids)
+    recorder = StageRecorder()
+    instrument(recorder)
+    directory.load()
+
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": {
+            "requests": requests,
+            "concurrency": concurrency_levels,
+            "distinct_payloads": distinct,
+            "rule_share": rule_share,
+            "roster_size": roster_size,
+            "users": users,
+            "seed": seed,
+            "llm": llm_profile.as_dict(),
+            "db": db_profile.as_dict(),
+        },
+        "runs": [],
+    }
+    for server_name in servers:
+        server = SERVERS[server_name]()
+        for scenario in scenarios:
+            for concurrency in concurrency_levels:
+                reset_state()
+                recorder.reset()
+                workload = Workload(scenario, distinct, rule_share, seed, auth_ids)
+                elapsed, latencies, statuses = server.run(workload, requests, concurrency)
+                run = {
+                    "server": server_name,
+                    "scenario": scenario,
+                    "concurrency": concurrency,
+                    "requests": len(latencies),
+                    "elapsed_s": round(elapsed, 3),
+                    "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+                    "latency": summarize(latencies),
+                    "statuses": statuses,
+                    "stages": recorder.summary(),
+                    "cache": triage_cache.stats(),
+                    "coalescing": singleflight.flights.stats(),
+                }
+                report["runs"].append(run)
+                log(
+                    f"{server_name:5} {scenario:14} c={concurrency:<4} "
+                    f"{run['throughput_rps']:>9} req/s  p50={run['latency']['p50_ms']}ms "
+                    f"p95={run['latency']['p95_ms']}ms p99={run['latency']['p99_ms']}ms {statuses}"
+                )
+    return report
+
+
+def compare(report, baseline):
+    """Lines describing p95 and throughput changes against ``baseline``."""
+    previous = {
+        (run["server"], run["scenario"], run["concurrency"]): run for run in baseline.get("runs", [])
+    }
+    lines = []
+    for run in report["runs"]:
+        old = previous.get((run["server"], run["scenario"], run["concurrency"]))
+        if not old or not old["latency"]["p95_ms"] or not old["throughput_rps"]:
+            continue
+        p95 = (run["latency"]["p95_ms"] - old["latency"]["p95_ms"]) / old["latency"]["p95_ms"] * 100
+        rps = (run["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] * 100
+        lines.append(
+            f"{run['server']:5} {run['scenario']:14} c={run['concurrency']:<4} "
+            f"p95 {p95:+.1f}%  throughput {rps:+.1f}%"
+        )
+    return lines
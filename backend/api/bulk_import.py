@@ -0,0 +1,482 @@
+"""
+Bulk import of doctors, patients and specialties (``manage.py import_records``).
+
+Records are streamed from CSV or NDJSON and never held in memory all at
+once. They move through a pipeline one batch at a time:
+
+1. read and validate against the kind's schema. Rejected records go to the
+   rejects file with their record number and errors.
+2. drop duplicates. Django usernames and emails, and the emails already in
+   the Supabase table (people who signed up through Supabase auth have a
+   row there but no Django user), are fetched once into sets at the start,
+   and every imported record is added to them, so checking a record is a
+   set lookup and not a query.
+3. hash passwords in a process pool (``HASH_WORKERS``). PBKDF2 is the slow
+   part, so batch N+1 is hashed while batch N is being written.
+4. write: one upsert per batch into the Supabase table, keyed on ``email``
+   (``name`` for specialties), then doctor_specialties for doctors, then one
+   ``bulk_create`` of the Django users in a transaction. A row only carries
+   the columns its record gave, so an upsert never blanks a column the file
+   did not mention.
+
+After each written batch the position is saved to a checkpoint file, and
+``resume`` continues after the last completed batch. The Supabase upserts
+are idempotent and the Django users are written last, so a batch that was
+interrupted half way can simply be written again.
+
+Records that already have a Django user or a row in the table are skipped
+unless ``update`` is set. With ``update``, they are upserted instead, and a
+doctor whose record lists specialties gets exactly those: links to other
+specialties are deleted. ``password_hash`` (an already encoded Django hash)
+is used as-is, with no hashing. A record with neither a password nor a hash
+gets an unusable password.
+"""
+import csv
+import functools
+import gzip
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+
+from . import codec, db, specialties
+from .schema import Any, Boolean, Email, Integer, Number, Schema, String
+
+DEFAULTS = {
+    "BATCH_SIZE": 1000,
+    # Processes hashing passwords; None means one per CPU
+    "HASH_WORKERS": None,
+    "HASH_CHUNK": 16,
+    # Rows per select when reading the emails already in the table
+    "SCAN_CHUNK": 5000,
+}
+config = {**DEFAULTS, **getattr(settings, "BULK_IMPORT", {})}
+
+FORMATS = ("csv", "ndjson")
+
+SPECIALTY_SEPARATORS = re.compile(r"[;|]")
+
+IDENTITY_FIELDS = dict(
+    email=Email(required=True, required_message="email is required."),
+    username=String(max_length=150),
+    password=String(strip=False),
+    password_hash=String(strip=False),
+    auth_id=String(max_length=64),
+)
+
+DOCTOR_SCHEMA = Schema(
+    **IDENTITY_FIELDS,
+    full_name=String(required=True, max_length=200),
+    phone=String(max_length=30),
+    specialization=String(max_length=200),
+    specialties=Any(types=(str, list)),
+    qualification=String(max_length=500),
+    experience=Integer(ge=0, le=80),
+    clinic_name=String(max_length=200),
+    location=String(max_length=500),
+    consultation_fee=Number(ge=0),
+    latitude=Number(ge=-90, le=90),
+    longitude=Number(ge=-180, le=180),
+    home_visits=Boolean(),
+    bio=String(),
+)
+
+PATIENT_SCHEMA = Schema(
+    **IDENTITY_FIELDS,
+    full_name=String(required=True, max_length=200),
+    phone=String(max_length=30),
+    address=String(max_length=500),
+    latitude=Number(ge=-90, le=90),
+    longitude=Number(ge=-180, le=180),
+)
+
+SPECIALTY_SCHEMA = Schema(
+    name=String(required=True, max_length=200),
+)
+
+
+class Kind:
+    """What one record type imports into."""
+
+    def __init__(self, schema, table, columns, on_conflict, users):
+        self.schema = schema
+        self.table = table
+        self.columns = columns  # Supabase columns taken from the record
+        self.on_conflict = on_conflict
+        self.users = users  # whether records also get a Django user
+
+
+KINDS = {
+    "doctors": Kind(
+        DOCTOR_SCHEMA, "doctors",
+        ("auth_id", "email", "full_name", "phone", "specialization", "qualification", "experience",
+         "clinic_name", "location", "consultation_fee", "latitude", "longitude", "home_visits", "bio"),
+        "email", users=True,
+    ),
+    "patients": Kind(
+        PATIENT_SCHEMA, "patients",
+        ("auth_id", "email", "full_name", "phone", "address", "latitude", "longitude"),
+        "email", users=True,
+    ),
+    "specialties": Kind(SPECIALTY_SCHEMA, "specialties", ("name",), "name", users=False),
+}
+
+
+# -----------------------------
+# Reading
+# -----------------------------
+def detect_format(path):
+    name = path.lower().removesuffix(".gz")
+    return "csv" if name.endswith(".csv") else "ndjson"
+
+
+def _open(path):
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def read_records(path, fmt=None):
+    """``(number, record or None)`` for each record in the file, 1-based.
+
+    A line that is not valid JSON comes back as ``None`` so it can be
+    reported without stopping the import.
+    """
+    fmt = fmt or detect_format(path)
+    with _open(path) as f:
+        if fmt == "csv":
+            for number, row in enumerate(csv.DictReader(f), 1):
+                # An empty cell means the column was not given
+                yield number, {name: value for name, value in row.items() if value not in ("", None)}
+            return
+        number = 0
+        for line in f:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                record = codec.loads(line)
+            except codec.DecodeError:
+                record = None
+            yield number, record if isinstance(record, dict) else None
+
+
+def specialty_names(values):
+    names = values["specialties"] or values.get("specialization") or []
+    if isinstance(names, str):
+        names = SPECIALTY_SEPARATORS.split(names)
+    cleaned = []
+    for name in names:
+        name = str(name).strip()
+        if name:
+            name = specialties.canonical_name(name) or name
+            if name not in cleaned:
+                cleaned.append(name)
+    return cleaned
+
+
+# -----------------------------
+# Password hashing (in worker processes)
+# -----------------------------
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _hash(password, hasher):
+    return make_password(password, hasher=hasher)
+
+
+def valid_hash(encoded):
+    try:
+        identify_hasher(encoded)
+    except ValueError:
+        return False
+    return True
+
+
+# -----------------------------
+# Checkpoints
+# -----------------------------
+def load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, state):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temporary, path)
+
+
+# -----------------------------
+# Import
+# -----------------------------
+class Batch:
+    def __init__(self):
+        self.entries = []  # validated values with "username"
+        self.last = 0  # number of the last record read into this batch
+        self.invalid = 0
+        self.duplicates = 0
+        self.hashes = None  # iterator of encoded passwords, in entry order
+
+
+class Importer:
+    def __init__(self, kind, client_factory=db.get_supabase, batch_size=None, update=False,
+                 workers=None, hasher="default", log=None, rejects=None):
+        self.name = kind
+        self.kind = KINDS[kind]
+        self._client_factory = client_factory
+        self.batch_size = int(batch_size or config["BATCH_SIZE"])
+        self.update = update
+        self.workers = workers if workers is not None else config["HASH_WORKERS"]
+        self.hasher = hasher
+        self.log = log or (lambda line: None)
+        self.rejects = rejects  # file object for rejected records, or None
+        self.usernames = set()
+        self.emails = {}  # email -> username
+        self.rows = set()  # emails with a row in the Supabase table
+        self.names = set()  # specialty names seen in this file
+        self._specialty_ids = None  # name -> id
+        self.counters = {"read": 0, "imported": 0, "duplicates": 0, "invalid": 0}
+
+    # Existing Django users and table rows, fetched once
+    def load_existing(self):
+        from django.contrib.auth.models import User
+        for username, email in User.objects.values_list("username", "email").iterator(chunk_size=5000):
+            self.usernames.add(username)
+            if email:
+                self.emails.setdefault(email.lower(), username)
+        for rows in self._table_emails():
+            self.rows.update(row["email"].lower() for row in rows if row.get("email"))
+
+    def _table_emails(self):
+        """Chunks of ``{id, email}`` rows of the kind's table, in ``id`` order."""
+        client = self._client_factory()
+        chunk_size = int(config["SCAN_CHUNK"])
+        last_id = None
+        while True:
+            query = client.table(self.kind.table).select("id, email")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            rows = db.execute(query.order("id").limit(chunk_size)).data or []
+            if rows:
+                yield rows
+                last_id = rows[-1]["id"]
+            if len(rows) < chunk_size:
+                return
+
+    def _reject(self, number, errors):
+        if self.rejects is not None:
+            self.rejects.write(codec.dumps({"record": number, "errors": errors}).decode() + "\n")
+
+    def _accept(self, values):
+        """``True`` if the record is new, or an update of its own user; records it as seen."""
+        if not self.kind.users:
+            key = values["name"].lower()
+            if key in self.names:
+                return False
+            self.names.add(key)
+            return True
+        email = values["email"]
+        username = values["username"] = values["username"] or email[:150]
+        owner = self.emails.get(email)
+        if owner is not None and owner != username:
+            return False  # the address belongs to someone else
+        if not self.update and (username in self.usernames or email in self.rows):
+            return False
+        self.usernames.add(username)
+        self.emails[email] = username
+        self.rows.add(email)
+        return True
+
+    def batches(self, records, after=0):
+        """Validated, de-duplicated batches of at most ``batch_size`` records."""
+        batch = Batch()
+        for number, record in records:
+            if number <= after:
+                continue
+            batch.last = number
+            if record is None:
+                batch.invalid += 1
+                self._reject(number, {"record": "Not a JSON object."})
+            else:
+                values, errors = self.kind.schema.validate(record)
+                if errors is None and values.get("password_hash") and not valid_hash(values["password_hash"]):
+                    errors = {"password_hash": "password_hash is not a Django password hash."}
+                if errors:
+                    batch.invalid += 1
+                    self._reject(number, errors)
+                elif not self._accept(values):
+                    batch.duplicates += 1
+                else:
+                    values["given"] = [column for column in self.kind.columns if column in record]
+                    batch.entries.append(values)
+            if len(batch.entries) >= self.batch_size:
+                yield batch
+                batch = Batch()
+        if batch.last:
+            yield batch
+
+    def _submit_hashes(self, pool, batch):
+        if not self.kind.users:
+            return
+        to_hash = [values["password"] for values in batch.entries
+                   if values["password"] and not values["password_hash"]]
+        batch.hashes = iter(())
+        if to_hash:
+            batch.hashes = pool.map(
+                functools.partial(_hash, hasher=self.hasher), to_hash, chunksize=int(config["HASH_CHUNK"]),
+            )
+
+    # -----------------------------
+    # Writing
+    # -----------------------------
+    def specialty_ids(self, names):
+        """``{name: id}`` for ``names``, creating the missing specialties."""
+        client = self._client_factory()
+        if self._specialty_ids is None:
+            rows = db.execute(client.table("specialties").select("id, name")).data or []
+            self._specialty_ids = {row["name"]: row["id"] for row in rows}
+        missing = [name for name in names if name not in self._specialty_ids]
+        if missing:
+            query = client.table("specialties").upsert([{"name": name} for name in missing], on_conflict="name")
+            for row in db.execute(query).data or []:
+                self._specialty_ids[row["name"]] = row["id"]
+        return {name: self._specialty_ids[name] for name in names if name in self._specialty_ids}
+
+    def _write_rows(self, batch):
+        client = self._client_factory()
+        # PostgREST wants the same keys in every row of an upsert, so rows
+        # are grouped by the columns their records gave
+        groups = {}
+        for values in batch.entries:
+            row = {column: values[column] for column in values["given"]}
+            row[self.kind.on_conflict] = values[self.kind.on_conflict]
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        written = []
+        for rows in groups.values():
+            query = client.table(self.kind.table).upsert(rows, on_conflict=self.kind.on_conflict)
+            written += db.execute(query).data or []
+        if self.name != "doctors":
+            return
+        doctor_ids = {row["email"]: row["id"] for row in written}
+        wanted = {values["email"]: specialty_names(values) for values in batch.entries}
+        ids = self.specialty_ids(sorted({name for names in wanted.values() for name in names}))
+        links = [
+            {"doctor_id": doctor_ids[email], "specialty_id": ids[name]}
+            for email, names in wanted.items() if email in doctor_ids
+            for name in names if name in ids
+        ]
+        if self.update:
+            self._drop_stale_links(client, doctor_ids, wanted, links)
+        if links:
+            query = client.table("doctor_specialties").upsert(links, on_conflict="doctor_id,specialty_id")
+            db.execute(query)
+
+    def _drop_stale_links(self, client, doctor_ids, wanted, links):
+        """Delete the links of updated doctors to specialties their record no longer lists."""
+        listed = [doctor_ids[email] for email, names in wanted.items() if names and email in doctor_ids]
+        if not listed:
+            return
+        keep = {(link["doctor_id"], link["specialty_id"]) for link in links}
+        query = client.table("doctor_specialties").select("doctor_id, specialty_id").in_("doctor_id", listed)
+        for row in db.execute(query).data or []:
+            if (row["doctor_id"], row["specialty_id"]) not in keep:
+                query = (client.table("doctor_specialties").delete()
+                         .eq("doctor_id", row["doctor_id"]).eq("specialty_id", row["specialty_id"]))
+                db.execute(query)
+
+    def _write_users(self, batch):
+        from django.contrib.auth.models import User
+        from django.db import transaction
+
+        users = []
+        for values in batch.entries:
+            if values["password_hash"]:
+                password = values["password_hash"]
+            elif values["password"]:
+                password = next(batch.hashes)
+            else:
+                password = make_password(None)
+            first_name, _, last_name = values["full_name"].partition(" ")
+            users.append(User(
+                username=values["username"], email=values["email"], password=password,
+                first_name=first_name[:150], last_name=last_name[:150],
+            ))
+        options = {"ignore_conflicts": True}
+        if self.update:
+            options = {
+                "update_conflicts": True,
+                "unique_fields": ["username"],
+                "update_fields": ["email", "password", "first_name", "last_name"],
+            }
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=self.batch_size, **options)
+
+    def write(self, batch):
+        if batch.entries:
+            self._write_rows(batch)
+            if self.kind.users:
+                self._write_users(batch)
+        self.counters["read"] = batch.last
+        self.counters["imported"] += len(batch.entries)
+        self.counters["duplicates"] += batch.duplicates
+        self.counters["invalid"] += batch.invalid
+
+    # -----------------------------
+    # Driver
+    # -----------------------------
+    def run(self, records, checkpoint=None, resume=False, source=None):
+        """Import ``records``; returns the counters."""
+        after = 0
+        if resume and checkpoint:
+            state = load_checkpoint(checkpoint)
+            if state is not None:
+                if state.get("kind") != self.name or state.get("source") != source:
+                    raise ValueError(f"{checkpoint} is a checkpoint for another import")
+                after = state["read"]
+                self.counters.update(state["counters"])
+                self.log(f"Resuming {self.name} after record {after}")
+        if self.kind.users:
+            self.load_existing()
+
+        started = time.monotonic()
+        resumed_at = self.counters["read"]
+        pool = ProcessPoolExecutor(self.workers, initializer=_init_worker) if self.kind.users else None
+        try:
+            pending = None
+            for batch in self.batches(records, after):
+                self._submit_hashes(pool, batch)
+                # The next batch hashes while this one is written
+                if pending is not None:
+                    self._finish(pending, checkpoint, source, started, resumed_at)
+                pending = batch
+            if pending is not None:
+                self._finish(pending, checkpoint, source, started, resumed_at)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return dict(self.counters)
+
+    def _finish(self, batch, checkpoint, source, started, resumed_at):
+        self.write(batch)
+        if checkpoint:
+            save_checkpoint(checkpoint, {
+                "kind": self.name, "source": source, "read": batch.last, "counters": self.counters,
+            })
+        elapsed = max(time.monotonic() - started, 1e-9)
+        counters = self.counters
+        self.log(
+            f"{self.name}: {counters['read']} read, {counters['imported']} imported, "
+            f"{counters['duplicates']} duplicate, {counters['invalid']} invalid "
+            f"({(counters['read'] - resumed_at) / elapsed:.0f} records/s)"
+        )
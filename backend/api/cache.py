@@ -0,0 +1,210 @@
+"""
+Result cache in front of the Gemini triage step.
+
+Requests are keyed on a canonical form of what the prompt actually uses:
+the deduplicated, sorted symptom set, an age band, a BMI class, gender,
+region and month. Near-identical requests (same complaint, same season,
+same city) then share one generation.
+
+The backend is chosen by ``settings.TRIAGE_CACHE["BACKEND"]``: ``"local"``
+keeps an in-process LRU with TTL per worker, ``"django"`` stores entries in
+the Django cache named by ``"ALIAS"`` so workers can share them.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+
+from . import codec
+
+DEFAULTS = {
+    "BACKEND": "local",
+    "TTL": 6 * 3600,
+    "MAX_ENTRIES": 5000,
+    "ALIAS": "default",
+}
+
+AGE_BANDS = [(5, "0-4"), (13, "5-12"), (18, "13-17"), (40, "18-39"), (60, "40-59")]
+
+_SYMPTOM_SPLIT = re.compile(r",|;|\band\b|\n")
+_SPACES = re.compile(r"\s+")
+
+
+# -----------------------------
+# Canonical key
+# -----------------------------
+def normalize_symptoms(symptoms):
+    if isinstance(symptoms, str):
+        parts = _SYMPTOM_SPLIT.split(symptoms.lower())
+    else:
+        parts = [str(s).lower() for s in symptoms or []]
+    return sorted({_SPACES.sub(" ", p).strip(" .") for p in parts} - {""})
+
+
+def age_band(age):
+    try:
+        age = int(age)
+    except (ValueError, TypeError):
+        return "unknown"
+    for upper, label in AGE_BANDS:
+        if age < upper:
+            return label
+    return "60+"
+
+
+def bmi_class(bmi):
+    if bmi is None:
+        return "unknown"
+    if bmi < 18.5:
+        return "underweight"
+    if bmi < 25:
+        return "normal"
+    if bmi < 30:
+        return "overweight"
+    return "obese"
+
+
+def region(location):
+    if not location:
+        return "unknown"
+    return _SPACES.sub(" ", str(location).lower()).strip()
+
+
+def cache_key(info, today=None):
+    today = today or datetime.today()
+    parts = [
+        ",".join(normalize_symptoms(info.get("normalized_symptoms") or info["symptoms"])),
+        age_band(info["age"]),
+        bmi_class(info["bmi"]),
+        (info["gender"] or "unknown").lower(),
+        region(info["location"]),
+        str(today.month),
+    ]
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+    return f"triage:{digest}"
+
+
+# -----------------------------
+# Backends
+# -----------------------------
+class LocalBackend:
+    """Thread-safe in-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCacheBackend:
+    """Stores entries in a Django cache; eviction is left to that cache."""
+
+    def __init__(self, alias):
+        from django.core.cache import caches
+        self._cache = caches[alias]
+        self.evictions = None
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, timeout=ttl)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return 0
+
+
+# -----------------------------
+# Cache
+# -----------------------------
+class TriageCache:
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        config = {**DEFAULTS, **getattr(settings, "TRIAGE_CACHE", {})}
+        if config["BACKEND"] == "django":
+            backend = DjangoCacheBackend(config["ALIAS"])
+        elif config["BACKEND"] == "local":
+            backend = LocalBackend(int(config["MAX_ENTRIES"]))
+        else:
+            raise ValueError(f"Unknown TRIAGE_CACHE backend: {config['BACKEND']}")
+        return cls(backend, int(config["TTL"]))
+
+    def get(self, info):
+        """Cached reply for ``info`` (a fresh copy), or ``None``."""
+        value = self.backend.get(cache_key(info))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return codec.loads(value)
+
+    def set(self, info, reply_json):
+        # Unparsed model output (no specialist) is not worth replaying
+        if not isinstance(reply_json, dict) or not reply_json.get("doctor_recommendation"):
+            return
+        self.backend.set(cache_key(info), codec.dumps(reply_json), self.ttl)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else None,
+            "evictions": self.backend.evictions,
+        }
+
+
+triage_cache = TriageCache.from_settings()
@@ -0,0 +1,74 @@
+"""
+JSON encoding and decoding for the API.
+
+Request bodies, responses, SSE events, cached replies and spooled sessions
+all go through ``loads`` / ``dumps`` here. With ``orjson`` installed (and
+``settings.JSON_CODEC["BACKEND"]`` left at ``"auto"``) they use it, which
+matters for batch replies and long ``recommended_doctors`` lists; otherwise
+the standard library is used. Values the codec cannot encode natively
+(``Decimal``, ``UUID``, lazy translations, ...) are rendered as Django's
+``DjangoJSONEncoder`` would.
+
+``JsonResponse`` is a drop-in replacement for ``django.http.JsonResponse``.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+DEFAULTS = {
+    "BACKEND": "auto",  # "auto", "orjson" or "json"
+}
+config = {**DEFAULTS, **getattr(settings, "JSON_CODEC", {})}
+
+# Both backends raise this (orjson's error subclasses it)
+DecodeError = json.JSONDecodeError
+
+_django_encoder = DjangoJSONEncoder()
+
+
+def _backend():
+    name = config["BACKEND"]
+    if name == "auto":
+        return "orjson" if orjson is not None else "json"
+    if name == "orjson" and orjson is None:
+        raise ImportError("JSON_CODEC BACKEND is 'orjson' but orjson is not installed")
+    return name
+
+
+BACKEND = _backend()
+
+if BACKEND == "orjson":
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(data):
+        """``data`` as UTF-8 JSON bytes."""
+        return orjson.dumps(data, default=_django_encoder.default, option=_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(data):
+        """``data`` as UTF-8 JSON bytes."""
+        return json.dumps(data, cls=DjangoJSONEncoder).encode("utf-8")
+
+    loads = json.loads
+
+
+def dumps_str(data):
+    return dumps(data).decode("utf-8")
+
+
+class JsonResponse(HttpResponse):
+    """``django.http.JsonResponse`` rendered with the configured codec."""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,211 @@
+"""
+Shared Supabase access for the API views.
+
+Every view, background writer and index goes through ``get_supabase()`` /
+``get_async_supabase()`` instead of building its own client. The clients
+sit on an explicitly configured httpx pool (keep-alive connections,
+connect/read/write/pool timeouts from ``settings.SUPABASE_CLIENT``), so a
+hung Supabase call fails after ``READ_TIMEOUT`` instead of holding a worker
+forever. ``execute()`` retries idempotent reads a bounded number of times on
+transport errors.
+
+Stable lookups such as ``auth_id`` -> ``patients.id`` are kept in an LRU and
+can be invalidated per key.
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+from dotenv import load_dotenv
+from supabase import create_client, acreate_client
+from supabase.lib.client_options import SyncClientOptions, AsyncClientOptions
+
+from .cache import LocalBackend
+
+load_dotenv()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
+
+DEFAULTS = {
+    "CONNECT_TIMEOUT": 3.0,
+    "READ_TIMEOUT": 10.0,
+    "WRITE_TIMEOUT": 10.0,
+    "POOL_TIMEOUT": 3.0,
+    "MAX_CONNECTIONS": 20,
+    "MAX_KEEPALIVE": 10,
+    "KEEPALIVE_EXPIRY": 30.0,
+    "RETRIES": 2,
+    "RETRY_BACKOFF": 0.2,
+    "LOOKUP_CACHE_SIZE": 10000,
+    "LOOKUP_CACHE_TTL": 3600,
+}
+config = {**DEFAULTS, **getattr(settings, "SUPABASE_CLIENT", {})}
+
+
+def _timeout():
+    return httpx.Timeout(
+        connect=config["CONNECT_TIMEOUT"],
+        read=config["READ_TIMEOUT"],
+        write=config["WRITE_TIMEOUT"],
+        pool=config["POOL_TIMEOUT"],
+    )
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=config["MAX_CONNECTIONS"],
+        max_keepalive_connections=config["MAX_KEEPALIVE"],
+        keepalive_expiry=config["KEEPALIVE_EXPIRY"],
+    )
+
+
+# -----------------------------
+# Clients
+# -----------------------------
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_supabase():
+    """The worker's Supabase client, created on first use.
+
+    Connection pools must not be shared across a fork, so a gunicorn worker
+    forked from a preloaded master builds its own.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            http = httpx.Client(
+                timeout=_timeout(),
+                # Reconnect on refused/reset connections; safe for any request
+                transport=httpx.HTTPTransport(retries=1, limits=_limits()),
+                follow_redirects=True,
+            )
+            _client = create_client(
+                SUPABASE_URL, SUPABASE_ANON_KEY,
+                options=SyncClientOptions(httpx_client=http),
+            )
+            _client_pid = pid
+    return _client
+
+
+# The async client owns an httpx.AsyncClient bound to the loop it was created
+# on, so there is one per running loop. Under ASGI that is one per worker;
+# under WSGI async_to_sync runs each request on its own short-lived loop.
+# Each client's pool is closed when its loop shuts down: asyncio.run (which
+# both uvicorn and async_to_sync use) cancels the tasks still pending and
+# waits for them, so ``_close_on_shutdown`` gets to run on the right loop.
+_async_clients = weakref.WeakKeyDictionary()
+_closers = set()
+
+
+async def _close_on_shutdown(loop, http):
+    try:
+        await asyncio.Event().wait()
+    finally:
+        _async_clients.pop(loop, None)
+        await http.aclose()
+
+
+async def get_async_supabase():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is not None:
+        return client
+    http = httpx.AsyncClient(
+        timeout=_timeout(),
+        transport=httpx.AsyncHTTPTransport(retries=1, limits=_limits()),
+        follow_redirects=True,
+    )
+    client = await acreate_client(
+        SUPABASE_URL, SUPABASE_ANON_KEY,
+        options=AsyncClientOptions(httpx_client=http),
+    )
+    if loop in _async_clients:
+        # Another request on this loop built one while we awaited
+        await http.aclose()
+        return _async_clients[loop]
+    _async_clients[loop] = client
+    closer = loop.create_task(_close_on_shutdown(loop, http))
+    _closers.add(closer)
+    closer.add_done_callback(_closers.discard)
+    return client
+
+
+# -----------------------------
+# Bounded retries
+# -----------------------------
+def execute(query, retries=None):
+    """``query.execute()``, retried on transport errors and timeouts.
+
+    Only pass ``retries`` > 0 for idempotent requests (selects); inserts
+    should use ``retries=0``.
+    """
+    retries = config["RETRIES"] if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return query.execute()
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            time.sleep(config["RETRY_BACKOFF"] * (2 ** attempt))
+
+
+async def execute_async(query, retries=None):
+    retries = config["RETRIES"] if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return await query.execute()
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(config["RETRY_BACKOFF"] * (2 ** attempt))
+
+
+# -----------------------------
+# Cached lookups
+# -----------------------------
+lookups = LocalBackend(int(config["LOOKUP_CACHE_SIZE"]))
+
+
+def _patient_key(auth_id):
+    return f"patient:{auth_id}"
+
+
+def patient_ids_for(auth_ids):
+    """``{auth_id: patient_id}`` for the given auth ids, one query for misses.
+
+    Only found patients are cached, so a profile created later is picked up
+    on the next lookup.
+    """
+    found, missing = {}, []
+    for auth_id in set(auth_ids):
+        patient_id = lookups.get(_patient_key(auth_id))
+        if patient_id is None:
+            missing.append(auth_id)
+        else:
+            found[auth_id] = patient_id
+    if missing:
+        query = get_supabase().table("patients").select("id, auth_id").in_("auth_id", missing)
+        for row in execute(query).data or []:
+            found[row["auth_id"]] = row["id"]
+            lookups.set(_patient_key(row["auth_id"]), row["id"], config["LOOKUP_CACHE_TTL"])
+    return found
+
+
+def patient_id_for(auth_id):
+    if not auth_id:
+        return None
+    return patient_ids_for([auth_id]).get(auth_id)
+
+
+def invalidate_patient(auth_id):
+    lookups.delete(_patient_key(auth_id))
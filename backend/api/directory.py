@@ -0,0 +1,378 @@
+"""
+In-memory doctor directory for the API process.
+
+The roster changes rarely, so instead of running the nested
+``doctor_specialties!inner(specialties!inner(name))`` join with an ``ilike``
+scan on every triage, the whole roster is loaded in bulk once per worker and
+kept keyed by canonical specialty id (see ``specialties.py``), each list
+already sorted by experience.
+
+Only the fields returned to clients are kept, as namedtuples: the triage
+reply's ``DOCTOR_FIELDS`` plus the ``LISTING_FIELDS`` that ``/api/doctors/``
+can project. ``browse()`` pages through a specialty (or the whole roster)
+in ``sort_key`` order from a keyset cursor, so a page costs a bisect plus
+the entries it looks at, however deep the client has scrolled. Fee and
+distance filters skip entries rather than narrowing an index, so a page
+looks at no more than ``MAX_SCAN`` of them and may come back short, with a
+cursor to carry on from. Reads never
+block on a refresh: when the index is older than ``REFRESH_INTERVAL`` a
+background thread pulls rows whose ``CHANGE_FIELD`` moved past the last
+watermark and swaps in updated lists; a full reload every
+``FULL_RELOAD_INTERVAL`` picks up edits and removals.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from . import db, geo, metrics, specialties
+from .geo import GeoGrid
+from .triage import DOCTOR_FIELDS
+
+DEFAULTS = {
+    "REFRESH_INTERVAL": 300,
+    "FULL_RELOAD_INTERVAL": 3600,
+    "CHANGE_FIELD": "created_at",
+    "PAGE_SIZE": 1000,
+    "GEO_CELL_DEG": 0.05,
+    "MAX_SCAN": 2000,
+}
+
+# Extra columns kept for the doctor listing (not part of triage replies)
+LISTING_FIELDS = ("specialization", "qualification", "location", "profile_photo", "home_visits")
+
+DoctorEntry = namedtuple("DoctorEntry", ("id",) + DOCTOR_FIELDS + LISTING_FIELDS + ("specialties",))
+
+_SPACES = re.compile(r"\s+")
+
+
+def specialty_key(name):
+    return _SPACES.sub(" ", str(name or "")).strip().lower()
+
+
+def specialty_keys(name):
+    """Canonical ids for ``name``; unrecognised names keep their own key."""
+    ids = specialties.normalize(name)
+    if ids:
+        return ids
+    key = specialty_key(name)
+    return (key,) if key else ()
+
+
+def _experience(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def _fee(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def sort_key(entry):
+    # Most experienced first, id as a stable tie-breaker
+    return (-_experience(entry.experience), str(entry.id))
+
+
+def entry_from_row(row):
+    names = []
+    for link in row.get("doctor_specialties") or []:
+        specialty = (link or {}).get("specialties") or {}
+        for key in specialty_keys(specialty.get("name")):
+            if key not in names:
+                names.append(key)
+    return DoctorEntry(
+        row.get("id"),
+        *(row.get(field) for field in DOCTOR_FIELDS + LISTING_FIELDS),
+        tuple(names),
+    )
+
+
+def entry_as_dict(entry):
+    return {field: getattr(entry, field) for field in DOCTOR_FIELDS}
+
+
+class DoctorDirectory:
+    def __init__(self, client_factory, config=None):
+        self._client_factory = client_factory
+        self.config = {**DEFAULTS, **(config or {})}
+        self._by_id = {}
+        self._by_specialty = {}  # specialty key -> [DoctorEntry] sorted by sort_key
+        self._all = []  # every DoctorEntry, sorted by sort_key
+        self._grids = {}  # specialty keys -> GeoGrid, built on first nearby search
+        self._watermark = None
+        self._loaded_at = None
+        self._full_loaded_at = None
+        self._load_lock = threading.Lock()
+        self._background_lock = threading.Lock()
+
+    # -----------------------------
+    # Loading
+    # -----------------------------
+    def _select(self):
+        fields = ", ".join(("id",) + DOCTOR_FIELDS + LISTING_FIELDS + (self.config["CHANGE_FIELD"],))
+        return f"{fields}, doctor_specialties(specialties(name))"
+
+    def _fetch(self, since=None):
+        """All doctor rows (or those changed since ``since``), page by page."""
+        client = self._client_factory()
+        change_field = self.config["CHANGE_FIELD"]
+        page_size = int(self.config["PAGE_SIZE"])
+        rows, start = [], 0
+        while True:
+            query = client.table("doctors").select(self._select())
+            if since is not None:
+                query = query.gte(change_field, since)
+            page = db.execute(query.order("id").range(start, start + page_size - 1)).data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+            start += page_size
+
+    def _advance_watermark(self, rows):
+        change_field = self.config["CHANGE_FIELD"]
+        stamps = [row[change_field] for row in rows if row.get(change_field)]
+        if stamps:
+            newest = max(stamps)
+            if self._watermark is None or newest > self._watermark:
+                self._watermark = newest
+
+    def load(self):
+        """Full reload of the roster."""
+        rows = self._fetch()
+        by_id = {}
+        by_specialty = {}
+        for row in rows:
+            entry = entry_from_row(row)
+            by_id[entry.id] = entry
+            for key in entry.specialties:
+                by_specialty.setdefault(key, []).append(entry)
+        for entries in by_specialty.values():
+            entries.sort(key=sort_key)
+        self._watermark = None
+        self._advance_watermark(rows)
+        self._swap(by_id, by_specialty)
+        self._loaded_at = self._full_loaded_at = time.monotonic()
+
+    def apply_changes(self, rows):
+        """Merge changed rows into copies of the affected lists, then swap."""
+        by_id = dict(self._by_id)
+        by_specialty = dict(self._by_specialty)
+        copied = set()
+        changed = False
+        for row in rows:
+            entry = entry_from_row(row)
+            old = by_id.get(entry.id)
+            if entry == old:
+                continue
+            for key in set(old.specialties if old else ()) | set(entry.specialties):
+                if key not in copied:
+                    by_specialty[key] = list(by_specialty.get(key, ()))
+                    copied.add(key)
+                if old is not None and key in old.specialties:
+                    by_specialty[key].remove(old)
+                if key in entry.specialties:
+                    bisect.insort(by_specialty[key], entry, key=sort_key)
+            by_id[entry.id] = entry
+            changed = True
+        self._advance_watermark(rows)
+        if changed:
+            self._swap(by_id, by_specialty)
+
+    def _swap(self, by_id, by_specialty):
+        # Grids for specialties that were being searched are rebuilt here,
+        # on the refreshing thread, rather than by the next request
+        warm = list(self._grids)
+        self._all = sorted(by_id.values(), key=sort_key)
+        self._by_id, self._by_specialty, self._grids = by_id, by_specialty, {}
+        for keys in warm:
+            self._grid(keys)
+
+    def refresh(self, full=False):
+        """Incremental refresh (or a full reload when due / requested)."""
+        with self._load_lock:
+            now = time.monotonic()
+            full_due = (
+                self._full_loaded_at is None
+                or now - self._full_loaded_at >= self.config["FULL_RELOAD_INTERVAL"]
+            )
+            if full or full_due or self._watermark is None:
+                self.load()
+            else:
+                self.apply_changes(self._fetch(since=self._watermark))
+                self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self.load()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            metrics.swallowed("directory_refresh", f"Doctor directory refresh failed: {e}")
+        finally:
+            self._background_lock.release()
+
+    def request_refresh(self):
+        """Start a background refresh unless one is already running."""
+        if not self._background_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return True
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def _maybe_refresh(self):
+        if self._loaded_at is None:
+            self.ensure_loaded()
+        elif time.monotonic() - self._loaded_at >= self.config["REFRESH_INTERVAL"]:
+            self.request_refresh()
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+    def _entries(self, keys, limit=None):
+        """Doctors for the specialty keys, most experienced first.
+
+        Recognised specialties are exact matches on canonical ids. A term the
+        normalizer does not know falls back to merging every specialty whose
+        name contains it, as the old ``ilike '%term%'`` query did.
+        """
+        by_specialty = self._by_specialty
+        if len(keys) == 1 and keys[0] in by_specialty:
+            return by_specialty[keys[0]]
+        if all(key in by_specialty or key in specialties.BY_ID for key in keys):
+            matches = [by_specialty[key] for key in keys if key in by_specialty]
+        else:
+            matches = [entries for name, entries in by_specialty.items() if keys[0] in name]
+        if len(matches) == 1:
+            return matches[0]
+        merged = {}
+        for entries in matches:
+            for entry in entries[:limit]:
+                merged.setdefault(entry.id, entry)
+        return sorted(merged.values(), key=sort_key)
+
+    def _grid(self, keys):
+        grids = self._grids
+        grid = grids.get(keys)
+        if grid is None:
+            grid = grids[keys] = GeoGrid(self._entries(keys), self.config["GEO_CELL_DEG"])
+        return grid
+
+    def lookup(self, specialty, limit=10, min_experience=None):
+        """Most experienced doctors for ``specialty`` as ``DoctorEntry``s."""
+        self._maybe_refresh()
+        keys = specialty_keys(specialty)
+        if not keys:
+            return []
+        if min_experience is None:
+            return self._entries(keys, limit)[:limit]
+        found = []
+        for entry in self._entries(keys):
+            if _experience(entry.experience) >= min_experience:
+                found.append(entry)
+                if len(found) == limit:
+                    break
+        return found
+
+    def nearest(self, specialty, latitude, longitude, limit=10, max_km=None, min_experience=None):
+        """Closest doctors for ``specialty`` as ``(distance_km, entry)`` pairs."""
+        self._maybe_refresh()
+        keys = specialty_keys(specialty)
+        if not keys:
+            return []
+        accept = None
+        if min_experience is not None:
+            accept = lambda entry: _experience(entry.experience) >= min_experience
+        return self._grid(keys).nearest(
+            float(latitude), float(longitude), k=limit, max_km=max_km, accept=accept,
+        )
+
+    def search(self, specialty, limit=10, latitude=None, longitude=None, max_km=None,
+               min_experience=None):
+        """Response-ready doctor dicts.
+
+        With a patient location the closest doctors come first and carry a
+        ``distance_km``; without one, the most experienced doctors are used.
+        """
+        if latitude is None or longitude is None:
+            return [
+                entry_as_dict(entry)
+                for entry in self.lookup(specialty, limit, min_experience=min_experience)
+            ]
+        doctors = []
+        for distance, entry in self.nearest(
+            specialty, latitude, longitude, limit, max_km=max_km, min_experience=min_experience,
+        ):
+            doctor = entry_as_dict(entry)
+            doctor["distance_km"] = round(distance, 2)
+            doctors.append(doctor)
+        return doctors
+
+    def browse(self, specialty=None, after=None, limit=20, min_fee=None, max_fee=None,
+               latitude=None, longitude=None, max_km=None):
+        """One page of doctors in ``sort_key`` order, starting after the key ``after``.
+
+        Returns ``([(distance_km or None, entry), ...], next_after)``, where
+        ``next_after`` is ``None`` on the last page. Fee and distance are
+        filters; the order stays most experienced first. A selective filter
+        ends the page after ``MAX_SCAN`` entries, full or not, and
+        ``next_after`` then points past the last one looked at.
+        """
+        self._maybe_refresh()
+        if specialty:
+            keys = specialty_keys(specialty)
+            entries = self._entries(keys) if keys else []
+        else:
+            entries = self._all
+        start = bisect.bisect_right(entries, after, key=sort_key) if after is not None else 0
+        origin = (float(latitude), float(longitude)) if latitude is not None and longitude is not None else None
+        page = []
+        end = min(len(entries), start + int(self.config["MAX_SCAN"]))
+        for index in range(start, end):
+            entry = entries[index]
+            if min_fee is not None or max_fee is not None:
+                fee = _fee(entry.consultation_fee)
+                if fee is None or (min_fee is not None and fee < min_fee) or (max_fee is not None and fee > max_fee):
+                    continue
+            distance = None
+            if origin is not None:
+                point = geo.coordinates(entry)
+                if point is None:
+                    continue
+                distance = geo.haversine_km(*origin, *point)
+                if max_km is not None and distance > max_km:
+                    continue
+            page.append((distance, entry))
+            if len(page) == limit:
+                return page, sort_key(entry) if index + 1 < len(entries) else None
+        return page, sort_key(entries[end - 1]) if end < len(entries) else None
+
+    def specialties(self):
+        self._maybe_refresh()
+        return sorted(self._by_specialty)
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "doctors": len(self._by_id),
+            "specialties": len(self._by_specialty),
+            "watermark": self._watermark,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
+
+
+directory = DoctorDirectory(db.get_supabase, getattr(settings, "DOCTOR_DIRECTORY", None))
@@ -0,0 +1,107 @@
+"""
+NDJSON export of ``symptom_sessions``.
+
+Sessions are read in keyset order: each select asks for the next
+``CHUNK_SIZE`` rows with ``id`` greater than the last one seen, ordered by
+``id``. An ``OFFSET`` scan would slow down as it goes. This way every chunk
+is one index range, and only one chunk is in memory at a time, whatever the
+size of the export. The rows are written out as NDJSON, one session per
+line, and optionally gzipped on the fly.
+
+``/api/sessions/export/`` (admins only) streams the same bytes as
+``manage.py export_sessions``. Under gunicorn's sync workers a long download
+is cut off by the worker timeout. Very large exports should use the command,
+or an ASGI worker, where the stream is read chunk by chunk off the event
+loop.
+"""
+import datetime
+import zlib
+
+from django.conf import settings
+
+from . import codec, db, specialties
+from .schema import Boolean, Date, Integer, Schema, String
+
+DEFAULTS = {
+    "CHUNK_SIZE": 1000,
+    "GZIP_LEVEL": 6,
+}
+config = {**DEFAULTS, **getattr(settings, "SESSION_EXPORT", {})}
+
+EXPORT_SCHEMA = Schema(
+    since=Date(),
+    until=Date(),
+    specialty=String(max_length=200),
+    severity=String(lower=True, max_length=50),
+    limit=Integer(ge=1),
+    gzip=Boolean(default=False),
+)
+
+
+def check_range(params):
+    """An error message if ``since`` is after ``until``, else ``None``."""
+    if params["since"] and params["until"] and params["since"] > params["until"]:
+        return "since must not be after until"
+    return None
+
+
+def filename(params):
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d-%H%M%S")
+    return f"symptom_sessions-{stamp}.ndjson" + (".gz" if params["gzip"] else "")
+
+
+def sessions(filters, client_factory=db.get_supabase, chunk_size=None):
+    """Chunks (lists) of session rows matching ``filters``, in ``id`` order.
+
+    ``since`` and ``until`` are inclusive dates on ``created_at``;
+    ``specialty`` matches the recommended specialist and ``severity`` the
+    model's severity.
+    """
+    chunk_size = int(chunk_size or config["CHUNK_SIZE"])
+    remaining = filters.get("limit")
+    specialty = filters.get("specialty")
+    if specialty:
+        specialty = specialties.canonical_name(specialty) or specialty
+    last_id = None
+    while remaining is None or remaining > 0:
+        query = _filtered(client_factory().table("symptom_sessions").select("*"), filters, specialty)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        rows = db.execute(query.order("id").limit(size)).data or []
+        if rows:
+            yield rows
+            last_id = rows[-1]["id"]
+            if remaining is not None:
+                remaining -= len(rows)
+        if len(rows) < size:
+            return
+
+
+def _filtered(query, filters, specialty):
+    if filters.get("since"):
+        query = query.gte("created_at", filters["since"].isoformat())
+    if filters.get("until"):
+        query = query.lt("created_at", (filters["until"] + datetime.timedelta(days=1)).isoformat())
+    if filters.get("severity"):
+        query = query.ilike("analysis_result->>severity", filters["severity"])
+    if specialty:
+        query = query.ilike("analysis_result->>doctor_recommendation", f"%{specialty}%")
+    return query
+
+
+def ndjson(chunks):
+    """One bytes block of NDJSON lines per chunk of rows."""
+    for rows in chunks:
+        yield b"".join(codec.dumps(row) + b"\n" for row in rows)
+
+
+def gzipped(blocks, level=None):
+    """``blocks`` as one gzip stream, compressed block by block."""
+    compressor = zlib.compressobj(int(level or config["GZIP_LEVEL"]), zlib.DEFLATED, 31)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
@@ -0,0 +1,507 @@
+"""
+Process-wide registry of Gemini models.
+
+Model discovery (``genai.list_models()``) is cached for ``GEMINI_DISCOVERY_TTL``
+seconds instead of being repeated on every triage request. Each model keeps
+its own success/failure counts and a smoothed latency; a model that fails
+``GEMINI_FAILURE_THRESHOLD`` times in a row has its circuit opened and is
+skipped until ``GEMINI_CIRCUIT_COOLDOWN`` seconds have passed, after which a
+single probe request is allowed through (half-open).
+
+Every generation runs against a ``Deadline`` (``GEMINI_DEADLINE`` seconds
+unless the caller passes one from the start of its request). Each attempt is
+given at most ``GEMINI_ATTEMPT_TIMEOUT`` seconds of what is left, so a model
+that hangs is abandoned in time for the next candidate to answer, and no
+attempt is started with less than ``GEMINI_MIN_ATTEMPT`` seconds remaining.
+With ``GEMINI_HEDGE`` on, a model that has not answered by its own observed
+p95 latency is raced against the next healthy candidate with the same
+prompt; whichever answers first wins and the other is abandoned.
+
+``google.generativeai`` takes about a second to import, so it is imported and
+configured on first use (``client()``) rather than when a worker loads the
+views; ``warmup.py`` can do that, and discovery, before the first request.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent import futures
+
+from . import metrics
+
+# Used when discovery itself fails
+FALLBACK_MODELS = [
+    "gemini-1.5-flash-latest",
+    "gemini-1.5-flash",
+    "gemini-2.0-flash-exp",
+]
+
+DISCOVERY_TTL = float(os.getenv("GEMINI_DISCOVERY_TTL", "600"))
+DISCOVERY_RETRY = float(os.getenv("GEMINI_DISCOVERY_RETRY", "60"))
+FAILURE_THRESHOLD = int(os.getenv("GEMINI_FAILURE_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("GEMINI_CIRCUIT_COOLDOWN", "60"))
+
+REQUEST_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "20"))
+ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "12"))
+MIN_ATTEMPT = float(os.getenv("GEMINI_MIN_ATTEMPT", "1"))
+HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() == "true"
+HEDGE_QUANTILE = float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.95"))
+# No hedging for a model until it has this many successful samples
+HEDGE_MIN_SAMPLES = 20
+# Threads for racing blocking generate_content calls
+HEDGE_THREADS = int(os.getenv("GEMINI_HEDGE_THREADS", "16"))
+
+# Weight of the newest sample in the smoothed latency
+LATENCY_ALPHA = 0.3
+# Successful latencies kept per model for percentiles
+LATENCY_WINDOW = 200
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def client():
+    """The ``google.generativeai`` module, imported and configured once."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                _genai = genai
+    return _genai
+
+
+class AllModelsFailed(Exception):
+    """Raised when every candidate model failed for a prompt."""
+
+    status = 500
+
+    def __init__(self, last_error):
+        super().__init__(f"All models failed. Last error: {last_error}")
+        self.last_error = last_error
+
+
+class DeadlineExceeded(AllModelsFailed):
+    """Raised when the deadline ran out before any model answered."""
+
+    status = 504
+
+    def __init__(self, last_error):
+        Exception.__init__(self, f"No model answered in time. Last error: {last_error}")
+        self.last_error = last_error
+
+
+class Deadline:
+    """The monotonic time by which a request must have its reply."""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds=None):
+        self.expires_at = time.monotonic() + (REQUEST_DEADLINE if seconds is None else seconds)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def attempt_timeout(self):
+        """Seconds for the next attempt, or ``None`` if too little time is left."""
+        timeout = min(ATTEMPT_TIMEOUT, self.remaining())
+        return timeout if timeout >= min(MIN_ATTEMPT, ATTEMPT_TIMEOUT) else None
+
+
+class ModelHealth:
+    """Health counters and circuit state for one model."""
+
+    def __init__(self, name, display_name=None, description=None):
+        self.name = name
+        self.display_name = display_name or name
+        self.description = description or ""
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None  # smoothed seconds, None until first success
+        self.recent = deque(maxlen=LATENCY_WINDOW)  # latest successful latencies
+        self.opened_at = None
+        self.probe_at = None  # when a half-open probe was last handed out
+        self.last_error = None
+
+    def state(self, now):
+        if self.opened_at is None:
+            return CLOSED
+        if now - self.opened_at >= CIRCUIT_COOLDOWN:
+            return HALF_OPEN
+        return OPEN
+
+    def quantile(self, q):
+        if len(self.recent) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def success_rate(self):
+        total = self.successes + self.failures
+        return round(self.successes / total, 3) if total else None
+
+    def as_dict(self, now):
+        return {
+            "name": self.name,
+            "display_name": self.display_name,
+            "description": self.description,
+            "state": self.state(now),
+            "successes": self.successes,
+            "failures": self.failures,
+            "success_rate": self.success_rate(),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if (p95 := self.quantile(0.95)) is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, list_models=None):
+        self._list_models = list_models  # None: genai.list_models
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._models = {}  # name -> ModelHealth, in discovery order
+        self._expires_at = 0.0
+
+    # -----------------------------
+    # Discovery
+    # -----------------------------
+    def _discover(self):
+        try:
+            found = [
+                (m.name, m.display_name, m.description)
+                for m in (self._list_models or client().list_models)()
+                if 'generateContent' in m.supported_generation_methods
+            ]
+            ttl = DISCOVERY_TTL
+        except Exception as e:
+            metrics.swallowed("gemini_discovery", f"Gemini model discovery failed: {e}")
+            found = [(name, None, None) for name in FALLBACK_MODELS]
+            ttl = DISCOVERY_RETRY
+        return found, ttl
+
+    def stale(self):
+        return time.monotonic() >= self._expires_at
+
+    def refresh(self, force=False):
+        """Re-run discovery if the cached list has expired (or ``force``)."""
+        if not force and not self.stale():
+            return
+        # Only one thread re-discovers; the rest keep using the current list
+        if not self._refresh_lock.acquire(blocking=not self._models):
+            return
+        try:
+            if force or self.stale():
+                self._store(*self._discover())
+        finally:
+            self._refresh_lock.release()
+
+    def _store(self, found, ttl):
+        with self._lock:
+            models = {}
+            for name, display_name, description in found:
+                # Keep health history for models that are still listed
+                health = self._models.get(name) or ModelHealth(name)
+                if display_name:
+                    health.display_name = display_name
+                if description:
+                    health.description = description
+                models[name] = health
+            self._models = models
+            self._expires_at = time.monotonic() + ttl
+
+    # -----------------------------
+    # Ordering
+    # -----------------------------
+    def candidates(self):
+        """Model names to try, fastest healthy model first.
+
+        Closed circuits come first, ordered by smoothed latency (models with
+        no samples yet keep discovery order after the measured ones). A
+        half-open model is offered once as a probe. If every circuit is open,
+        the one that opened longest ago is returned so the request still has
+        something to try.
+        """
+        self.refresh()
+        now = time.monotonic()
+        with self._lock:
+            closed, probes, opened = [], [], []
+            for index, health in enumerate(self._models.values()):
+                state = health.state(now)
+                if state == CLOSED:
+                    measured = health.latency is not None
+                    closed.append((not measured, health.latency or 0.0, index, health.name))
+                elif state == HALF_OPEN and (
+                    health.probe_at is None or now - health.probe_at >= CIRCUIT_COOLDOWN
+                ):
+                    # A probe that is handed out but never tried (an earlier
+                    # model answered) expires after one more cooldown
+                    health.probe_at = now
+                    probes.append(health.name)
+                elif state == OPEN:
+                    opened.append((health.opened_at, health.name))
+            ordered = [name for *_, name in sorted(closed)] + probes
+            if not ordered and opened:
+                ordered = [min(opened)[1]]
+            return ordered
+
+    # -----------------------------
+    # Outcome tracking
+    # -----------------------------
+    def _health(self, name):
+        health = self._models.get(name)
+        if health is None:
+            health = self._models[name] = ModelHealth(name)
+        return health
+
+    def record_success(self, name, latency):
+        with self._lock:
+            health = self._health(name)
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.opened_at = None
+            health.probe_at = None
+            health.recent.append(latency)
+            if health.latency is None:
+                health.latency = latency
+            else:
+                health.latency += LATENCY_ALPHA * (latency - health.latency)
+
+    def record_failure(self, name, error):
+        with self._lock:
+            health = self._health(name)
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.last_error = str(error)
+            if health.opened_at is not None or health.consecutive_failures >= FAILURE_THRESHOLD:
+                # A failed half-open probe re-opens the circuit straight away
+                health.opened_at = time.monotonic()
+            health.probe_at = None
+
+    def hedge_delay(self, name):
+        """Seconds to wait for ``name`` before hedging, or ``None`` (not enough samples)."""
+        with self._lock:
+            health = self._models.get(name)
+            return health.quantile(HEDGE_QUANTILE) if health is not None else None
+
+    def snapshot(self, refresh=True):
+        if refresh:
+            self.refresh()
+        now = time.monotonic()
+        with self._lock:
+            return [health.as_dict(now) for health in self._models.values()]
+
+    # -----------------------------
+    # Generation
+    # -----------------------------
+    def _succeeded(self, model_name, fallback, latency):
+        self.record_success(model_name, latency)
+        metrics.gemini_seconds.observe(latency, model_name, "success")
+        if fallback:
+            # An earlier candidate failed and this one answered instead
+            metrics.fallbacks.inc("gemini_model")
+
+    def _failed(self, model_name, error, latency):
+        self.record_failure(model_name, error)
+        metrics.gemini_seconds.observe(latency, model_name, "error")
+        metrics.swallowed("gemini_model", f"Model {model_name} failed with error: {error}")
+
+    def _call(self, model_name, prompt, timeout, fallback):
+        """One blocking attempt; outcomes are recorded even if nobody waits for them."""
+        started = time.monotonic()
+        in_flight = metrics.gemini_in_flight.labels()
+        in_flight.inc()
+        try:
+            response = client().GenerativeModel(model_name).generate_content(
+                prompt, request_options={"timeout": timeout},
+            )
+        except Exception as e:
+            self._failed(model_name, e, time.monotonic() - started)
+            raise
+        finally:
+            in_flight.dec()
+        self._succeeded(model_name, fallback, time.monotonic() - started)
+        return response
+
+    async def _call_async(self, model_name, prompt, timeout, fallback):
+        started = time.monotonic()
+        in_flight = metrics.gemini_in_flight.labels()
+        in_flight.inc()
+        try:
+            model = client().GenerativeModel(model_name)
+            response = await asyncio.wait_for(
+                model.generate_content_async(prompt, request_options={"timeout": timeout}), timeout,
+            )
+        except asyncio.CancelledError:
+            # Lost a hedge race or the request went away; not the model's fault
+            metrics.gemini_seconds.observe(time.monotonic() - started, model_name, "cancelled")
+            raise
+        except asyncio.TimeoutError:
+            error = TimeoutError(f"no reply within {timeout:.1f}s")
+            self._failed(model_name, error, time.monotonic() - started)
+            raise error
+        except Exception as e:
+            self._failed(model_name, e, time.monotonic() - started)
+            raise
+        finally:
+            in_flight.dec()
+        self._succeeded(model_name, fallback, time.monotonic() - started)
+        return response
+
+    def _hedge_at(self, model_name, others_left):
+        if not HEDGE or not others_left:
+            return None
+        delay = self.hedge_delay(model_name)
+        return time.monotonic() + delay if delay is not None else None
+
+    def generate(self, prompt, deadline=None):
+        """Run ``prompt`` against the best available model before ``deadline``.
+
+        Returns ``(response, model_name)``; raises ``DeadlineExceeded`` when
+        time runs out and ``AllModelsFailed`` when every candidate failed.
+        """
+        deadline = deadline or Deadline()
+        if HEDGE:
+            return self._generate_hedged(prompt, deadline)
+        last_error = "no models available"
+        for attempt, model_name in enumerate(self.candidates()):
+            timeout = deadline.attempt_timeout()
+            if timeout is None:
+                raise DeadlineExceeded(last_error)
+            try:
+                return self._call(model_name, prompt, timeout, attempt > 0), model_name
+            except Exception as e:
+                last_error = str(e)
+        raise _gave_up(deadline, last_error)
+
+    def _generate_hedged(self, prompt, deadline):
+        # Blocking calls cannot be cancelled: a losing or timed-out attempt
+        # finishes on its pool thread (bounded by its request timeout)
+        names = self.candidates()
+        running = {}  # future -> (model name, give up at)
+        last_error = "no models available"
+        hedged = False
+        hedge_at = None
+
+        def launch(fallback):
+            timeout = deadline.attempt_timeout()
+            if not names or timeout is None:
+                return None
+            name = names.pop(0)
+            future = _hedge_pool().submit(self._call, name, prompt, timeout, fallback)
+            running[future] = (name, time.monotonic() + timeout)
+            return name
+
+        primary = launch(fallback=False)
+        if primary is not None:
+            hedge_at = self._hedge_at(primary, names)
+        while running:
+            wait = min(expires_at for _, expires_at in running.values()) - time.monotonic()
+            if hedge_at is not None and not hedged:
+                wait = min(wait, hedge_at - time.monotonic())
+            done, _ = futures.wait(running, timeout=max(0.0, wait), return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                name, _ = running.pop(future)
+                try:
+                    return future.result(), name
+                except Exception as e:
+                    last_error = str(e)
+            now = time.monotonic()
+            for future, (name, expires_at) in list(running.items()):
+                if now >= expires_at:
+                    # Abandoned; the call records its own outcome when it returns
+                    del running[future]
+                    last_error = f"{name}: no reply within the attempt timeout"
+            if not done and not hedged and hedge_at is not None and time.monotonic() >= hedge_at:
+                hedged = True
+                metrics.fallbacks.inc("gemini_hedge")
+                launch(fallback=False)
+            elif not running:
+                name = launch(fallback=True)
+                if name is not None and not hedged:
+                    hedge_at = self._hedge_at(name, names)
+            elif not deadline.remaining():
+                raise DeadlineExceeded(last_error)
+        raise _gave_up(deadline, last_error)
+
+    async def generate_async(self, prompt, deadline=None):
+        """Async twin of ``generate`` using ``generate_content_async``."""
+        deadline = deadline or Deadline()
+        if self.stale():
+            # Discovery is a blocking call; keep it off the event loop
+            await asyncio.to_thread(self.refresh)
+        names = self.candidates()
+        running = {}  # task -> model name
+        last_error = "no models available"
+        hedged = False
+        hedge_at = None
+
+        def launch(fallback):
+            timeout = deadline.attempt_timeout()
+            if not names or timeout is None:
+                return None
+            name = names.pop(0)
+            running[asyncio.ensure_future(self._call_async(name, prompt, timeout, fallback))] = name
+            return name
+
+        try:
+            primary = launch(fallback=False)
+            if primary is not None:
+                hedge_at = self._hedge_at(primary, names)
+            while running:
+                wait = deadline.remaining()
+                if hedge_at is not None and not hedged:
+                    wait = min(wait, max(0.0, hedge_at - time.monotonic()))
+                done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    try:
+                        return task.result(), name
+                    except Exception as e:
+                        last_error = str(e)
+                if not done and not hedged and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedged = True
+                    metrics.fallbacks.inc("gemini_hedge")
+                    launch(fallback=False)
+                elif not running:
+                    name = launch(fallback=True)
+                    if name is not None and not hedged:
+                        hedge_at = self._hedge_at(name, names)
+                elif not deadline.remaining():
+                    raise DeadlineExceeded(last_error)
+        finally:
+            # The loser of a hedge race, or everything if we were cancelled
+            for task in running:
+                task.cancel()
+        raise _gave_up(deadline, last_error)
+
+
+def _gave_up(deadline, last_error):
+    if deadline.attempt_timeout() is None:
+        return DeadlineExceeded(last_error)
+    return AllModelsFailed(last_error)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _hedge_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = futures.ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="gemini")
+    return _pool
+
+
+registry = ModelRegistry()
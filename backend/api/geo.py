@@ -0,0 +1,153 @@
+"""
+Spatial index for nearest-doctor search.
+
+Doctors are bucketed into a fixed-size lat/lng grid (``cell_deg`` degrees per
+side, ~5.5 km at the default). A query walks square rings of cells outwards
+from the patient's cell and stops once it holds ``k`` doctors that are
+provably closer than anything in the unvisited rings, so the cost depends on
+local density rather than roster size. Sparse grids (a rare specialty) skip
+the ring walk and rank their few occupied cells directly.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.32
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def coordinates(entry):
+    """``(lat, lng)`` floats for an entry, or ``None`` if it has no location."""
+    try:
+        lat, lng = float(entry.latitude), float(entry.longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+class GeoGrid:
+    def __init__(self, entries, cell_deg=0.05):
+        self.cell_deg = cell_deg
+        self.cells = {}  # (row, col) -> [(lat, lng, rank, entry)]
+        for rank, entry in enumerate(entries):
+            point = coordinates(entry)
+            if point is not None:
+                self.cells.setdefault(self._cell(*point), []).append((point[0], point[1], rank, entry))
+        if self.cells:
+            rows = [row for row, _ in self.cells]
+            cols = [col for _, col in self.cells]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def _ring(self, center, r):
+        """Cells of the square ring at Chebyshev distance ``r``, clipped to the grid."""
+        row0, col0 = center
+        min_row, max_row, min_col, max_col = self._bounds
+        if r == 0:
+            yield center
+            return
+        cols = range(max(col0 - r, min_col), min(col0 + r, max_col) + 1)
+        for row in (row0 - r, row0 + r):
+            if min_row <= row <= max_row:
+                for col in cols:
+                    yield row, col
+        rows = range(max(row0 - r + 1, min_row), min(row0 + r - 1, max_row) + 1)
+        for col in (col0 - r, col0 + r):
+            if min_col <= col <= max_col:
+                for row in rows:
+                    yield row, col
+
+    def _covered_km(self, lat, lng, center, r):
+        """Distance within which every point is guaranteed to be in rings 0..r.
+
+        That is the distance to the nearest edge of the visited square,
+        ignoring edges beyond which the grid holds nothing: straight along
+        the meridian for the north/south edges, cross-track for the
+        east/west ones.
+        """
+        row0, col0 = center
+        min_row, max_row, min_col, max_col = self._bounds
+        edges = []
+        if row0 - r > min_row:
+            edges.append(math.radians(lat - (row0 - r) * self.cell_deg))
+        if row0 + r < max_row:
+            edges.append(math.radians((row0 + r + 1) * self.cell_deg - lat))
+        cos_lat = math.cos(math.radians(lat))
+        for dlng in (
+            lng - (col0 - r) * self.cell_deg if col0 - r > min_col else None,
+            (col0 + r + 1) * self.cell_deg - lng if col0 + r < max_col else None,
+        ):
+            if dlng is not None:
+                dlng = math.radians(min(dlng, 90.0))
+                edges.append(math.asin(min(1.0, math.sin(dlng) * cos_lat)))
+        if not edges:
+            return math.inf
+        return EARTH_RADIUS_KM * min(edges)
+
+    def nearest(self, lat, lng, k=10, max_km=None, accept=None):
+        """``k`` closest ``(distance_km, entry)`` pairs, nearest first.
+
+        ``accept`` is an optional predicate on entries (e.g. a minimum
+        experience); ties on distance go to the earlier entry in the
+        source list, i.e. the more experienced doctor.
+        """
+        if not self.cells or k <= 0:
+            return []
+        best = []  # max-heap of (-distance, -rank, entry) holding the k nearest
+
+        def consider(points):
+            for plat, plng, rank, entry in points:
+                if accept is not None and not accept(entry):
+                    continue
+                dist = haversine_km(lat, lng, plat, plng)
+                if max_km is not None and dist > max_km:
+                    continue
+                item = (-dist, -rank, entry)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+
+        center = self._cell(lat, lng)
+        min_row, max_row, min_col, max_col = self._bounds
+        max_r = max(
+            abs(center[0] - min_row), abs(center[0] - max_row),
+            abs(center[1] - min_col), abs(center[1] - max_col),
+        )
+        # Rings that lie wholly outside the grid hold nothing; start at the first
+        # one that touches it (0 when the patient is inside the roster's extent)
+        first_r = max(
+            min_row - center[0], center[0] - max_row,
+            min_col - center[1], center[1] - max_col, 0,
+        )
+        visited = set()
+        for r in range(first_r, max_r + 1):
+            if 8 * r > len(self.cells) - len(visited):
+                # Fewer occupied cells left than ring cells: rank them directly
+                for cell, points in self.cells.items():
+                    if cell not in visited:
+                        consider(points)
+                break
+            for cell in self._ring(center, r):
+                points = self.cells.get(cell)
+                if points is not None:
+                    visited.add(cell)
+                    consider(points)
+            covered = self._covered_km(lat, lng, center, r)
+            if max_km is not None and covered >= max_km:
+                break
+            if len(best) == k and -best[0][0] <= covered:
+                break
+
+        return [(-neg_dist, entry) for neg_dist, _, entry in sorted(best, reverse=True)]
@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmark
+
+
+def _csv(value):
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API through its WSGI and ASGI handlers against in-process "
+        "Gemini and Supabase stand-ins, and store the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", default="wsgi,asgi", help="Comma-separated: wsgi, asgi")
+        parser.add_argument(
+            "--scenarios", default="analyze,recommend,doctors,auth",
+            help=f"Comma-separated: {', '.join(benchmark.SCENARIOS)}",
+        )
+        parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated levels")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per run")
+        parser.add_argument("--distinct", type=int, default=50,
+                            help="Distinct patient payloads (fewer means more cache hits)")
+        parser.add_argument("--rule-share", type=float, default=0.3,
+                            help="Share of payloads the rule engine can answer")
+        parser.add_argument("--roster", type=int, default=2000, help="Fake doctors in the roster")
+        parser.add_argument("--users", type=int, default=100, help="Fake patients sending requests")
+        parser.add_argument("--llm-latency-ms", type=float, default=800)
+        parser.add_argument("--llm-sigma", type=float, default=0.4,
+                            help="Log-normal spread of the Gemini latency")
+        parser.add_argument("--llm-error-rate", type=float, default=0.0)
+        parser.add_argument("--db-latency-ms", type=float, default=40)
+        parser.add_argument("--db-sigma", type=float, default=0.3)
+        parser.add_argument("--db-error-rate", type=float, default=0.0)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="JSON file (default: benchmarks/<time>-<commit>.json)")
+        parser.add_argument("--compare", help="Earlier result JSON to compare against")
+
+    def handle(self, *args, **options):
+        servers = _csv(options["servers"])
+        scenarios = _csv(options["scenarios"])
+        unknown = [s for s in servers if s not in benchmark.SERVERS]
+        unknown += [s for s in scenarios if s not in benchmark.SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown server or scenario: {', '.join(unknown)}")
+        try:
+            levels = [int(level) for level in _csv(options["concurrency"])]
+        except ValueError:
+            raise CommandError("--concurrency must be comma-separated integers")
+
+        report = benchmark.run_benchmark(
+            servers,
+            scenarios,
+            levels,
+            options["requests"],
+            benchmark.Profile(options["llm_latency_ms"], options["llm_sigma"],
+                              options["llm_error_rate"], seed=options["seed"]),
+            benchmark.Profile(options["db_latency_ms"], options["db_sigma"],
+                              options["db_error_rate"], seed=options["seed"] + 1),
+            distinct=options["distinct"],
+            rule_share=options["rule_share"],
+            roster_size=options["roster"],
+            users=options["users"],
+            seed=options["seed"],
+            log=self.stdout.write,
+        )
+
+        output = options["output"]
+        if not output:
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            output = os.path.join(
+                settings.BASE_DIR, "benchmarks", f"{stamp}-{report['commit'] or 'nocommit'}.json",
+            )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as f:
+                baseline = json.load(f)
+            self.stdout.write(f"Against {options['compare']} ({baseline.get('commit')}):")
+            for line in benchmark.compare(report, baseline):
+                self.stdout.write(line)
@@ -0,0 +1,61 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Write symptom_sessions as NDJSON (optionally gzipped), reading them in "
+        "keyset-ordered chunks so memory stays flat for any number of rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="First day (YYYY-MM-DD, inclusive)")
+        parser.add_argument("--until", help="Last day (YYYY-MM-DD, inclusive)")
+        parser.add_argument("--specialty", help="Recommended specialist")
+        parser.add_argument("--severity", help="Model severity, e.g. mild, moderate, severe")
+        parser.add_argument("--limit", help="Stop after this many sessions")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output")
+        parser.add_argument("--chunk-size", type=int, help="Rows per select")
+        parser.add_argument("--output", "-o", help="File to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        params, errors = export.EXPORT_SCHEMA.validate(
+            {name: options[name] for name in ("since", "until", "specialty", "severity", "limit", "gzip")}
+        )
+        if errors:
+            raise CommandError(" ".join(errors.values()))
+        error = export.check_range(params)
+        if error:
+            raise CommandError(error)
+        if options["chunk_size"] is not None and options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        written = 0
+        started = time.monotonic()
+
+        def counted(chunks):
+            nonlocal written
+            for rows in chunks:
+                written += len(rows)
+                yield rows
+                self.stderr.write(f"{written} sessions ({written / max(time.monotonic() - started, 1e-9):.0f}/s)")
+
+        blocks = export.ndjson(counted(export.sessions(params, chunk_size=options["chunk_size"])))
+        if params["gzip"]:
+            blocks = export.gzipped(blocks)
+        output = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        try:
+            for block in blocks:
+                output.write(block)
+        finally:
+            if options["output"]:
+                output.close()
+            else:
+                output.flush()
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {written} sessions" + (f" to {options['output']}" if options["output"] else "")
+        ))
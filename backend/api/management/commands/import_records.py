@@ -0,0 +1,68 @@
+import os
+
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand, CommandError
+
+from api import bulk_import
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream doctors, patients or specialties from a CSV or NDJSON file (optionally "
+        ".gz) into Supabase and Django auth in batches, with resumable checkpoints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(bulk_import.KINDS))
+        parser.add_argument("path", help="CSV or NDJSON file")
+        parser.add_argument("--format", choices=bulk_import.FORMATS,
+                            help="File format (default: from the extension)")
+        parser.add_argument("--batch-size", type=int, help="Records per upsert")
+        parser.add_argument("--workers", type=int, help="Password hashing processes (default: one per CPU)")
+        parser.add_argument("--hasher", default="default",
+                            help="Django password hasher for the password column")
+        parser.add_argument("--update", action="store_true",
+                            help="Update records whose user or row already exists instead of skipping them")
+        parser.add_argument("--checkpoint", help="Checkpoint file (default: <path>.checkpoint.json)")
+        parser.add_argument("--resume", action="store_true", help="Continue after the last checkpoint")
+        parser.add_argument("--rejects", help="NDJSON file for invalid records (default: <path>.rejects.ndjson)")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.isfile(path):
+            raise CommandError(f"No such file: {path}")
+        if options["batch_size"] is not None and options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        try:
+            get_hasher(options["hasher"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint.json"
+        rejects_path = options["rejects"] or f"{path}.rejects.ndjson"
+
+        with open(rejects_path, "a" if options["resume"] else "w", encoding="utf-8") as rejects:
+            importer = bulk_import.Importer(
+                options["kind"],
+                batch_size=options["batch_size"],
+                update=options["update"],
+                workers=options["workers"],
+                hasher=options["hasher"],
+                log=self.stdout.write,
+                rejects=rejects,
+            )
+            try:
+                counters = importer.run(
+                    bulk_import.read_records(path, options["format"]),
+                    checkpoint=checkpoint,
+                    resume=options["resume"],
+                    source=os.path.abspath(path),
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {counters['imported']} {options['kind']} "
+            f"({counters['duplicates']} duplicate, {counters['invalid']} invalid)"
+        ))
+        if counters["invalid"]:
+            self.stdout.write(f"Invalid records are listed in {rejects_path}")
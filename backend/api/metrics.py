@@ -0,0 +1,385 @@
+"""
+Per-stage latency metrics, ``Server-Timing`` headers and Prometheus text.
+
+Code that does a distinct piece of request work wraps it in a span::
+
+    with metrics.span("llm"):
+        reply_json = generate_reply(info)
+
+A span is a ``perf_counter`` pair plus one histogram update, so it costs a
+couple of microseconds and can stay on in production. Its duration goes into
+the ``bookmydoc_stage_seconds`` histogram and, through ``ServerTimingMiddleware``,
+into the response's ``Server-Timing`` header (spans of the same name are
+summed). ``/api/metrics`` renders every metric registered here in the
+Prometheus text format, plus point-in-time gauges taken from the cache,
+session writer, doctor directory, model registry and coalescing stats.
+"""
+import bisect
+import contextlib
+import contextvars
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+DEFAULTS = {
+    "ENABLED": True,
+    "SERVER_TIMING": True,
+}
+config = {**DEFAULTS, **getattr(settings, "METRICS", {})}
+
+# Seconds; triage spans range from sub-millisecond rule hits to multi-second generations
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+# (name, seconds) pairs for the current request; None outside a request
+_timings = contextvars.ContextVar("server_timings", default=None)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+# -----------------------------
+# Metric types
+# -----------------------------
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}  # label values -> child
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_label_text(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, *values, amount=1):
+        self.labels(*values).inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+
+class _HistogramValues:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            cumulative += count
+            le = (("le", _format_value(float(bound))),)
+            lines.append(f"{name}_bucket{_label_text(labelnames, values, le)} {cumulative}")
+        labels = _label_text(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValues(self.buckets)
+
+    def observe(self, seconds, *values):
+        self.labels(*values).observe(seconds)
+
+
+stage_seconds = Histogram(
+    "bookmydoc_stage_seconds", "Time spent in each request stage.", ["stage"],
+)
+request_seconds = Histogram(
+    "bookmydoc_request_seconds", "API request latency until the response is returned.",
+    ["route", "method", "status"],
+)
+requests_in_flight = Gauge("bookmydoc_requests_in_flight", "API requests being handled.")
+gemini_seconds = Histogram(
+    "bookmydoc_gemini_request_seconds", "Gemini generate calls by model and outcome.",
+    ["model", "outcome"],
+)
+gemini_in_flight = Gauge("bookmydoc_gemini_requests_in_flight", "Gemini generate calls in flight.")
+fallbacks = Counter(
+    "bookmydoc_fallbacks_total",
+    "Requests served by a fallback path (a later Gemini model, a direct doctor query).",
+    ["kind"],
+)
+swallowed_errors = Counter(
+    "bookmydoc_swallowed_errors_total", "Errors caught and logged instead of failing a request.",
+    ["site"],
+)
+admission_rejected = Counter(
+    "bookmydoc_admission_rejected_total", "Requests refused by rate limits (429) or LLM load shedding (503).",
+    ["endpoint", "status"],
+)
+triage_sources = Counter(
+    "bookmydoc_triage_replies_total", "Triage replies by where they came from.", ["source"],
+)
+
+# Always exported, even before the first request
+requests_in_flight.labels()
+gemini_in_flight.labels()
+
+REGISTRY = [
+    stage_seconds, request_seconds, requests_in_flight, gemini_seconds,
+    gemini_in_flight, fallbacks, swallowed_errors, admission_rejected, triage_sources,
+]
+
+
+# -----------------------------
+# Spans
+# -----------------------------
+class span:
+    """Time a stage: ``with metrics.span("doctors"): ...``."""
+
+    __slots__ = ("_child", "_name", "_started")
+
+    def __init__(self, name):
+        self._name = name
+        self._child = stage_seconds.labels(name)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._started
+        self._child.observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self._name, elapsed))
+        return False
+
+
+@contextlib.contextmanager
+def without_server_timing():
+    """Keep spans started in this block (and tasks created in it) out of the header.
+
+    For work that runs concurrently inside one request, whose summed span
+    time would exceed the request's own.
+    """
+    token = _timings.set(None)
+    try:
+        yield
+    finally:
+        _timings.reset(token)
+
+
+def swallowed(site, message):
+    """Count an error that is logged and handled rather than raised."""
+    swallowed_errors.inc(site)
+    print(message)
+
+
+# -----------------------------
+# Server-Timing middleware
+# -----------------------------
+def server_timing(timings, total):
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+class ServerTimingMiddleware:
+    """Times API requests and adds their spans as a ``Server-Timing`` header.
+
+    Works under WSGI and ASGI. Streaming responses only report the spans that
+    finished before the response was returned.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not config["ENABLED"] or not request.path.startswith("/api/"):
+            return self.get_response(request)
+        started, token = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = self._finish(token)
+        return self._record(request, response, started, timings)
+
+    async def __acall__(self, request):
+        if not config["ENABLED"] or not request.path.startswith("/api/"):
+            return await self.get_response(request)
+        started, token = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = self._finish(token)
+        return self._record(request, response, started, timings)
+
+    def _start(self):
+        requests_in_flight.labels().inc()
+        return time.perf_counter(), _timings.set([])
+
+    def _finish(self, token):
+        requests_in_flight.labels().dec()
+        timings = _timings.get()
+        _timings.reset(token)
+        return timings
+
+    def _record(self, request, response, started, timings):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None else "unmatched"
+        request_seconds.observe(elapsed, route, request.method, f"{response.status_code // 100}xx")
+        if config["SERVER_TIMING"]:
+            response["Server-Timing"] = server_timing(timings, elapsed)
+        return response
+
+
+# -----------------------------
+# Prometheus text
+# -----------------------------
+def _gauge_lines(name, help_text, samples):
+    """``samples`` is a list of ``(labels, value)``; non-numeric values are skipped."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            names, values = zip(*labels) if labels else ((), ())
+            lines.append(f"{name}{_label_text(names, values)} {_format_value(value)}")
+    return lines
+
+
+def stats_lines(component, stats, labels=()):
+    """Gauges ``bookmydoc_<component>_<key>`` from a flat ``stats()`` dict."""
+    lines = []
+    for key, value in stats.items():
+        if value is None or isinstance(value, (str, dict, list)):
+            continue
+        lines.extend(_gauge_lines(
+            f"bookmydoc_{component}_{key}", f"{component} {key.replace('_', ' ')}.",
+            [(labels, value)],
+        ))
+    return lines
+
+
+def render(components=None, models=None, coalescing=None):
+    """Prometheus exposition text for everything registered plus ``stats()`` snapshots.
+
+    ``components`` maps a component name to its flat ``stats()`` dict,
+    ``models`` is ``ModelRegistry.snapshot()`` and ``coalescing`` is
+    ``SingleFlight.stats()``.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for component, stats in (components or {}).items():
+        lines.extend(stats_lines(component, stats))
+    if models is not None:
+        for key in ("successes", "failures", "success_rate", "latency_ms"):
+            lines.extend(_gauge_lines(
+                f"bookmydoc_gemini_model_{key}", f"Model registry {key.replace('_', ' ')}.",
+                [((("model", model["name"]),), model[key]) for model in models],
+            ))
+        lines.extend(_gauge_lines(
+            "bookmydoc_gemini_model_circuit_open", "1 if the model's circuit is not closed.",
+            [((("model", model["name"]), ("state", model["state"])), int(model["state"] != "closed"))
+             for model in models],
+        ))
+    if coalescing is not None:
+        coalescing = dict(coalescing)
+        lines.extend(_gauge_lines(
+            "bookmydoc_coalescing_in_flight", "Coalesced calls in flight.",
+            [((), coalescing.pop("in_flight", 0))],
+        ))
+        for key in ("calls", "coalesced", "errors"):
+            lines.extend(_gauge_lines(
+                f"bookmydoc_coalescing_{key}", f"Single-flight {key} by kind.",
+                [((("kind", kind),), counters[key]) for kind, counters in sorted(coalescing.items())],
+            ))
+    return "\n".join(lines) + "\n"
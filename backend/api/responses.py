@@ -0,0 +1,128 @@
+"""
+Response encoding for the API: compression and conditional requests.
+
+``CompressionMiddleware`` compresses ``/api/`` responses of at least
+``MIN_SIZE`` bytes with Brotli when the client accepts it (and ``brotli`` is
+installed), otherwise with gzip. Streaming responses (the SSE endpoints) are
+left alone so their events are not held back by a compressor's buffer.
+
+``conditional_json(request, data)`` renders ``data`` and tags it with an
+ETag derived from the body, answering ``304 Not Modified`` when the client's
+``If-None-Match`` already holds it. The tag is marked weak because the
+middleware may send the same body with different encodings.
+"""
+import gzip
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+from . import codec
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+DEFAULTS = {
+    "ENABLED": True,
+    "MIN_SIZE": 1024,
+    "BROTLI_QUALITY": 5,
+    "GZIP_LEVEL": 6,
+    "CONTENT_TYPES": ("application/json", "text/"),
+}
+config = {**DEFAULTS, **getattr(settings, "COMPRESSION", {})}
+
+
+def accepted(header):
+    """Encodings named in an ``Accept-Encoding`` header (ignoring ``q=0``)."""
+    names = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        names.add(name.strip().lower())
+    return names
+
+
+def compress(body, accept_encoding):
+    """``(body, encoding)``; ``encoding`` is ``None`` when nothing was done."""
+    names = accepted(accept_encoding)
+    if brotli is not None and "br" in names:
+        return brotli.compress(body, quality=int(config["BROTLI_QUALITY"])), "br"
+    if "gzip" in names or "*" in names:
+        return gzip.compress(body, compresslevel=int(config["GZIP_LEVEL"]), mtime=0), "gzip"
+    return body, None
+
+
+def _compressible(response):
+    if response.streaming or response.has_header("Content-Encoding"):
+        return False
+    if response.status_code != 200 or len(response.content) < int(config["MIN_SIZE"]):
+        return False
+    content_type = response.get("Content-Type", "")
+    return content_type.startswith(tuple(config["CONTENT_TYPES"]))
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self._encode(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._encode(request, await self.get_response(request))
+
+    def _encode(self, request, response):
+        if not config["ENABLED"] or not request.path.startswith("/api/"):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if not _compressible(response):
+            return response
+        body, encoding = compress(response.content, request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None or len(body) >= len(response.content):
+            return response
+        response.content = body
+        response["Content-Length"] = str(len(body))
+        response["Content-Encoding"] = encoding
+        return response
+
+
+# -----------------------------
+# ETag / If-None-Match
+# -----------------------------
+def etag_for(body):
+    return 'W/"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of ``etag`` against an ``If-None-Match`` header."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def conditional_json(request, data, cache_control="private, no-cache"):
+    """``JsonResponse`` with an ETag, or 304 if the client already has this body."""
+    body = codec.dumps(data)
+    etag = etag_for(body)
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match and etag_matches(if_none_match, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    return response
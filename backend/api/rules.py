@@ -0,0 +1,227 @@
+"""
+Rule-based local triage.
+
+Common single-complaint requests ("fever and cough", "skin rash") do not need
+a multi-second Gemini generation. This engine scores a request against a
+symptom -> specialist/severity rule table (plus ``DISEASE_SPECIALIST_MAP``
+for patients who name a condition) and answers directly when its confidence
+reaches ``settings.TRIAGE_RULES["CONFIDENCE_THRESHOLD"]``.
+
+It is deliberately conservative: any red-flag symptom, unexplained words in
+the complaint, disagreeing specialists or an age-risk group lowers the score
+or hands the request to the LLM. It reads what the patient wrote, not the
+spelling-corrected list, and a condition the patient names ("diabetes") is
+only their guess: it never answers without a matching symptom.
+"""
+import re
+
+from django.conf import settings
+
+from .cache import normalize_symptoms
+from .triage import ALLOWED_SPECIALISTS, DISEASE_SPECIALIST_MAP
+
+DEFAULTS = {
+    "ENABLED": True,
+    "CONFIDENCE_THRESHOLD": 0.85,
+}
+
+SEVERITY_ORDER = ["mild", "moderate", "severe", "emergency"]
+
+# symptom -> (specialist, severity, possible diseases, confidence)
+SYMPTOM_RULES = {
+    "fever": ("General Physician", "mild", ["Viral Fever"], 0.85),
+    "cough": ("General Physician", "mild", ["Common Cold", "Acute Bronchitis"], 0.85),
+    "cold": ("General Physician", "mild", ["Common Cold"], 0.9),
+    "runny nose": ("General Physician", "mild", ["Common Cold", "Allergic Rhinitis"], 0.9),
+    "sneezing": ("General Physician", "mild", ["Common Cold", "Allergic Rhinitis"], 0.85),
+    "sore throat": ("General Physician", "mild", ["Pharyngitis"], 0.85),
+    "body ache": ("General Physician", "mild", ["Viral Fever"], 0.85),
+    "body pain": ("General Physician", "mild", ["Viral Fever"], 0.85),
+    "fatigue": ("General Physician", "mild", ["Anemia", "Viral Infection"], 0.75),
+    "weakness": ("General Physician", "mild", ["Anemia", "Viral Infection"], 0.75),
+    "headache": ("General Physician", "mild", ["Tension Headache"], 0.8),
+    "skin rash": ("Dermatologist", "mild", ["Allergic Dermatitis", "Skin Infection"], 0.9),
+    "rash": ("Dermatologist", "mild", ["Allergic Dermatitis", "Skin Infection"], 0.9),
+    "itching": ("Dermatologist", "mild", ["Allergic Dermatitis", "Fungal Infection"], 0.9),
+    "acne": ("Dermatologist", "mild", ["Acne Vulgaris"], 0.95),
+    "pimples": ("Dermatologist", "mild", ["Acne Vulgaris"], 0.95),
+    "dandruff": ("Dermatologist", "mild", ["Seborrheic Dermatitis"], 0.95),
+    "hair fall": ("Dermatologist", "mild", ["Telogen Effluvium"], 0.9),
+    "ear pain": ("Ent Specialist", "mild", ["Otitis Media"], 0.9),
+    "ear discharge": ("Ent Specialist", "moderate", ["Otitis Media"], 0.9),
+    "blocked nose": ("Ent Specialist", "mild", ["Sinusitis"], 0.85),
+    "nasal congestion": ("Ent Specialist", "mild", ["Sinusitis"], 0.85),
+    "joint pain": ("Orthopedic", "mild", ["Arthritis"], 0.85),
+    "knee pain": ("Orthopedic", "mild", ["Osteoarthritis"], 0.9),
+    "back pain": ("Orthopedic", "mild", ["Mechanical Back Pain"], 0.85),
+    "neck pain": ("Orthopedic", "mild", ["Cervical Strain"], 0.85),
+    "acidity": ("Gastroenterologist", "mild", ["Gastritis", "GERD"], 0.9),
+    "heartburn": ("Gastroenterologist", "mild", ["GERD"], 0.9),
+    "indigestion": ("Gastroenterologist", "mild", ["Dyspepsia"], 0.9),
+    "constipation": ("Gastroenterologist", "mild", ["Functional Constipation"], 0.9),
+    "diarrhea": ("Gastroenterologist", "mild", ["Acute Gastroenteritis"], 0.85),
+    "loose motions": ("Gastroenterologist", "mild", ["Acute Gastroenteritis"], 0.85),
+    "stomach ache": ("Gastroenterologist", "mild", ["Gastritis"], 0.8),
+    "abdominal pain": ("Gastroenterologist", "mild", ["Gastritis"], 0.8),
+    "wheezing": ("Pulmonologist", "moderate", ["Asthma"], 0.85),
+    "burning urination": ("Urologist", "mild", ["Urinary Tract Infection"], 0.9),
+    "frequent urination": ("Urologist", "mild", ["Urinary Tract Infection", "Diabetes"], 0.8),
+    "irregular periods": ("Gynecologist", "mild", ["PCOS", "Hormonal Imbalance"], 0.9),
+    "period pain": ("Gynecologist", "mild", ["Dysmenorrhea"], 0.9),
+    "white discharge": ("Gynecologist", "mild", ["Vaginal Infection"], 0.9),
+    "anxiety": ("Psychiatrist", "mild", ["Anxiety Disorder"], 0.85),
+    "stress": ("Psychiatrist", "mild", ["Adjustment Disorder"], 0.8),
+    "insomnia": ("Psychiatrist", "mild", ["Insomnia"], 0.85),
+    "excessive thirst": ("Endocrinologist", "mild", ["Diabetes"], 0.8),
+    "weight gain": ("Endocrinologist", "mild", ["Hypothyroidism"], 0.75),
+}
+
+# Symptom sets that together point to one answer more strongly than alone
+COMBINATION_RULES = {
+    frozenset({"fever", "cough"}): ("General Physician", "mild", ["Viral Infection", "Common Cold", "Influenza"], 0.95),
+    frozenset({"fever", "body ache"}): ("General Physician", "mild", ["Viral Fever", "Dengue"], 0.9),
+    frozenset({"fever", "body pain"}): ("General Physician", "mild", ["Viral Fever", "Dengue"], 0.9),
+    frozenset({"fever", "cold"}): ("General Physician", "mild", ["Common Cold", "Influenza"], 0.95),
+    frozenset({"cold", "cough"}): ("General Physician", "mild", ["Common Cold"], 0.95),
+    frozenset({"fever", "sore throat"}): ("General Physician", "mild", ["Pharyngitis", "Viral Infection"], 0.9),
+    frozenset({"rash", "itching"}): ("Dermatologist", "mild", ["Allergic Dermatitis", "Urticaria"], 0.95),
+    frozenset({"skin rash", "itching"}): ("Dermatologist", "mild", ["Allergic Dermatitis", "Urticaria"], 0.95),
+    frozenset({"acidity", "heartburn"}): ("Gastroenterologist", "mild", ["GERD"], 0.95),
+}
+
+# Any of these sends the request to the LLM, whatever else matched
+RED_FLAGS = [
+    "chest pain", "chest tightness", "shortness of breath", "breathlessness",
+    "difficulty breathing", "can't breathe", "cannot breathe", "unconscious",
+    "fainting", "fainted", "seizure", "convulsion", "fits", "stiff neck",
+    "blood", "bleeding", "paralysis", "numbness", "slurred speech", "confusion",
+    "suicidal", "suicide", "self harm", "pregnant", "pregnancy", "severe",
+    "unbearable", "worst", "high fever", "poisoning", "accident", "injury",
+    "fracture", "burn", "yellow eyes", "jaundice",
+]
+
+# Words that carry no clinical meaning of their own
+FILLER_WORDS = {
+    "i", "im", "i'm", "have", "has", "having", "had", "am", "is", "are", "a", "an",
+    "the", "my", "me", "with", "since", "for", "from", "last", "past", "days",
+    "day", "weeks", "week", "hours", "hour", "months", "month", "mild", "slight",
+    "little", "bit", "some", "also", "feeling", "feel", "getting", "got", "of",
+    "in", "on", "today", "yesterday", "night", "morning", "evening", "very",
+    "continuous", "frequent", "sometimes", "lot",
+}
+
+ADVICE = {
+    "General Physician": "Consult a General Physician if symptoms persist beyond 2-3 days or worsen.",
+    "Dermatologist": "Consult a Dermatologist for an examination of the affected skin.",
+    "Ent Specialist": "Consult an ENT Specialist for an ear, nose and throat examination.",
+    "Orthopedic": "Consult an Orthopedic specialist for an examination of the affected joint or area.",
+    "Gastroenterologist": "Consult a Gastroenterologist if symptoms persist or keep recurring.",
+    "Pulmonologist": "Consult a Pulmonologist for a breathing assessment.",
+    "Urologist": "Consult a Urologist; a urine test may be advised.",
+    "Gynecologist": "Consult a Gynecologist for an evaluation.",
+    "Psychiatrist": "Consult a Psychiatrist to talk through these symptoms.",
+    "Endocrinologist": "Consult an Endocrinologist; blood tests may be advised.",
+    "Neurologist": "Consult a Neurologist for an evaluation.",
+    "Cardiologist": "Consult a Cardiologist for an evaluation.",
+}
+
+
+def _canonical_specialist(name):
+    # DISEASE_SPECIALIST_MAP spells some specialists differently from the prompt
+    for allowed in ALLOWED_SPECIALISTS:
+        if allowed.lower() == name.lower():
+            return allowed
+    return name
+
+
+def _disease_rules():
+    rules = {}
+    for disease, specialist in DISEASE_SPECIALIST_MAP.items():
+        rules[disease] = (_canonical_specialist(specialist), "moderate", [disease.title()], 0.85)
+    return rules
+
+
+def _alternation(phrases):
+    # Longest first so "skin rash" wins over "rash"
+    ordered = sorted(phrases, key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(re.escape(p) for p in ordered) + r")\b")
+
+
+class RuleEngine:
+    def __init__(self, symptom_rules, combination_rules, red_flags):
+        self.symptom_rules = symptom_rules
+        self.rules = {**_disease_rules(), **symptom_rules}
+        self.combinations = combination_rules
+        self._rule_pattern = _alternation(self.rules)
+        self._red_flag_pattern = _alternation(red_flags)
+
+    def score(self, symptoms, age=None):
+        """Best local answer as ``(confidence, reply)``, or ``(0.0, None)``."""
+        phrases = normalize_symptoms(symptoms)
+        if not phrases:
+            return 0.0, None
+        text = " | ".join(phrases)
+        if self._red_flag_pattern.search(text):
+            return 0.0, None
+
+        matched, content_words, covered_words = [], 0, 0
+        for phrase in phrases:
+            words = [w for w in re.findall(r"[a-z']+", phrase) if w not in FILLER_WORDS]
+            content_words += len(words)
+            for match in self._rule_pattern.finditer(phrase):
+                matched.append(match.group(1))
+                covered_words += len(match.group(1).split())
+        if not any(name in self.symptom_rules for name in matched):
+            return 0.0, None
+        # Words we could not explain might change the diagnosis
+        coverage = min(1.0, covered_words / content_words) if content_words else 1.0
+
+        matched_set = frozenset(matched)
+        combination = self.combinations.get(matched_set)
+        if combination is not None:
+            specialist, severity, diseases, confidence = combination
+        else:
+            hits = [self.rules[name] for name in dict.fromkeys(matched)]
+            specialists = {hit[0] for hit in hits}
+            best = max(hits, key=lambda hit: hit[3])
+            specialist = best[0]
+            severity = max((hit[1] for hit in hits), key=SEVERITY_ORDER.index)
+            diseases = list(dict.fromkeys(d for hit in hits if hit[0] == specialist for d in hit[2]))
+            confidence = min(hit[3] for hit in hits)
+            if len(specialists) > 1:
+                confidence *= 0.6
+            elif len(hits) > 1:
+                confidence *= 0.95
+
+        confidence *= coverage
+        try:
+            age = int(age)
+            if age < 5 or age >= 65:
+                # Pediatric and geriatric patients get the LLM's fuller reasoning
+                confidence *= 0.8
+        except (TypeError, ValueError):
+            pass
+
+        return round(confidence, 3), {
+            "possible_diseases": diseases,
+            "severity": severity,
+            "doctor_recommendation": specialist,
+            "advice": ADVICE.get(specialist, f"Consult a {specialist}."),
+        }
+
+
+engine = RuleEngine(SYMPTOM_RULES, COMBINATION_RULES, RED_FLAGS)
+config = {**DEFAULTS, **getattr(settings, "TRIAGE_RULES", {})}
+
+
+def local_triage(info):
+    """Reply from the rule engine if it is confident enough, else ``None``."""
+    if not config["ENABLED"]:
+        return None
+    # The patient's own words; normalized_symptoms may hold a corrected guess
+    confidence, reply = engine.score(info["symptoms"], info["age"])
+    if reply is None or confidence < config["CONFIDENCE_THRESHOLD"]:
+        return None
+    reply["source"] = "rules"
+    reply["confidence"] = confidence
+    return reply
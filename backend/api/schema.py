@@ -0,0 +1,231 @@
+"""
+Declarative request validation.
+
+A ``Schema`` lists its fields once, at import time; ``validate(data)`` then
+reads, coerces and checks every field in a single pass and returns the
+cleaned values together with *all* field errors, so a client fixing a form
+sees every problem at once::
+
+    PATIENT = Schema(
+        age=Integer(gt=0, lt=120),
+        gender=String(choices={"male", "female", "trans"}, lower=True),
+        symptoms=Any(required=True),
+    )
+    values, errors = PATIENT.validate(data)  # errors: {"age": "..."} or None
+
+``data`` may be a dict or a ``QueryDict`` (``request.GET``). Coerced values
+are what the views use afterwards; nothing is parsed twice.
+"""
+import datetime
+import math
+
+MISSING = object()
+
+
+class Field:
+    """Base field: ``None`` (and ``empty`` values) count as not given."""
+
+    empty = (None,)
+    default_message = "Invalid {name} value: {value}."
+
+    def __init__(self, required=False, default=None, message=None, required_message=None):
+        self.required = required
+        self.default = default
+        self.message = message or self.default_message
+        self.required_message = required_message or "{name} is required."
+
+    def coerce(self, value):
+        """Return the cleaned value or raise ``ValueError``/``TypeError``."""
+        return value
+
+    def clean(self, name, value):
+        """``(value, None)`` or ``(None, message)``."""
+        if value is MISSING or value in self.empty:
+            if self.required:
+                return None, self.required_message.format(name=name, value=value)
+            return self.default, None
+        try:
+            return self.coerce(value), None
+        except (ValueError, TypeError):
+            return None, self.message.format(name=name, value=value)
+
+
+class _Bounded(Field):
+    def __init__(self, gt=None, ge=None, lt=None, le=None, clamp=False, **kwargs):
+        super().__init__(**kwargs)
+        self.gt, self.ge, self.lt, self.le = gt, ge, lt, le
+        self.clamp = clamp
+
+    def bounded(self, number):
+        if self.clamp:
+            if self.ge is not None:
+                number = max(number, self.ge)
+            if self.le is not None:
+                number = min(number, self.le)
+            return number
+        if (
+            (self.gt is not None and number <= self.gt)
+            or (self.ge is not None and number < self.ge)
+            or (self.lt is not None and number >= self.lt)
+            or (self.le is not None and number > self.le)
+        ):
+            raise ValueError(number)
+        return number
+
+
+class Integer(_Bounded):
+    default_message = "{name} must be an integer."
+
+    def coerce(self, value):
+        if isinstance(value, bool):
+            raise TypeError(value)
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(value)
+        return self.bounded(int(value))
+
+
+class Number(_Bounded):
+    default_message = "{name} must be a number."
+
+    def coerce(self, value):
+        if isinstance(value, bool):
+            raise TypeError(value)
+        number = float(value)
+        if not math.isfinite(number):
+            raise ValueError(value)
+        return self.bounded(number)
+
+
+class String(Field):
+    """Text, stripped unless ``strip=False``; blank counts as not given."""
+
+    empty = (None, "")
+    default_message = "{name} must be text."
+
+    def __init__(self, choices=None, lower=False, max_length=None, strip=True, **kwargs):
+        super().__init__(**kwargs)
+        self.strip = strip
+        self.choices = frozenset(choices) if choices is not None else None
+        self.lower = lower
+        self.max_length = max_length
+
+    def coerce(self, value):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        if self.strip:
+            value = value.strip()
+        if self.lower:
+            value = value.lower()
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(value)
+        if self.max_length is not None and len(value) > self.max_length:
+            raise ValueError(value)
+        return value
+
+    def clean(self, name, value):
+        if isinstance(value, str) and not value.strip():
+            value = ""
+        return super().clean(name, value)
+
+
+class Email(String):
+    """An address with one ``@`` and a dot in the domain, lower-cased."""
+
+    default_message = "{name} must be an email address."
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("max_length", 254)
+        super().__init__(lower=True, **kwargs)
+
+    def coerce(self, value):
+        value = super().coerce(value)
+        local, at, domain = value.partition("@")
+        if not local or not at or "@" in domain or "." not in domain.strip(".") or " " in value:
+            raise ValueError(value)
+        return value
+
+
+class Boolean(Field):
+    """JSON booleans, or ``true``/``false``, ``yes``/``no``, ``1``/``0`` as text."""
+
+    empty = (None, "")
+    default_message = "{name} must be true or false."
+    TRUE = frozenset({"true", "yes", "1", "y", "t"})
+    FALSE = frozenset({"false", "no", "0", "n", "f"})
+
+    def coerce(self, value):
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in self.TRUE:
+            return True
+        if text in self.FALSE:
+            return False
+        raise ValueError(value)
+
+
+class Date(Field):
+    """``YYYY-MM-DD`` as a ``datetime.date``."""
+
+    empty = (None, "")
+    default_message = "{name} must be a date (YYYY-MM-DD)."
+
+    def coerce(self, value):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        return datetime.date.fromisoformat(value.strip())
+
+
+class DateTime(Field):
+    """ISO 8601 timestamp with a UTC offset (or ``Z``) as an aware ``datetime``."""
+
+    empty = (None, "")
+    default_message = "{name} must be an ISO 8601 date and time with a time zone."
+
+    def coerce(self, value):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        parsed = datetime.datetime.fromisoformat(value.strip())
+        if parsed.tzinfo is None:
+            raise ValueError(value)
+        return parsed
+
+
+class Any(Field):
+    """Passed through unchanged, optionally restricted to ``types``."""
+
+    empty = (None, "", [], {})
+
+    def __init__(self, types=None, **kwargs):
+        super().__init__(**kwargs)
+        self.types = types
+
+    def coerce(self, value):
+        if self.types is not None and not isinstance(value, self.types):
+            raise TypeError(value)
+        return value
+
+
+class Schema:
+    def __init__(self, **fields):
+        self.fields = tuple(fields.items())
+
+    def validate(self, data):
+        """``(values, None)`` or ``(None, {field: message, ...})``."""
+        if not hasattr(data, "get"):
+            return None, {"body": "Expected a JSON object."}
+        values, errors = {}, None
+        for name, field in self.fields:
+            value, error = field.clean(name, data.get(name, MISSING))
+            if error is not None:
+                if errors is None:
+                    errors = {}
+                errors[name] = error
+            else:
+                values[name] = value
+        return (None, errors) if errors else (values, None)
+
+
+def error_body(errors):
+    """Response body for failed validation; ``error`` keeps older clients working."""
+    return {"error": " ".join(errors.values()), "errors": errors}
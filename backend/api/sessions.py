@@ -0,0 +1,300 @@
+"""
+Write-behind pipeline for ``symptom_sessions`` rows.
+
+Requests only enqueue the session record (with the caller's ``auth_id``) and
+return. A background thread per worker drains the queue in batches: it
+resolves ``patient_id`` for every ``auth_id`` in the batch with one
+``patients`` query, then bulk-inserts the rows, flushing when ``BATCH_SIZE``
+records are waiting or ``FLUSH_INTERVAL`` seconds have passed. Failed
+batches are retried with exponential backoff.
+
+Every record gets a ``write_id`` when it is queued, and rows are upserted on
+it with duplicates ignored, so a retry after an insert that did land (a read
+timeout, say) writes nothing twice. The column needs a unique index (see the
+README).
+
+Records that cannot be written (retries exhausted, queue full, or still
+queued when the process exits) are appended to a JSONL spool file under
+``SPOOL_DIR``; the next worker to start replays and removes it, along with
+files left half-replayed by a worker that died. Lines that cannot be read
+back (a write torn by a crash) are moved to a ``.bad`` file next to it.
+"""
+import atexit
+import glob
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from . import codec, db, metrics
+
+DEFAULTS = {
+    "BATCH_SIZE": 100,
+    "FLUSH_INTERVAL": 2.0,
+    "MAX_QUEUE": 10000,
+    "MAX_RETRIES": 4,
+    "RETRY_BACKOFF": 0.5,
+    "SPOOL_DIR": os.path.join(settings.BASE_DIR, "spool"),
+}
+
+SPOOL_PREFIX = "symptom_sessions"
+WRITE_ID = "write_id"
+
+_CLAIMED = re.compile(r"\.replay-(\d+)$")
+
+
+def _with_write_id(record):
+    if WRITE_ID in record:
+        return record
+    return {**record, WRITE_ID: str(uuid.uuid4())}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by someone else
+    return True
+
+
+class SessionWriter:
+    def __init__(self, client_factory, config=None):
+        self._client_factory = client_factory
+        self.config = {**DEFAULTS, **(config or {})}
+        self._queue = queue.Queue(maxsize=int(self.config["MAX_QUEUE"]))
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._atexit_registered = False
+        self.counters = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "retries": 0,
+            "skipped_no_patient": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "quarantined": 0,
+        }
+
+    # -----------------------------
+    # Producer side
+    # -----------------------------
+    def enqueue(self, auth_id, record):
+        """Queue ``record`` for the patient with ``auth_id``; never blocks."""
+        if not auth_id:
+            return False
+        self._ensure_started()
+        item = {"auth_id": auth_id, "record": _with_write_id(record)}
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._spool([item])
+            return False
+        self._count("enqueued")
+        return True
+
+    def enqueue_many(self, items):
+        """Queue ``(auth_id, record)`` pairs; the writer inserts them in bulk."""
+        items = [{"auth_id": auth_id, "record": _with_write_id(record)} for auth_id, record in items if auth_id]
+        if not items:
+            return 0
+        self._ensure_started()
+        queued = 0
+        for item in items:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._spool(items[queued:])
+                break
+            queued += 1
+        self._count("enqueued", queued)
+        return queued
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so gunicorn workers started from a
+        # preloaded master each get their own writer thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    # -----------------------------
+    # Worker side
+    # -----------------------------
+    def _run(self):
+        try:
+            self._replay_spool()
+        except Exception as e:
+            # The queue still has to be drained
+            metrics.swallowed("session_replay", f"Failed to replay spooled symptom sessions: {e}")
+        batch_size = int(self.config["BATCH_SIZE"])
+        interval = float(self.config["FLUSH_INTERVAL"])
+        while not self._stopping.is_set():
+            batch = []
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or self._stopping.is_set():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_with_retries(batch)
+
+    def _write(self, batch):
+        # One patients query for the auth ids not already in the lookup cache
+        patients = db.patient_ids_for(item["auth_id"] for item in batch)
+        rows = []
+        for item in batch:
+            patient_id = patients.get(item["auth_id"])
+            if patient_id is None:
+                # Same outcome as before: no patient profile, no session row
+                self._count("skipped_no_patient")
+                continue
+            rows.append({**item["record"], "patient_id": patient_id})
+        if rows:
+            query = self._client_factory().table("symptom_sessions").upsert(
+                rows, on_conflict=WRITE_ID, ignore_duplicates=True,
+            )
+            db.execute(query, retries=0)
+        self._count("written", len(rows))
+        self._count("batches")
+
+    def _write_with_retries(self, batch):
+        retries = int(self.config["MAX_RETRIES"])
+        backoff = float(self.config["RETRY_BACKOFF"])
+        for attempt in range(retries + 1):
+            try:
+                self._write(batch)
+                return True
+            except Exception as e:
+                metrics.swallowed("session_insert", f"Failed to insert symptom sessions (attempt {attempt + 1}): {e}")
+                if attempt == retries or self._stopping.is_set():
+                    break
+                self._count("retries")
+                self._stopping.wait(backoff * (2 ** attempt))
+        self._spool(batch)
+        return False
+
+    # -----------------------------
+    # Spool file
+    # -----------------------------
+    def _spool_path(self):
+        return os.path.join(self.config["SPOOL_DIR"], f"{SPOOL_PREFIX}.{os.getpid()}.jsonl")
+
+    def _spool(self, items):
+        if not items:
+            return
+        try:
+            with self._spool_lock:
+                os.makedirs(self.config["SPOOL_DIR"], exist_ok=True)
+                with open(self._spool_path(), "a", encoding="utf-8") as f:
+                    for item in items:
+                        f.write(codec.dumps_str(item) + "\n")
+            self._count("spooled", len(items))
+        except OSError as e:
+            metrics.swallowed("session_spool", f"Failed to spool {len(items)} symptom sessions: {e}")
+
+    def _claimable(self):
+        """Spool files to replay: unclaimed ones, and claims of dead workers."""
+        directory = self.config["SPOOL_DIR"]
+        for path in glob.glob(os.path.join(directory, f"{SPOOL_PREFIX}.*.jsonl")):
+            yield path
+        for path in glob.glob(os.path.join(directory, f"{SPOOL_PREFIX}.*.jsonl.replay-*")):
+            match = _CLAIMED.search(path)
+            if match and not _pid_alive(int(match.group(1))):
+                yield path
+
+    def _read_spool(self, path):
+        """Spooled items in ``path``; unreadable lines go to ``<path>.bad``."""
+        items, bad = [], []
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    item = codec.loads(line)
+                except codec.DecodeError:
+                    item = None
+                if isinstance(item, dict) and item.get("auth_id") and isinstance(item.get("record"), dict):
+                    items.append({**item, "record": _with_write_id(item["record"])})
+                else:
+                    bad.append(line if line.endswith("\n") else line + "\n")
+        if bad:
+            quarantine = f"{_CLAIMED.sub('', path)}.bad"
+            with open(quarantine, "a", encoding="utf-8") as f:
+                f.writelines(bad)
+            self._count("quarantined", len(bad))
+            metrics.swallowed("session_spool_line", f"Moved {len(bad)} unreadable spool lines to {quarantine}")
+        return items
+
+    def _replay_spool(self):
+        """Re-queue records spooled by earlier (or crashed) workers."""
+        for path in self._claimable():
+            claimed = f"{_CLAIMED.sub('', path)}.replay-{os.getpid()}"
+            try:
+                # rename is atomic, so only one worker replays each file
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                items = self._read_spool(claimed)
+            except OSError as e:
+                metrics.swallowed("session_replay", f"Failed to read spool file {claimed}: {e}")
+                continue
+            batch_size = int(self.config["BATCH_SIZE"])
+            for start in range(0, len(items), batch_size):
+                # Batches that fail again are re-spooled under this pid
+                self._write_with_retries(items[start:start + batch_size])
+            os.remove(claimed)
+            self._count("replayed", len(items))
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def pending(self):
+        return self._queue.qsize()
+
+    def shutdown(self, timeout=5.0):
+        """Stop the worker and spool anything it did not get to write."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._spool(leftover)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending": self.pending()}
+
+
+session_writer = SessionWriter(db.get_supabase, getattr(settings, "SESSION_WRITER", None))
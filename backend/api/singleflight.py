@@ -0,0 +1,110 @@
+"""
+In-process single-flight coalescing.
+
+Retries, double submits and kiosk bursts send the same triage request while
+the first one is still waiting on Gemini. Calls made through ``flights.do``
+(threads) or ``flights.do_async`` (event loop) with the same key while one
+is in flight wait for that call and get a copy of its result instead of
+starting their own. Keys are ``(kind, ...)`` tuples; counters are kept per
+kind so ``stats()`` shows how many generations and doctor queries were
+saved.
+"""
+import asyncio
+import copy
+import threading
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+        self._async_calls = {}  # key -> Future on the loop that started it
+        self.counters = {}  # kind -> {"calls", "coalesced", "errors"}
+
+    def _count(self, key, name):
+        with self._lock:
+            counters = self.counters.setdefault(key[0], {"calls": 0, "coalesced": 0, "errors": 0})
+            counters[name] += 1
+
+    def do(self, key, fn):
+        """``fn()``, or a copy of the result of the identical call in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self._count(key, "coalesced")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        self._count(key, "calls")
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            self._count(key, "errors")
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        # Waiters copy the stored result, so the caller may mutate its own
+        return copy.deepcopy(call.result)
+
+    async def do_async(self, key, coro_fn):
+        """Awaitable counterpart of ``do`` for calls on the same event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            future = self._async_calls.get(key)
+            if future is None or future.get_loop() is not loop:
+                break
+            self._count(key, "coalesced")
+            try:
+                # shield: a waiter that is cancelled must not cancel the leader
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled, not us: run the call ourselves
+
+        future = loop.create_future()
+        self._async_calls[key] = future
+        self._count(key, "calls")
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self._count(key, "errors")
+            future.set_exception(e)
+            # Mark retrieved so a failure nobody waited for is not logged
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return copy.deepcopy(result)
+        finally:
+            if self._async_calls.get(key) is future:
+                del self._async_calls[key]
+
+    def stats(self):
+        with self._lock:
+            kinds = {kind: dict(counters) for kind, counters in self.counters.items()}
+            in_flight = len(self._calls)
+        return {**kinds, "in_flight": in_flight + len(self._async_calls)}
+
+
+flights = SingleFlight()
@@ -0,0 +1,259 @@
+"""
+Specialty normalization.
+
+Gemini's ``doctor_recommendation`` is free text: "Ent Specialist", "ENT
+(Otolaryngologist)", "Gastroentrologist", "Cardiologist or General
+Physician". The vocabulary below maps each way of naming a specialty, from
+the prompt's allowed list and from ``specialties.name`` in the database, to
+one canonical id. The doctor directory keys doctors by those ids, so a
+lookup is an exact dict hit instead of a substring scan.
+
+Everything is compiled once at import. Text that is not a known alias is
+split into one or more specialty mentions; each one is then matched exactly,
+by a known alias inside it, or by edit distance against aliases that share
+character trigrams with it. Results are memoized per input string.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+Specialty = namedtuple("Specialty", ("id", "name", "search", "aliases"))
+
+# id, display name (as in the prompt's allowed list where it has one),
+# substring for the Supabase ilike fallback, aliases
+VOCABULARY = [
+    Specialty("general-physician", "General Physician", "general", (
+        "general physician", "general practitioner", "general practioneer", "gp",
+        "physician", "family physician", "family medicine", "family doctor",
+        "general medicine", "general",
+    )),
+    Specialty("internal-medicine", "Internal Medicine", "internal", (
+        "internal medicine", "internist",
+    )),
+    Specialty("cardiology", "Cardiologist", "cardio", (
+        "cardiologist", "cardiology", "cardiac", "heart", "cardiac surgeon",
+    )),
+    Specialty("neurology", "Neurologist", "neuro", (
+        "neurologist", "neurology", "neuro", "brain", "nerve", "neurosurgeon",
+    )),
+    Specialty("pulmonology", "Pulmonologist", "pulmo", (
+        "pulmonologist", "pulmonology", "chest physician", "chest", "lung",
+        "respiratory", "respiratory medicine",
+    )),
+    Specialty("ent", "Ent Specialist", "ent", (
+        "ent", "ear nose throat", "otolaryngologist", "otolaryngology",
+        "otorhinolaryngologist", "otorhinolaryngology",
+    )),
+    Specialty("gastroenterology", "Gastroenterologist", "gastro", (
+        "gastroenterologist", "gastroenterology", "gastro", "stomach", "digestive",
+        "hepatologist", "hepatology",
+    )),
+    Specialty("dermatology", "Dermatologist", "derma", (
+        "dermatologist", "dermatology", "derma", "skin", "cosmetologist",
+        "venereologist",
+    )),
+    Specialty("orthopedics", "Orthopedic", "ortho", (
+        "orthopedic", "orthopaedic", "orthopedics", "orthopaedics", "orthopedist",
+        "orthopedic surgeon", "ortho", "bone", "joint",
+    )),
+    Specialty("endocrinology", "Endocrinologist", "endocrin", (
+        "endocrinologist", "endocrinology", "diabetologist", "diabetes", "thyroid",
+        "hormone",
+    )),
+    Specialty("psychiatry", "Psychiatrist", "psychiat", (
+        "psychiatrist", "psychiatry", "psychologist", "psychology", "mental health",
+        "counsellor", "counselor",
+    )),
+    Specialty("gynecology", "Gynecologist", "gyn", (
+        "gynecologist", "gynaecologist", "gynecology", "gynaecology", "obstetrician",
+        "obgyn", "ob gyn", "obstetrics", "womens health",
+    )),
+    Specialty("urology", "Urologist", "urolog", (
+        "urologist", "urology", "urinary",
+    )),
+    # Not offered by the triage prompt but present in the doctors roster
+    Specialty("pediatrics", "Pediatrician", "pediatric", (
+        "pediatrician", "paediatrician", "pediatrics", "paediatrics", "child",
+        "children", "child specialist",
+    )),
+    Specialty("nephrology", "Nephrologist", "nephro", (
+        "nephrologist", "nephrology", "kidney",
+    )),
+    Specialty("ophthalmology", "Ophthalmologist", "ophthalm", (
+        "ophthalmologist", "ophthalmology", "eye", "eye surgeon",
+    )),
+    Specialty("oncology", "Oncologist", "oncolog", (
+        "oncologist", "oncology", "cancer",
+    )),
+    Specialty("dentistry", "Dentist", "dent", (
+        "dentist", "dentistry", "dental", "dental surgeon",
+    )),
+]
+
+BY_ID = {specialty.id: specialty for specialty in VOCABULARY}
+
+# Words that do not change which specialty is meant
+FILLER_WORDS = {
+    "a", "an", "the", "see", "visit", "consult", "consultation", "with", "to",
+    "specialist", "specialists", "doctor", "doctors", "dr", "department", "dept",
+    "clinic", "expert", "possibly", "preferably", "urgent", "urgently", "immediately",
+    "first", "then", "also", "maybe", "e", "g", "eg", "s",
+}
+
+# Multi-word names that contain a separator, rewritten before splitting
+_COMPOUNDS = [
+    (re.compile(r"\bear,?\s*nose,?\s*(and|&)?\s*throat\b"), "ent"),
+    (re.compile(r"\bob\s*/\s*gyn\b"), "obgyn"),
+    (re.compile(r"\bwomen'?s\b"), "womens"),
+]
+_SEPARATORS = re.compile(r",|;|/|&|\+|\(|\)|\[|\]|\bor\b|\band\b|\bthen\b|\n")
+_NON_WORD = re.compile(r"[^a-z]+")
+
+MAX_MENTIONS = 3
+
+
+def clean(text):
+    """Lowercased words of ``text`` with filler words removed."""
+    words = _NON_WORD.sub(" ", str(text or "").lower()).split()
+    return " ".join(w for w in words if w not in FILLER_WORDS)
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance, or ``limit + 1`` once it exceeds ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _max_distance(text):
+    # Short aliases ("ent", "gp") must match exactly
+    if len(text) < 5:
+        return 0
+    return 1 if len(text) < 9 else 2
+
+
+class SpecialtyNormalizer:
+    def __init__(self, vocabulary):
+        self.aliases = {}  # cleaned alias -> specialty id
+        for specialty in vocabulary:
+            for alias in (specialty.name,) + specialty.aliases:
+                self.aliases.setdefault(clean(alias), specialty.id)
+        self.aliases.pop("", None)
+        self._trigram_index = {}  # trigram -> aliases containing it
+        for alias in self.aliases:
+            for gram in _trigrams(alias):
+                self._trigram_index.setdefault(gram, []).append(alias)
+        self._longest_alias = max(len(alias.split()) for alias in self.aliases)
+        self._normalize_text = lru_cache(maxsize=4096)(self._normalize)
+
+    def _fuzzy(self, text):
+        limit = _max_distance(text)
+        if not limit:
+            return None
+        grams = _trigrams(text)
+        shared = {}
+        for gram in grams:
+            for alias in self._trigram_index.get(gram, ()):
+                shared[alias] = shared.get(alias, 0) + 1
+        # A typo leaves most trigrams intact; only those candidates are scored
+        needed = len(grams) / 2
+        best, best_distance = None, limit + 1
+        for alias, count in shared.items():
+            if count < needed or abs(len(alias) - len(text)) > limit:
+                continue
+            alias_limit = min(best_distance - 1, _max_distance(alias))
+            if alias_limit <= 0:
+                continue
+            distance = edit_distance(text, alias, alias_limit)
+            if distance <= alias_limit:
+                best, best_distance = alias, distance
+        return self.aliases[best] if best is not None else None
+
+    def _scan(self, words):
+        """Ids of aliases found inside ``words``, longest phrases first."""
+        found, i = [], 0
+        while i < len(words):
+            for size in range(min(self._longest_alias, len(words) - i), 0, -1):
+                phrase = " ".join(words[i:i + size])
+                specialty_id = self.aliases.get(phrase) or (
+                    self._fuzzy(phrase) if size == 1 else None
+                )
+                if specialty_id:
+                    found.append(specialty_id)
+                    i += size
+                    break
+            else:
+                i += 1
+        return found
+
+    def _mention(self, text):
+        text = clean(text)
+        if not text:
+            return []
+        specialty_id = self.aliases.get(text) or self._fuzzy(text)
+        if specialty_id:
+            return [specialty_id]
+        return self._scan(text.split())
+
+    def _normalize(self, text):
+        text = str(text or "").lower()
+        for pattern, replacement in _COMPOUNDS:
+            text = pattern.sub(replacement, text)
+        ids = []
+        for part in _SEPARATORS.split(text):
+            for specialty_id in self._mention(part):
+                if specialty_id not in ids:
+                    ids.append(specialty_id)
+        return tuple(ids[:MAX_MENTIONS])
+
+    def normalize(self, text):
+        """Canonical ids mentioned in ``text``.
+
+        The model sometimes answers with a list of specialties; its items are
+        read in order. Other values that are not strings are read as
+        ``str()``, so they never reach the memo unhashable.
+        """
+        if isinstance(text, (list, tuple)):
+            ids = []
+            for item in text:
+                for specialty_id in self.normalize(item):
+                    if specialty_id not in ids:
+                        ids.append(specialty_id)
+            return tuple(ids[:MAX_MENTIONS])
+        if text is not None and not isinstance(text, str):
+            text = str(text)
+        return self._normalize_text(text)
+
+    def primary(self, text):
+        ids = self.normalize(text)
+        return BY_ID[ids[0]] if ids else None
+
+
+normalizer = SpecialtyNormalizer(VOCABULARY)
+
+
+def normalize(text):
+    """Canonical specialty ids mentioned in ``text``, most relevant first."""
+    return normalizer.normalize(text)
+
+
+def canonical_name(text):
+    """Display name of the main specialty in ``text``, or ``None``."""
+    specialty = normalizer.primary(text)
+    return specialty.name if specialty else None
@@ -0,0 +1,81 @@
+"""
+Server-Sent Events helpers for the streaming analyze-symptoms mode.
+"""
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+
+from . import codec, metrics
+
+
+def wants_event_stream(request):
+    """True if the client asked for SSE (``Accept`` header or ``?stream=1``)."""
+    if request.GET.get("stream") in ("1", "true"):
+        return True
+    return "text/event-stream" in request.META.get("HTTP_ACCEPT", "")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {codec.dumps_str(data)}\n\n"
+
+
+class EventStream:
+    """Iterable of SSE chunks that runs deferred work once the stream closes.
+
+    The WSGI/ASGI handler calls ``close()`` after the last chunk has been
+    sent, so callbacks queued in ``after_close`` (e.g. the session insert)
+    never hold up the events the client is waiting for.
+    """
+
+    def __init__(self, events, after_close=None):
+        self._events = events
+        self.after_close = after_close if after_close is not None else []
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def close(self):
+        close_events = getattr(self._events, "close", None)
+        if close_events:
+            close_events()
+        for callback in self.after_close:
+            try:
+                callback()
+            except Exception as e:
+                metrics.swallowed("stream_callback", f"Deferred stream callback failed: {e}")
+
+
+class AsyncEventStream(EventStream):
+    """``EventStream`` for the ASGI handler.
+
+    It is only async-iterable, so Django does not read it into a list
+    first: each event is produced off the event loop and sent as soon as it
+    is ready.
+    """
+
+    __iter__ = None
+
+    def __aiter__(self):
+        return off_loop(self._events)
+
+
+async def off_loop(blocks):
+    """Async iterator over a blocking iterator, one ``next()`` per thread hop.
+
+    Django serves a plain iterator on ASGI by reading it into a list first,
+    which would hold the whole response in memory.
+    """
+    iterator = iter(blocks)
+    done = object()
+    while True:
+        block = await sync_to_async(next, thread_sensitive=False)(iterator, done)
+        if block is done:
+            return
+        yield block
+
+
+def event_stream_response(stream):
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx-style proxies from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
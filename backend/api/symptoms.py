@@ -0,0 +1,289 @@
+"""
+Server-side symptom normalization.
+
+The chatbot cleans up input in the browser, but ``analyze-symptoms`` is also
+called directly, so the API derives a canonical complaint list from
+``symptoms`` itself, for the triage cache key and the prompt: the text is
+split into complaints, known misspellings are corrected, and Hinglish or
+colloquial phrasings are collapsed to one canonical name ("bukhar", "high
+temperature" -> "fever"). Words that are not recognised are kept, so
+durations and qualifiers ("since 3 days", "severe") are not lost. The model
+is shown the list next to what the patient wrote, never instead of it, and
+the session stores only the patient's words.
+
+Correction is deliberately conservative, because a plain English word that
+is one letter away from a clinical term ("heart" / "heat", "tongue" /
+"dengue") must never become that term. A word is only changed when it is
+
+* a known typo from the frontend's ``medical_dictionary.json``, or
+* at least ``MIN_FUZZY_LENGTH`` letters long and exactly one dropped,
+  doubled, extra or swapped letter away from a single vocabulary word.
+
+Words of the vocabulary, ``COMMON_WORDS`` and ``PROTECTED_WORDS`` are kept
+as they are, and a substituted letter is never treated as a typo: it is how
+real words turn into other real words ("painting" / "fainting").
+
+Candidates are found with a symmetric-delete index (as in SymSpell): every
+vocabulary word is stored under each string obtained by deleting one of its
+characters, and a query only generates its own deletes and looks them up,
+so the cost depends on the word's length, not on the size of the
+vocabulary. The dictionary is resolved against the canonical phrases once,
+when the normalizer is first used (or by the worker warm-up), so the known
+typos (including split or merged words) are single dict hits.
+"""
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+
+from . import metrics
+from .specialties import edit_distance
+
+DEFAULTS = {
+    "ENABLED": True,
+    "DICTIONARY": os.path.join(
+        settings.BASE_DIR.parent, "react-frontend", "src", "data", "medical_dictionary.json",
+    ),
+    # Shortest unknown word that may be corrected without a dictionary entry
+    "MIN_FUZZY_LENGTH": 7,
+}
+
+# Canonical terms, the base lists of react-frontend/src/scripts/generate_med_dict.ts
+# plus the complaints used by the triage rules
+SYMPTOMS = [
+    "fever", "cough", "cold", "sore throat", "headache", "nausea", "vomiting", "diarrhea",
+    "fatigue", "dizziness", "shortness of breath", "chest pain", "abdominal pain", "back pain",
+    "joint pain", "muscle pain", "rash", "itching", "sneezing", "runny nose", "loss of smell",
+    "loss of taste", "chills", "night sweats", "weight loss", "weight gain", "constipation",
+    "urinary frequency", "burning urination", "blood in urine", "numbness", "tingling",
+    "blurred vision", "eye pain", "ear pain", "hearing loss", "tinnitus", "palpitations",
+    "anxiety", "depression", "insomnia", "menstrual pain", "irregular periods", "infertility",
+    "breast pain", "breast lump", "hair loss", "dry skin", "oily skin", "acne", "swelling",
+    "edema", "cold intolerance", "heat intolerance", "excessive thirst", "polyuria",
+    "bloating", "acid reflux", "heartburn", "indigestion", "hiccups",
+    "body ache", "skin rash", "weakness", "neck pain", "knee pain", "leg pain", "stomach ache",
+    "acidity", "ear discharge", "blocked nose", "nasal congestion", "wheezing", "stress",
+    "frequent urination", "period pain", "white discharge", "dandruff", "pimples", "hair fall",
+    "toothache", "bleeding", "fainting", "seizure", "stiff neck", "confusion", "jaundice",
+]
+CONDITIONS = [
+    "common cold", "influenza", "covid-19", "urinary tract infection", "uti", "gastroenteritis",
+    "migraine", "tension headache", "hypertension", "diabetes", "type 1 diabetes",
+    "type 2 diabetes", "asthma", "bronchitis", "pneumonia", "bronchiectasis", "tuberculosis",
+    "pneumothorax", "anemia", "iron deficiency anemia", "allergic rhinitis", "sinusitis",
+    "otitis media", "conjunctivitis", "eczema", "psoriasis", "urticaria", "cellulitis",
+    "dermatitis", "appendicitis", "cholecystitis", "peptic ulcer disease", "gallstones",
+    "kidney stones", "renal colic", "osteoarthritis", "rheumatoid arthritis", "arthritis",
+    "allergy", "dengue", "malaria", "typhoid",
+]
+BODY_PARTS = [
+    "head", "chest", "abdomen", "stomach", "back", "neck", "throat", "ear", "eye", "nose", "leg",
+    "arm", "knee", "hip", "shoulder", "wrist", "ankle", "pelvis", "groin", "genitals",
+    "urinary tract", "urine", "bladder", "kidney", "skin", "body", "tooth", "teeth",
+]
+
+# Colloquial and Hinglish phrasings -> canonical term (after spelling correction)
+SYNONYMS = {
+    "bukhar": "fever", "bukhaar": "fever", "high temperature": "fever", "high temp": "fever",
+    "feverish": "fever",
+    "khasi": "cough", "khaasi": "cough", "khansi": "cough", "coughing": "cough",
+    "sardi": "cold", "jukaam": "cold", "zukam": "cold",
+    "sirdard": "headache", "sir dard": "headache", "head pain": "headache", "head ache": "headache",
+    "pet dard": "abdominal pain", "stomach pain": "abdominal pain", "tummy ache": "abdominal pain",
+    "belly pain": "abdominal pain",
+    "pet mein jalan": "acidity", "acid reflux": "acidity",
+    "chakkar": "dizziness", "dizzy": "dizziness", "giddiness": "dizziness",
+    "kharash": "sore throat", "throat pain": "sore throat",
+    "peshab mein jalan": "burning urination", "peshab karte waqt jalan": "burning urination",
+    "painful urination": "burning urination", "pain while urinating": "burning urination",
+    "loose motions": "diarrhea", "loose motion": "diarrhea", "diarrhoea": "diarrhea",
+    "vomit": "vomiting", "throwing up": "vomiting", "ulti": "vomiting",
+    "breathlessness": "shortness of breath", "saans phoolna": "shortness of breath",
+    "gardi dard": "neck pain", "gardan dard": "neck pain", "pair dard": "leg pain",
+    "kamar dard": "back pain", "body pain": "body ache", "badan dard": "body ache",
+    "tiredness": "fatigue", "tired": "fatigue", "thakan": "fatigue",
+    "itchy": "itching", "itch": "itching", "khujli": "itching",
+    "running nose": "runny nose", "nose running": "runny nose",
+    "menstrual cramps": "period pain", "menstrual pain": "period pain",
+    "hair loss": "hair fall", "sleeplessness": "insomnia",
+}
+
+# Dropped: carry no clinical meaning
+FILLER_WORDS = {
+    "i", "im", "ive", "have", "has", "having", "had", "am", "is", "are", "was", "a", "an", "the",
+    "my", "me", "mujhe", "mera", "meri", "hai", "ho", "raha", "rahi", "also", "got", "getting",
+    "feeling", "suffering", "from", "please", "pls", "doctor",
+}
+
+# Kept as-is and never "corrected" towards a similar vocabulary word
+PROTECTED_WORDS = {
+    "since", "for", "days", "day", "weeks", "week", "months", "month", "hours", "hour",
+    "years", "year", "last", "past", "severe", "mild", "moderate", "very", "high", "low",
+    "left", "right", "upper", "lower", "both", "after", "before", "when", "while", "during",
+    "at", "night", "morning", "evening", "in", "on", "of", "no", "not", "could", "can",
+    "cannot", "cant", "with", "without", "sudden", "suddenly", "continuous", "constant",
+    "frequent", "sometimes", "again", "worse", "better", "pregnant", "pregnancy", "blood",
+    "burn", "injury", "accident", "unconscious", "suicidal", "paralysis",
+}
+
+# Everyday English words that are one letter away from a vocabulary word or
+# a dictionary typo ("heart" / "heat", "hills" / "chills"): kept as written
+COMMON_WORDS = {
+    "ace", "ash", "black", "boating", "breathe", "cane", "cash", "clod", "crash", "dead",
+    "dimples", "dwelling", "eating", "elvis", "ever", "goose", "grin", "heart", "hills", "hurting",
+    "ladder", "looser", "lose", "never", "none", "noose", "painting", "point", "rain", "real",
+    "reflex", "rental", "rose", "rough", "sari", "selling", "sirdar", "smelling", "spelling",
+    "stoned", "sweating", "tinging", "tongue", "welling", "wright", "writ", "writs",
+}
+
+_SPLIT = re.compile(r",|;|\band\b|\n|\.")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_DIGITS_SUFFIX = re.compile(r"\d+$")
+
+
+def _clean(text):
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def _deletes(word):
+    """``word`` and every string obtained by deleting one of its characters."""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _one_slip(word, term):
+    """Whether ``word`` is ``term`` with one letter dropped, added or swapped.
+
+    Substitutions are left out on purpose (see the module docstring).
+    """
+    if word == term or abs(len(word) - len(term)) > 1:
+        return False
+    if len(word) == len(term) and sorted(word) != sorted(term):
+        return False
+    return edit_distance(word, term, 1) == 1
+
+
+class DeleteIndex:
+    """Symmetric-delete index over a fixed set of terms, for one-letter slips."""
+
+    def __init__(self, terms):
+        self.terms = set(terms)
+        self._index = {}  # delete -> terms it was derived from
+        for term in self.terms:
+            for deleted in _deletes(term):
+                self._index.setdefault(deleted, []).append(term)
+
+    def lookup(self, word):
+        """The only term one slip away from ``word``; ``None`` if none or several are."""
+        if word in self.terms:
+            return word
+        found = {
+            term
+            for deleted in _deletes(word)
+            for term in self._index.get(deleted, ())
+            if _one_slip(word, term)
+        }
+        return found.pop() if len(found) == 1 else None
+
+
+class SymptomNormalizer:
+    def __init__(self, terms, synonyms, dictionary_words=(), min_fuzzy_length=7):
+        self.synonyms = {_clean(k): v for k, v in synonyms.items()}
+        canonical = {_clean(term) for term in terms} | set(self.synonyms.values())
+        self.vocabulary = {word for phrase in canonical | set(self.synonyms) for word in phrase.split()}
+        self.min_fuzzy_length = min_fuzzy_length
+        self.words = DeleteIndex(self.vocabulary - PROTECTED_WORDS)
+        self.phrases = DeleteIndex(canonical | set(self.synonyms))
+        self._synonym_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(k) for k in sorted(self.synonyms, key=len, reverse=True)) + r")\b"
+        )
+        # Known typos from the frontend dictionary, resolved once. An entry
+        # that is itself a word ("ever", "hills") is not a typo to us.
+        self.known = {}
+        for entry in dictionary_words:
+            entry = _clean(_DIGITS_SUFFIX.sub("", str(entry)))
+            if not entry or entry in self.phrases.terms or self._is_word(entry):
+                continue
+            match = self.phrases.lookup(entry) or self.phrases.lookup(entry.replace(" ", ""))
+            if match:
+                self.known[entry] = match
+        self.normalize_phrase = lru_cache(maxsize=8192)(self._normalize_phrase)
+
+    def _is_word(self, word):
+        return word in self.vocabulary or word in COMMON_WORDS or word in PROTECTED_WORDS
+
+    def _correct(self, word):
+        if word in FILLER_WORDS:
+            return None
+        if word.isdigit() or self._is_word(word):
+            return word
+        if word in self.known:
+            return self.known[word]
+        if len(word) >= self.min_fuzzy_length:
+            return self.words.lookup(word) or word
+        return word
+
+    def _normalize_phrase(self, phrase):
+        phrase = _clean(phrase)
+        if not phrase:
+            return ""
+        if phrase in self.known:
+            phrase = self.known[phrase]
+        else:
+            words = (self._correct(word) for word in phrase.split())
+            phrase = " ".join(word for word in words if word)
+            phrase = self.known.get(phrase, phrase)
+        return self._synonym_pattern.sub(lambda m: self.synonyms[m.group(1)], phrase)
+
+    def normalize(self, symptoms):
+        """Canonical, de-duplicated complaint list for ``symptoms`` (text or list)."""
+        if isinstance(symptoms, str):
+            parts = _SPLIT.split(symptoms)
+        else:
+            parts = [str(s) for s in symptoms or []]
+        found = []
+        for part in parts:
+            phrase = self.normalize_phrase(part)
+            if phrase and phrase not in found:
+                found.append(phrase)
+        return found
+
+
+def _load_dictionary(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        # Backend deployed without the frontend tree: the delete index still works
+        metrics.swallowed("symptom_dictionary", f"Symptom dictionary not loaded from {path}: {e}")
+        return []
+
+
+config = {**DEFAULTS, **getattr(settings, "SYMPTOM_NORMALIZER", {})}
+_normalizer = None
+_normalizer_lock = threading.Lock()
+
+
+def get_normalizer():
+    """The shared normalizer; building it resolves the whole dictionary (~0.7 s)."""
+    global _normalizer
+    if _normalizer is None:
+        with _normalizer_lock:
+            if _normalizer is None:
+                _normalizer = SymptomNormalizer(
+                    SYMPTOMS + CONDITIONS + BODY_PARTS,
+                    SYNONYMS,
+                    _load_dictionary(config["DICTIONARY"]) if config["ENABLED"] else (),
+                    int(config["MIN_FUZZY_LENGTH"]),
+                )
+    return _normalizer
+
+
+def normalize(symptoms):
+    """Canonical complaint list; with normalization disabled, just the split input."""
+    if not config["ENABLED"]:
+        parts = _SPLIT.split(symptoms) if isinstance(symptoms, str) else symptoms or []
+        return [p.strip() for p in map(str, parts) if p.strip()]
+    return get_normalizer().normalize(symptoms)
@@ -1,3 +1,1274 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import Http404, HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from userapp import views as spa
+
+from . import (
+    admission, async_views, auth, batch, benchmark, bulk_import, cache, codec, db, export, gemini, geo, metrics,
+    rules, sessions, specialties, symptoms, triage, views, warmup,
+)
+from .directory import DoctorDirectory, entry_from_row, sort_key
+from .schema import Boolean, Date, Email, Integer, Schema, String
+from .singleflight import SingleFlight
+from .views import decode_cursor, encode_cursor
+
+
+class FakeQuery:
+    """Just enough of a postgrest query builder over in-memory rows."""
+
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self.action = "select"
+        self.payload = None
+        self.filters = []
+        self.offset = 0
+        self.limit_to = None
+
+    def select(self, *columns, **options):
+        return self
+
+    def upsert(self, rows, on_conflict, **options):
+        self.action, self.payload = "upsert", (rows, on_conflict.split(","))
+        return self
+
+    def insert(self, rows, **options):
+        self.action, self.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) > value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) >= value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) < value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, **options):
+        return self
+
+    def limit(self, count):
+        self.limit_to = count
+        return self
+
+    def range(self, start, end):
+        self.offset, self.limit_to = start, end - start + 1
+        return self
+
+    def execute(self):
+        rows = self.store.rows.setdefault(self.table, [])
+        if self.action == "upsert":
+            upserts, keys = self.payload
+            return SimpleNamespace(data=[self.store.upsert(self.table, row, keys) for row in upserts])
+        if self.action == "insert":
+            return SimpleNamespace(data=[self.store.add(self.table, row) for row in self.payload])
+        matched = [row for row in rows if all(test(row) for test in self.filters)]
+        if self.action == "delete":
+            self.store.rows[self.table] = [row for row in rows if row not in matched]
+        matched.sort(key=lambda row: row.get("id", 0))
+        end = None if self.limit_to is None else self.offset + self.limit_to
+        return SimpleNamespace(data=[dict(row) for row in matched[self.offset:end]])
+
+
+class FakeSupabase:
+    """An in-memory Supabase client: ``{table: [row, ...]}`` with serial ids."""
+
+    def __init__(self, **rows):
+        self.rows = {table: [] for table in rows}
+        self.next_id = 1
+        for table, table_rows in rows.items():
+            for row in table_rows:
+                self.add(table, row)
+
+    def add(self, table, row):
+        row = {"id": self.next_id, **row}
+        self.next_id += 1
+        self.rows.setdefault(table, []).append(row)
+        return dict(row)
+
+    def upsert(self, table, row, keys):
+        for existing in self.rows.setdefault(table, []):
+            if all(existing.get(key) == row[key] for key in keys):
+                existing.update(row)
+                return dict(existing)
+        return self.add(table, row)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def patient(symptom_text, **fields):
+    return {"age": 35, "gender": "female", "location": "Pune", "symptoms": symptom_text, **fields}
+
+
+class SymptomNormalizerTests(SimpleTestCase):
+    def setUp(self):
+        self.normalizer = symptoms.get_normalizer()
+
+    def test_english_words_are_not_turned_into_clinical_terms(self):
+        for word, lookalike in [
+            ("heart", "heat"), ("sweating", "swelling"), ("tongue", "dengue"),
+            ("eating", "hearing"), ("hurting", "burning"), ("lose", "nose"),
+            ("painting", "fainting"), ("spelling", "swelling"), ("hills", "chills"),
+            ("ever", "fever"), ("breathe", "breath"),
+        ]:
+            with self.subTest(word=word):
+                self.assertEqual(self.normalizer._correct(word), word)
+                self.assertNotIn(lookalike, self.normalizer.normalize(word))
+
+    def test_phrases_keep_their_words(self):
+        self.assertEqual(self.normalizer.normalize("heart pain and sweating"), ["heart pain", "sweating"])
+        self.assertEqual(self.normalizer.normalize("swollen tongue"), ["swollen tongue"])
+        self.assertEqual(self.normalizer.normalize("heart disease"), ["heart disease"])
+        self.assertEqual(self.normalizer.normalize("not eating, hurting"), ["not eating", "hurting"])
+
+    def test_vocabulary_words_are_kept(self):
+        for word in ("heat", "hearing", "burning", "dengue", "nose", "swelling"):
+            with self.subTest(word=word):
+                self.assertEqual(self.normalizer._correct(word), word)
+
+    def test_dictionary_typos_are_corrected(self):
+        self.assertEqual(self.normalizer.normalize("feverr, coguh"), ["fever", "cough"])
+        self.assertEqual(self.normalizer.normalize("chestpain"), ["chest pain"])
+
+    def test_long_words_one_slip_away_are_corrected(self):
+        self.assertEqual(self.normalizer._correct("vomitting"), "vomiting")
+        self.assertEqual(self.normalizer._correct("palpitatoins"), "palpitations")
+        self.assertEqual(self.normalizer._correct("plapitatoins"), "plapitatoins")  # two slips
+
+    def test_substitutions_and_short_words_are_not_guessed(self):
+        self.assertEqual(self.normalizer._correct("feber"), "feber")
+        self.assertEqual(self.normalizer._correct("covd"), "covd")
+        self.assertEqual(self.normalizer._correct("hypotension"), "hypotension")
+
+    def test_synonyms_are_collapsed(self):
+        self.assertEqual(self.normalizer.normalize("bukhar and khasi since 3 days"), ["fever", "cough since 3 days"])
+
+    def test_missing_dictionary_is_swallowed(self):
+        with mock.patch.object(symptoms.metrics, "swallowed") as swallowed:
+            self.assertEqual(symptoms._load_dictionary("/nonexistent/medical_dictionary.json"), [])
+        self.assertEqual(swallowed.call_args.args[0], "symptom_dictionary")
+
+
+class PatientSymptomsTests(SimpleTestCase):
+    def test_prompt_and_session_keep_the_raw_text(self):
+        info, errors = triage.extract_patient_info(patient("heart pain and sweating, swollen tongue"))
+        self.assertIsNone(errors)
+        self.assertEqual(info["symptoms"], "heart pain and sweating, swollen tongue")
+        self.assertIn("Symptoms: heart pain and sweating, swollen tongue", triage.build_prompt(info))
+        record = triage.session_record("p1", info, {}, [])
+        self.assertEqual(record["symptoms"], ["heart pain and sweating", " swollen tongue"])
+
+    def test_prompt_adds_the_normalized_terms(self):
+        info, _ = triage.extract_patient_info(patient("bukhar, khasi since 3 days"))
+        prompt = triage.build_prompt(info)
+        self.assertIn("Symptoms: bukhar, khasi since 3 days\nStandard terms", prompt)
+        self.assertIn(": fever, cough since 3 days\n", prompt)
+        info, _ = triage.extract_patient_info(patient("fever, cough"))
+        self.assertNotIn("Standard terms", triage.build_prompt(info))
+
+    def test_cache_key_uses_the_normalized_list(self):
+        first, _ = triage.extract_patient_info(patient("bukhar, khasi"))
+        second, _ = triage.extract_patient_info(patient("cough and fever"))
+        self.assertEqual(first["normalized_symptoms"], ["fever", "cough"])
+        self.assertEqual(cache.cache_key(first), cache.cache_key(second))
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.supabase = FakeSupabase(
+            doctors=[{"email": "supa@x.com", "auth_id": "u1", "full_name": "Dr Supa", "latitude": 18.5,
+                      "consultation_fee": 500}],
+            specialties=[], doctor_specialties=[],
+        )
+        User.objects.create_user("taken", "taken@x.com", "pw")
+
+    def importer(self, **options):
+        return bulk_import.Importer("doctors", client_factory=lambda: self.supabase, workers=1, **options)
+
+    def doctors(self):
+        return {row["email"]: row for row in self.supabase.rows["doctors"]}
+
+    def test_existing_users_rows_and_file_duplicates_are_skipped(self):
+        counters = self.importer().run(enumerate([
+            {"email": "new@x.com", "full_name": "Dr New"},
+            {"email": "NEW@x.com", "full_name": "Dr Again"},
+            {"email": "taken@x.com", "username": "someone", "full_name": "Dr Taken"},
+            {"email": "supa@x.com", "full_name": "Dr Overwrite"},
+        ], 1))
+        self.assertEqual((counters["imported"], counters["duplicates"]), (1, 3))
+        self.assertEqual(self.doctors()["supa@x.com"]["full_name"], "Dr Supa")
+        self.assertFalse(User.objects.filter(email="supa@x.com").exists())
+
+    def test_update_only_writes_the_given_columns(self):
+        self.importer(update=True).run(enumerate([{"email": "supa@x.com", "full_name": "Dr Supa Jr"}], 1))
+        row = self.doctors()["supa@x.com"]
+        self.assertEqual(row["full_name"], "Dr Supa Jr")
+        self.assertEqual((row["auth_id"], row["latitude"], row["consultation_fee"]), ("u1", 18.5, 500))
+
+    def test_update_replaces_listed_specialties(self):
+        self.importer().run(enumerate([{"email": "d@x.com", "full_name": "Dr D", "specialties": "Cardiologist"}], 1))
+        self.importer(update=True).run(enumerate([
+            {"email": "d@x.com", "full_name": "Dr D", "specialties": "Neurologist"},
+        ], 1))
+        names = {row["id"]: row["name"] for row in self.supabase.rows["specialties"]}
+        linked = [names[row["specialty_id"]] for row in self.supabase.rows["doctor_specialties"]]
+        self.assertEqual(linked, ["Neurologist"])
+
+    def test_passwords_are_hashed_or_taken_as_is(self):
+        encoded = User.objects.get(username="taken").password
+        counters = self.importer().run(enumerate([
+            {"email": "a@x.com", "full_name": "Dr A", "password": "secret"},
+            {"email": "b@x.com", "full_name": "Dr B", "password_hash": encoded},
+            {"email": "c@x.com", "full_name": "Dr C"},
+            {"email": "d@x.com", "full_name": "Dr D", "password_hash": "plain"},
+        ], 1))
+        self.assertEqual(counters["invalid"], 1)
+        self.assertTrue(User.objects.get(username="a@x.com").check_password("secret"))
+        self.assertTrue(User.objects.get(username="b@x.com").check_password("pw"))
+        self.assertFalse(User.objects.get(username="c@x.com").has_usable_password())
+
+    def test_resume_continues_after_the_checkpoint(self):
+        records = [(n, {"email": f"doc{n}@x.com", "full_name": f"Dr {n}"}) for n in range(1, 8)]
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "doctors.checkpoint.json")
+            # The first run stops after two batches of three
+            self.importer(batch_size=3).run(records[:6], checkpoint=checkpoint, source="doctors.csv")
+            self.assertEqual(bulk_import.load_checkpoint(checkpoint)["read"], 6)
+            with mock.patch.object(bulk_import.Importer, "_write_rows", autospec=True,
+                                   side_effect=bulk_import.Importer._write_rows) as write_rows:
+                counters = self.importer(batch_size=3).run(
+                    records, checkpoint=checkpoint, resume=True, source="doctors.csv",
+                )
+            self.assertEqual(write_rows.call_count, 1)
+            self.assertEqual((counters["read"], counters["imported"]), (7, 7))
+            with self.assertRaises(ValueError):
+                self.importer().run(records, checkpoint=checkpoint, resume=True, source="other.csv")
+        self.assertEqual(len(self.doctors()), 8)
+
+
+class SessionWriterTests(SimpleTestCase):
+    def setUp(self):
+        self.supabase = FakeSupabase(symptom_sessions=[])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool_dir = directory.name
+        self.writer = sessions.SessionWriter(lambda: self.supabase, {
+            "SPOOL_DIR": self.spool_dir, "RETRY_BACKOFF": 0, "MAX_RETRIES": 2,
+        })
+        patcher = mock.patch.object(sessions.db, "patient_ids_for", lambda auth_ids: {a: 7 for a in auth_ids})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def spool(self, name, lines):
+        with open(os.path.join(self.spool_dir, name), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def item(self, symptom):
+        return codec.dumps_str({"auth_id": "a1", "record": {"symptoms": [symptom]}})
+
+    def test_torn_lines_are_quarantined_and_the_rest_replayed(self):
+        self.spool("symptom_sessions.1.jsonl", [self.item("fever"), '{"auth_id": "a1", "rec', "[1, 2]", self.item("cough")])
+        self.writer._replay_spool()
+        written = [row["symptoms"] for row in self.supabase.rows["symptom_sessions"]]
+        self.assertEqual(written, [["fever"], ["cough"]])
+        self.assertEqual(os.listdir(self.spool_dir), ["symptom_sessions.1.jsonl.bad"])
+        with open(os.path.join(self.spool_dir, "symptom_sessions.1.jsonl.bad"), encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertEqual(self.writer.stats()["quarantined"], 2)
+
+    def test_claims_of_dead_workers_are_replayed(self):
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        self.spool(f"symptom_sessions.1.jsonl.replay-{dead.pid}", [self.item("fever")])
+        self.spool(f"symptom_sessions.2.jsonl.replay-{os.getpid()}", [self.item("cough")])
+        self.writer._replay_spool()
+        self.assertEqual(len(self.supabase.rows["symptom_sessions"]), 1)
+        self.assertEqual(os.listdir(self.spool_dir), [f"symptom_sessions.2.jsonl.replay-{os.getpid()}"])
+
+    def test_retry_after_a_landed_insert_writes_once(self):
+        execute = FakeQuery.execute
+
+        def landed_then_timed_out(query):
+            result = execute(query)
+            if not getattr(landed_then_timed_out, "done", False):
+                landed_then_timed_out.done = True
+                raise httpx.ReadTimeout("read timed out")
+            return result
+
+        item = {"auth_id": "a1", "record": sessions._with_write_id({"symptoms": ["fever"]})}
+        with mock.patch.object(FakeQuery, "execute", landed_then_timed_out):
+            self.assertTrue(self.writer._write_with_retries([item]))
+        self.assertEqual(len(self.supabase.rows["symptom_sessions"]), 1)
+        self.assertEqual(self.writer.stats()["retries"], 1)
+
+    def test_records_keep_their_write_id_through_the_spool(self):
+        self.writer._spool([{"auth_id": "a1", "record": sessions._with_write_id({"symptoms": ["fever"]})}])
+        name = os.listdir(self.spool_dir)[0]
+        with open(os.path.join(self.spool_dir, name), encoding="utf-8") as f:
+            write_id = codec.loads(f.readline())["record"]["write_id"]
+        self.writer._replay_spool()
+        self.assertEqual(self.supabase.rows["symptom_sessions"][0]["write_id"], write_id)
+
+
+class AdmissionTests(SimpleTestCase):
+    def request(self, forwarded=None, user_id=None):
+        extra = {"REMOTE_ADDR": "10.0.0.1"}
+        if forwarded is not None:
+            extra["HTTP_X_FORWARDED_FOR"] = forwarded
+        request = RequestFactory().get("/api/doctors/", **extra)
+        request.user_id = user_id
+        return request
+
+    def test_forwarded_for_is_ignored_by_default(self):
+        self.assertEqual(admission.client_id(self.request("6.6.6.6")), "ip:10.0.0.1")
+
+    def test_the_trusted_proxys_hop_is_used(self):
+        with mock.patch.dict(admission.config, TRUSTED_PROXY_COUNT=1):
+            # The client sent "6.6.6.6" itself; the proxy appended 1.2.3.4
+            self.assertEqual(admission.client_id(self.request("6.6.6.6, 1.2.3.4")), "ip:1.2.3.4")
+            self.assertEqual(admission.client_id(self.request()), "ip:10.0.0.1")
+        with mock.patch.dict(admission.config, TRUSTED_PROXY_COUNT=2):
+            self.assertEqual(admission.client_id(self.request("6.6.6.6, 1.2.3.4, 10.1.1.1")), "ip:1.2.3.4")
+            self.assertEqual(admission.client_id(self.request("1.2.3.4")), "ip:10.0.0.1")
+
+    def test_readiness_warns_about_an_ignored_proxy(self):
+        with mock.patch.dict(warmup.config, ENABLED=False):
+            response = self.client.get("/api/ready/", HTTP_X_FORWARDED_FOR="1.2.3.4")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("TRUSTED_PROXY_COUNT is 0", response.json()["warnings"][0])
+            self.assertNotIn("warnings", self.client.get("/api/ready/").json())
+            with mock.patch.dict(admission.config, TRUSTED_PROXY_COUNT=1):
+                response = self.client.get("/api/ready/", HTTP_X_FORWARDED_FOR="1.2.3.4")
+                self.assertNotIn("warnings", response.json())
+
+    def test_users_are_limited_by_id(self):
+        self.assertEqual(admission.client_id(self.request("6.6.6.6", user_id="u1")), "user:u1")
+
+    def test_bucket_refuses_past_the_burst(self):
+        limiter = admission.RateLimiter({"default": {"RATE": 1.0, "BURST": 2}}, 10)
+        self.assertEqual(limiter.take("x", "ip:1"), 0)
+        self.assertEqual(limiter.take("x", "ip:1"), 0)
+        self.assertGreater(limiter.take("x", "ip:1"), 0)
+        self.assertEqual(limiter.take("x", "ip:2"), 0)
+        self.assertEqual(limiter.stats()["rejected"], {"x": 1})
+
+    def test_gate_sheds_when_the_queue_is_full(self):
+        gate = admission.LLMGate(1, 0, 0.1)
+        acquired_at = gate.acquire()
+        with self.assertRaises(admission.Overloaded):
+            gate.acquire()
+        gate.release(acquired_at)
+        gate.release(gate.acquire())
+        self.assertEqual(gate.stats()["shed"], 1)
+
+
+def url_views(patterns, prefix=""):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_views(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            yield prefix + str(pattern.pattern), pattern.callback
+
+
+class AuthTests(SimpleTestCase):
+    SECRET = "test-secret-" + "0" * 32
+
+    def test_api_views_require_auth_unless_listed_as_public(self):
+        checked = 0
+        for route, view in url_views(get_resolver().url_patterns):
+            if not route.startswith("api/"):
+                continue
+            checked += 1
+            name = f"{view.__module__}.{view.__name__}"
+            with self.subTest(route=route):
+                if name in auth.PUBLIC_VIEWS:
+                    self.assertFalse(getattr(view, "requires_auth", False), f"{name} is listed as public")
+                else:
+                    self.assertTrue(getattr(view, "requires_auth", False), f"{name} has no require_auth")
+        self.assertGreater(checked, len(auth.PUBLIC_VIEWS))
+
+    def test_missing_token_is_rejected(self):
+        with mock.patch.dict(auth.config, REQUIRED=True):
+            response = self.client.get("/api/triage/stats/")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], 'Bearer realm="api"')
+
+    def authenticator(self):
+        return auth.Authenticator(auth.KeyProvider(secret=self.SECRET), {**auth.DEFAULTS, "JWT_SECRET": self.SECRET})
+
+    def token(self, **claims):
+        claims = {"sub": "u1", "aud": "authenticated", "exp": int(time.time()) + 60, **claims}
+        return jwt.encode(claims, self.SECRET, algorithm="HS256")
+
+    def test_tokens_are_verified_then_cached(self):
+        authenticator = self.authenticator()
+        token = self.token()
+        self.assertEqual(authenticator.authenticate(token)["sub"], "u1")
+        self.assertEqual(authenticator.authenticate(token)["sub"], "u1")
+        self.assertEqual((authenticator.counters["verified"], authenticator.counters["cache_hits"]), (1, 1))
+
+    def test_bad_tokens_are_rejected(self):
+        authenticator = self.authenticator()
+        for token in (
+            self.token(exp=int(time.time()) - 120),
+            self.token(aud="anon"),
+            jwt.encode({"sub": "u1", "aud": "authenticated", "exp": int(time.time()) + 60}, "x" * 32, algorithm="HS256"),
+            "not-a-token",
+        ):
+            with self.subTest(token=token), self.assertRaises(auth.AuthError):
+                authenticator.authenticate(token)
+
+    def test_admins(self):
+        self.assertTrue(auth.is_admin({"role": "service_role"}))
+        self.assertTrue(auth.is_admin({"app_metadata": {"role": "admin"}}))
+        self.assertFalse(auth.is_admin({"user_metadata": {"role": "admin"}}))
+        self.assertFalse(auth.is_admin(None))
+
+
+class RuleTests(SimpleTestCase):
+    def triage(self, symptom_text, age=30):
+        return rules.local_triage(patient(symptom_text, age=age))
+
+    def test_rule_table(self):
+        allowed = set(triage.ALLOWED_SPECIALISTS)
+        for name, (specialist, severity, diseases, confidence) in {**rules.SYMPTOM_RULES, **{
+            ", ".join(sorted(key)): value for key, value in rules.COMBINATION_RULES.items()
+        }}.items():
+            with self.subTest(rule=name):
+                self.assertIn(specialist, allowed)
+                self.assertIn(severity, rules.SEVERITY_ORDER)
+                self.assertTrue(diseases)
+                self.assertTrue(0 < confidence <= 1)
+        for key in rules.COMBINATION_RULES:
+            self.assertLessEqual(key, set(rules.SYMPTOM_RULES))
+        for name in rules.SYMPTOM_RULES:
+            self.assertIsNone(rules.engine._red_flag_pattern.search(name), name)
+
+    def test_common_complaints_are_answered_locally(self):
+        reply = self.triage("fever and cough since 2 days")
+        self.assertEqual(reply["doctor_recommendation"], "General Physician")
+        self.assertEqual((reply["source"], reply["confidence"]), ("rules", 0.95))
+        self.assertEqual(self.triage("itching")["doctor_recommendation"], "Dermatologist")
+
+    def test_named_conditions_alone_go_to_the_model(self):
+        for text in ("diabetes", "depression", "hypertension", "migraine", "asthma and diabetes"):
+            with self.subTest(text=text):
+                self.assertEqual(rules.engine.score(text, 30), (0.0, None))
+
+    def test_red_flags_unexplained_words_and_age_go_to_the_model(self):
+        self.assertIsNone(self.triage("fever and chest pain"))
+        self.assertIsNone(self.triage("severe headache"))
+        self.assertIsNone(self.triage("cough with yellow phlegm at night"))
+        self.assertIsNone(self.triage("fever", age=70))
+        self.assertIsNone(self.triage("fever and rash"))  # two specialists
+
+    def test_scores_the_raw_text(self):
+        # "heart" is not read as "heat" and "feverr" is not read as "fever"
+        self.assertIsNone(self.triage("heart burning"))
+        self.assertIsNone(self.triage("feverr"))
+
+    def test_threshold(self):
+        confidence, _ = rules.engine.score("fever", 30)
+        self.assertEqual(confidence, 0.85)
+        with mock.patch.dict(rules.config, CONFIDENCE_THRESHOLD=0.85):
+            self.assertIsNotNone(self.triage("fever"))
+        with mock.patch.dict(rules.config, CONFIDENCE_THRESHOLD=0.86):
+            self.assertIsNone(self.triage("fever"))
+            self.assertIsNotNone(self.triage("fever and cough"))
+        with mock.patch.dict(rules.config, ENABLED=False):
+            self.assertIsNone(self.triage("fever and cough"))
+
+
+class FakeModel:
+    """A ``GenerativeModel`` whose replies are scripted per model name."""
+
+    behaviour = {}  # name -> seconds to wait, or an exception to raise
+
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, request_options=None):
+        outcome = self.behaviour.get(self.name, 0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        time.sleep(outcome)
+        return SimpleNamespace(text=self.name)
+
+
+class FakeModelsTestCase(SimpleTestCase):
+    """Registries over three listed models, "a", "b" and "c", served by ``FakeModel``."""
+
+    def setUp(self):
+        self.listed = 0
+        FakeModel.behaviour = {}
+        patcher = mock.patch.object(gemini, "client", lambda: SimpleNamespace(GenerativeModel=FakeModel))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def list_models(self):
+        self.listed += 1
+        return [SimpleNamespace(name=name, display_name=name, description="",
+                                supported_generation_methods=["generateContent"]) for name in ("a", "b", "c")]
+
+
+class ModelRegistryTests(FakeModelsTestCase):
+    def test_discovery_is_cached(self):
+        registry = gemini.ModelRegistry(self.list_models)
+        self.assertEqual(registry.candidates(), ["a", "b", "c"])
+        registry.candidates()
+        self.assertEqual(self.listed, 1)
+
+    def test_failed_discovery_falls_back(self):
+        def broken():
+            raise RuntimeError("no network")
+        self.assertEqual(gemini.ModelRegistry(broken).candidates(), gemini.FALLBACK_MODELS)
+
+    def test_circuit_opens_then_lets_one_probe_through(self):
+        registry = gemini.ModelRegistry(self.list_models)
+        registry.record_success("b", 0.5)
+        registry.record_success("c", 0.2)
+        for _ in range(gemini.FAILURE_THRESHOLD):
+            registry.record_failure("c", "boom")
+        self.assertEqual(registry.candidates(), ["b", "a"])  # measured first, c open
+        registry._models["c"].opened_at -= gemini.CIRCUIT_COOLDOWN
+        self.assertEqual(registry.candidates(), ["b", "a", "c"])  # half-open probe
+        self.assertEqual(registry.candidates(), ["b", "a"])  # only one probe at a time
+        registry.record_failure("c", "still broken")
+        self.assertEqual(registry.snapshot()[2]["state"], gemini.OPEN)
+
+    def test_generate_falls_back_to_the_next_model(self):
+        FakeModel.behaviour = {"a": RuntimeError("quota")}
+        registry = gemini.ModelRegistry(self.list_models)
+        response, name = registry.generate("prompt")
+        self.assertEqual((response.text, name), ("b", "b"))
+        FakeModel.behaviour = {name: RuntimeError("quota") for name in "abc"}
+        with self.assertRaises(gemini.AllModelsFailed):
+            registry.generate("prompt")
+
+
+class DeadlineTests(FakeModelsTestCase):
+    def test_deadline(self):
+        registry = gemini.ModelRegistry(self.list_models)
+        with self.assertRaises(gemini.DeadlineExceeded):
+            registry.generate("prompt", gemini.Deadline(0))
+        self.assertIsNone(gemini.Deadline(0).attempt_timeout())
+        self.assertEqual(gemini.Deadline(100).attempt_timeout(), gemini.ATTEMPT_TIMEOUT)
+
+    def test_slow_model_is_hedged(self):
+        FakeModel.behaviour = {"a": 1.0}
+        registry = gemini.ModelRegistry(self.list_models)
+        for _ in range(gemini.HEDGE_MIN_SAMPLES):
+            registry.record_success("a", 0.01)
+        with mock.patch.object(gemini, "HEDGE", True):
+            started = time.monotonic()
+            _, name = registry.generate("prompt")
+        self.assertEqual(name, "b")
+        self.assertLess(time.monotonic() - started, 0.5)
+
+
+class TriageCacheKeyTests(SimpleTestCase):
+    def test_same_complaint_same_key(self):
+        first = {**patient("Fever, cough"), "bmi": 22.0}
+        second = {**patient(["cough ", "fever."]), "bmi": 23.0, "location": " pune "}
+        self.assertEqual(cache.cache_key(first), cache.cache_key(second))
+
+    def test_demographics_change_the_key(self):
+        base = {**patient("fever"), "bmi": 22.0}
+        today = datetime.date(2024, 1, 15)
+        for change in ({"age": 70}, {"gender": "male"}, {"bmi": 31.0}, {"location": "Delhi"}):
+            with self.subTest(change=change):
+                self.assertNotEqual(cache.cache_key(base, today), cache.cache_key({**base, **change}, today))
+        self.assertNotEqual(cache.cache_key(base, today), cache.cache_key(base, datetime.date(2024, 7, 15)))
+
+
+class GeoGridTests(SimpleTestCase):
+    def test_nearest_matches_a_full_scan(self):
+        random.seed(7)
+        entries = [SimpleNamespace(latitude=18 + random.random(), longitude=73 + random.random(), id=i)
+                   for i in range(500)]
+        entries.append(SimpleNamespace(latitude=None, longitude=None, id="nowhere"))
+        grid = geo.GeoGrid(entries)
+        for lat, lng in ((18.5, 73.5), (18.01, 73.99), (20.0, 75.0)):
+            expected = sorted((geo.haversine_km(lat, lng, e.latitude, e.longitude), e.id) for e in entries[:-1])
+            found = grid.nearest(lat, lng, k=10)
+            self.assertEqual([entry.id for _, entry in found], [i for _, i in expected[:10]])
+            within = grid.nearest(lat, lng, k=500, max_km=20)
+            self.assertEqual(len(within), sum(1 for d, _ in expected if d <= 20))
+
+    def test_haversine(self):
+        # Mumbai to Pune is about 120 km
+        self.assertAlmostEqual(geo.haversine_km(19.076, 72.8777, 18.5204, 73.8567), 119.8, delta=1)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_identical_calls_run_once(self):
+        flights = SingleFlight()
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"answer": 42}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do(("triage", "k"), slow)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flights.do(("triage", "k"), slow)))
+                     for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while flights.stats()["triage"]["coalesced"] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+        self.assertEqual((len(calls), results), (1, [{"answer": 42}] * 4))
+        results[0]["answer"] = 0
+        self.assertEqual(results[1]["answer"], 42)  # each caller gets its own copy
+
+    def test_errors_reach_every_waiter_and_are_not_cached(self):
+        flights = SingleFlight()
+
+        async def main():
+            gate = asyncio.Event()
+
+            async def failing():
+                await gate.wait()
+                raise RuntimeError("boom")
+
+            tasks = [asyncio.ensure_future(flights.do_async(("triage", "k"), failing)) for _ in range(3)]
+            await asyncio.sleep(0)
+            gate.set()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        outcomes = asyncio.run(main())
+        self.assertTrue(all(isinstance(outcome, RuntimeError) for outcome in outcomes))
+        self.assertEqual(flights.stats()["triage"], {"calls": 1, "coalesced": 2, "errors": 1})
+        self.assertEqual(flights.do(("triage", "k"), lambda: "ok"), "ok")
+
+
+class SchemaTests(SimpleTestCase):
+    def test_values_are_coerced_and_errors_collected(self):
+        schema = Schema(
+            age=Integer(gt=0, lt=120), email=Email(required=True), gender=String(choices={"male", "female"}, lower=True),
+            visits=Boolean(default=False), day=Date(),
+        )
+        values, errors = schema.validate({"age": "42", "email": "A@X.com", "gender": "Female", "day": "2024-02-29"})
+        self.assertIsNone(errors)
+        self.assertEqual(values, {"age": 42, "email": "a@x.com", "gender": "female", "visits": False,
+                                  "day": datetime.date(2024, 2, 29)})
+        values, errors = schema.validate({"age": 200, "email": "nope", "gender": "x", "visits": "maybe"})
+        self.assertIsNone(values)
+        self.assertEqual(set(errors), {"age", "email", "gender", "visits"})
+        self.assertEqual(schema.validate([])[1], {"body": "Expected a JSON object."})
+
+    def test_codec_round_trip(self):
+        data = {"when": datetime.date(2024, 1, 2), "text": "bukhār", "n": [1, 2.5, None]}
+        self.assertEqual(codec.loads(codec.dumps(data)), {**data, "when": "2024-01-02"})
+        with self.assertRaises(codec.DecodeError):
+            codec.loads(b'{"torn": ')
+        response = codec.JsonResponse({"ok": True})
+        self.assertEqual((response["Content-Type"], codec.loads(response.content)), ("application/json", {"ok": True}))
+
+
+class DoctorListingTests(SimpleTestCase):
+    def setUp(self):
+        # Ties on experience, so the id has to break them
+        rows = [{"full_name": f"Dr {i}", "experience": i % 4, "consultation_fee": 100 * i,
+                 "latitude": 18.5, "longitude": 73.8, "created_at": "2024-01-01",
+                 "doctor_specialties": [{"specialties": {"name": "Cardiologist"}}]} for i in range(23)]
+        self.directory = DoctorDirectory(lambda: FakeSupabase(doctors=rows))
+        self.directory.load()
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor((-5.0, "17"))), (-5.0, "17"))
+        for cursor in ("", "not-base64!", encode_cursor(("x", 1)), encode_cursor((1,))):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_pages_cover_the_roster_once_in_order(self):
+        seen, after = [], None
+        while True:
+            page, after = self.directory.browse("cardiologist", after=after, limit=5)
+            seen += [entry for _, entry in page]
+            if after is None:
+                break
+            after = decode_cursor(encode_cursor(after))
+        self.assertEqual(len(seen), 23)
+        self.assertEqual(len({entry.id for entry in seen}), 23)
+        self.assertEqual([entry.experience for entry in seen], sorted((e.experience for e in seen), reverse=True))
+
+    def test_filters_keep_the_order(self):
+        page, after = self.directory.browse(min_fee=500, max_fee=1000, limit=50)
+        self.assertIsNone(after)
+        self.assertEqual(sorted(entry.consultation_fee for _, entry in page), list(range(500, 1001, 100)))
+
+    def test_a_selective_filter_stops_at_the_scan_cap(self):
+        self.directory.config["MAX_SCAN"] = 4
+        fees, pages, after = [], 0, None
+        while True:
+            page, after = self.directory.browse(min_fee=2000, after=after, limit=5)
+            fees += [entry.consultation_fee for _, entry in page]
+            pages += 1
+            if after is None:
+                break
+        # 23 doctors, 4 looked at per page, and the 3 matches all found
+        self.assertEqual(pages, 6)
+        self.assertEqual(sorted(fees), [2000, 2100, 2200])
+        page, after = self.directory.browse(min_fee=5000, limit=5)
+        self.assertEqual((page, after), ([], sort_key(self.directory._all[3])))
+
+
+class SessionExportTests(SimpleTestCase):
+    def setUp(self):
+        self.supabase = FakeSupabase(symptom_sessions=[
+            {"created_at": f"2024-01-{day:02d}T10:00:00", "symptoms": ["fever"]} for day in range(1, 8)
+        ])
+
+    def export(self, chunk_size=3, **filters):
+        params = {"since": None, "until": None, "specialty": None, "severity": None, "limit": None, **filters}
+        return list(export.sessions(params, client_factory=lambda: self.supabase, chunk_size=chunk_size))
+
+    def test_keyset_chunks(self):
+        chunks = self.export()
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 1])
+        self.assertEqual([row["id"] for chunk in chunks for row in chunk], list(range(1, 8)))
+        self.assertEqual(sum(len(chunk) for chunk in self.export(limit=4)), 4)
+
+    def test_dates_are_inclusive(self):
+        rows = [row for chunk in self.export(since=datetime.date(2024, 1, 2), until=datetime.date(2024, 1, 3))
+                for row in chunk]
+        self.assertEqual([row["created_at"][:10] for row in rows], ["2024-01-02", "2024-01-03"])
+
+    def test_ndjson_and_gzip(self):
+        blocks = list(export.gzipped(export.ndjson(self.export())))
+        lines = gzip.decompress(b"".join(blocks)).splitlines()
+        self.assertEqual([codec.loads(line)["id"] for line in lines], list(range(1, 8)))
+
+
+class AsyncClientTests(SimpleTestCase):
+    def setUp(self):
+        self.closed = []
+
+        async def create_client(url, key, options):
+            await asyncio.sleep(0)
+            return options
+
+        patches = [
+            mock.patch.object(db, "acreate_client", create_client),
+            mock.patch.object(httpx.AsyncClient, "aclose", mock.AsyncMock(side_effect=lambda: self.closed.append(1))),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_one_client_per_loop_closed_with_the_loop(self):
+        async def request():
+            first, second = await asyncio.gather(db.get_async_supabase(), db.get_async_supabase())
+            self.assertIs(first, second)
+            return first
+
+        one, two = asyncio.run(request()), asyncio.run(request())
+        self.assertIsNot(one, two)
+        self.assertEqual(len(self.closed), 4)  # each loop's pool and the one that lost its race
+        self.assertEqual((len(db._async_clients), len(db._closers)), (0, 0))
+
+
+class EventStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.released = threading.Event()
+        self.waited = []
+
+        def doctors(specialty, info):
+            # Blocks until the test has read the first event
+            self.waited.append(self.released.wait(5))
+            return [{"name": "Dr A"}]
+
+        patches = [
+            mock.patch.dict(auth.config, REQUIRED=False),
+            mock.patch.object(views, "run_triage", lambda info, deadline: {"doctor_recommendation": "Cardiologist"}),
+            mock.patch.object(views, "fetch_doctors", doctors),
+            mock.patch.object(views, "save_session", lambda *args: None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, factory):
+        return views.analyze_symptoms(factory.post(
+            "/api/analyze-symptoms/?stream=1", codec.dumps(patient("chest pain")), content_type="application/json",
+        ))
+
+    def test_asgi_sends_the_triage_event_before_the_rest_is_ready(self):
+        response = self.post(AsyncRequestFactory())
+        self.assertTrue(response.is_async)
+
+        async def read():
+            chunks = response.__aiter__()
+            first = await chunks.__anext__()
+            self.released.set()
+            return [first] + [chunk async for chunk in chunks]
+
+        chunks = asyncio.run(read())
+        response.close()
+        self.assertEqual(self.waited, [True])
+        self.assertTrue(chunks[0].startswith(b"event: triage\n"))
+        self.assertEqual([chunk.split(b"\n")[0] for chunk in chunks[1:]], [b"event: doctors", b"event: done"])
+
+    def test_wsgi_stream_is_a_plain_iterator(self):
+        self.released.set()
+        response = self.post(RequestFactory())
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(list(response)), 3)
+
+
+class AsyncAnalyzeTests(SimpleTestCase):
+    def setUp(self):
+        self.prompts = []
+        self.writer = mock.Mock()
+
+        async def generate_async(prompt, deadline):
+            self.prompts.append(prompt)
+            await asyncio.sleep(0.2)
+            return SimpleNamespace(text='```json\n{"doctor_recommendation": "Cardiologist"}\n```'), "m"
+
+        directory = SimpleNamespace(loaded=True, search=lambda specialty, **options: [{"name": "Dr A"}])
+        patches = [
+            mock.patch.dict(auth.config, REQUIRED=False),
+            mock.patch.dict(rules.config, ENABLED=False),
+            mock.patch.object(gemini, "registry", SimpleNamespace(generate_async=generate_async)),
+            mock.patch.object(async_views, "triage_cache", SimpleNamespace(get=lambda info: None, set=lambda *a: None)),
+            mock.patch.object(async_views, "directory", directory),
+            mock.patch.object(async_views, "session_writer", self.writer),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, symptom_text):
+        request = AsyncRequestFactory().post(
+            "/api/analyze-symptoms/async/", codec.dumps(patient(symptom_text)), content_type="application/json",
+        )
+        return async_views.analyze_symptoms_async(request)
+
+    def test_reply_with_doctors_and_a_queued_session(self):
+        response = asyncio.run(self.post("chest pain"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(codec.loads(response.content), {
+            "doctor_recommendation": "Cardiologist", "source": "llm",
+            "recommended_doctors": [{"name": "Dr A"}], "recommended_specialization": "Cardiologist",
+        })
+        self.assertIn("chest pain", self.prompts[0])
+        self.writer.enqueue.assert_called_once()
+
+    def test_requests_wait_on_the_model_concurrently(self):
+        async def both():
+            return await asyncio.gather(self.post("chest pain"), self.post("back pain"))
+
+        started = time.monotonic()
+        responses = asyncio.run(both())
+        self.assertLess(time.monotonic() - started, 0.35)
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(len(self.prompts), 2)
+
+    def test_invalid_patient(self):
+        request = AsyncRequestFactory().post(
+            "/api/analyze-symptoms/async/", codec.dumps({"age": 500}), content_type="application/json",
+        )
+        response = asyncio.run(async_views.analyze_symptoms_async(request))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.prompts, [])
+
+
+def doctor(name, experience, *specialty_names, **fields):
+    return {"full_name": name, "experience": experience, "created_at": "2024-01-01",
+            "doctor_specialties": [{"specialties": {"name": n}} for n in specialty_names], **fields}
+
+
+class DoctorDirectoryTests(SimpleTestCase):
+    def setUp(self):
+        self.supabase = FakeSupabase(doctors=[
+            doctor("Dr Low", 2, "Cardiologist"),
+            doctor("Dr High", 20, "Cardiology"),
+            doctor("Dr Both", 9, "cardiologist", "Neurologist"),
+            doctor("Dr Sport", 5, "Sports Medicine"),
+        ])
+        self.directory = DoctorDirectory(lambda: self.supabase)
+        self.directory.load()
+
+    def names(self, entries):
+        return [entry.full_name for entry in entries]
+
+    def test_spellings_of_a_specialty_share_one_list(self):
+        self.assertEqual(self.names(self.directory.lookup("heart specialist")), ["Dr High", "Dr Both", "Dr Low"])
+        self.assertEqual(self.names(self.directory.lookup("Cardiologist", limit=2)), ["Dr High", "Dr Both"])
+        self.assertEqual(self.names(self.directory.lookup("Cardiologist", min_experience=5)), ["Dr High", "Dr Both"])
+
+    def test_several_specialties_are_merged_in_order(self):
+        self.assertEqual(self.names(self.directory.lookup("Neurologist or Cardiologist")),
+                         ["Dr High", "Dr Both", "Dr Low"])
+
+    def test_unknown_terms_match_by_substring(self):
+        self.assertEqual(self.names(self.directory.lookup("sports")), ["Dr Sport"])
+        self.assertEqual(self.directory.lookup("astrology"), [])
+
+    def test_incremental_refresh(self):
+        self.supabase.add("doctors", doctor("Dr New", 15, "Cardiologist", created_at="2024-02-01"))
+        moved = dict(self.supabase.rows["doctors"][0], experience=30, created_at="2024-02-02",
+                     doctor_specialties=[{"specialties": {"name": "Neurology"}}])
+        self.supabase.upsert("doctors", moved, ["id"])
+        with mock.patch.object(self.directory, "load", side_effect=AssertionError("full reload")):
+            self.directory.refresh()
+        self.assertEqual(self.names(self.directory.lookup("cardiology")), ["Dr High", "Dr New", "Dr Both"])
+        self.assertEqual(self.names(self.directory.lookup("neurology")), ["Dr Low", "Dr Both"])
+        self.assertEqual(self.directory.stats()["watermark"], "2024-02-02")
+
+    def test_entries_keep_canonical_ids(self):
+        entry = entry_from_row({"id": 1, **doctor("Dr X", 3, "ENT (Otolaryngologist)", "Skin")})
+        self.assertEqual(entry.specialties, ("ent", "dermatology"))
+
+
+class SpecialtyTests(SimpleTestCase):
+    def test_free_text_maps_to_canonical_ids(self):
+        for text, ids in (
+            ("Ent Specialist", ("ent",)),
+            ("ENT (Otolaryngologist)", ("ent",)),
+            ("Gastroentrologist", ("gastroenterology",)),
+            ("Cardiologist or General Physician", ("cardiology", "general-physician")),
+            ("astrologer", ()),
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(specialties.normalize(text), ids)
+        self.assertEqual(specialties.canonical_name("cardiac surgeon"), "Cardiologist")
+
+    def test_lists_and_none(self):
+        self.assertEqual(specialties.normalize(["Cardiologist", "ENT", "cardiology"]), ("cardiology", "ent"))
+        self.assertEqual(specialties.normalize(None), ())
+        self.assertEqual(specialties.normalize(42), ())
+        info, _ = triage.extract_patient_info(patient("chest pain"))
+        self.assertEqual(triage.doctors_flight_key(["Cardiologist"], info)[1], ("cardiology",))
+        self.assertEqual(triage.doctors_flight_key(None, info)[1], "none")
+
+    def test_a_list_recommendation_still_finds_doctors(self):
+        directory = DoctorDirectory(lambda: FakeSupabase(doctors=[doctor("Dr A", 3, "Cardiologist")]))
+        info, _ = triage.extract_patient_info(patient("chest pain"))
+        with mock.patch.object(views, "directory", directory):
+            found = views.fetch_doctors(["Cardiologist", "Neurologist"], info)
+            self.assertEqual([d["full_name"] for d in found], ["Dr A"])
+            self.assertEqual(views.fetch_doctors(None, info), [])
+
+
+class BatchTriageTests(SimpleTestCase):
+    def setUp(self):
+        self.prompts = []
+        self.writer = mock.Mock()
+        self.lookups = []
+
+        async def generate_async(prompt, deadline):
+            self.prompts.append(prompt)
+            await asyncio.sleep(0.05)
+            if "broken" in prompt:
+                raise RuntimeError("model failed")
+            return SimpleNamespace(text='{"doctor_recommendation": "Cardiologist"}'), "m"
+
+        def search(specialty, **options):
+            self.lookups.append(specialty)
+            return [{"name": "Dr A"}]
+
+        no_cache = SimpleNamespace(get=lambda info: None, set=lambda *a: None)
+        directory = SimpleNamespace(loaded=True, search=search)
+        patches = [
+            mock.patch.dict(admission.config, ENABLED=False),
+            mock.patch.dict(rules.config, ENABLED=False),
+            mock.patch.object(gemini, "registry", SimpleNamespace(generate_async=generate_async)),
+            mock.patch.object(async_views, "triage_cache", no_cache),
+            mock.patch.object(batch, "triage_cache", no_cache),
+            mock.patch.object(async_views, "directory", directory),
+            mock.patch.object(batch, "directory", directory),
+            mock.patch.object(batch, "session_writer", self.writer),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, items, role="authenticated"):
+        claims = {"sub": "caller", "role": role}
+        authenticator = SimpleNamespace(cached=lambda token: claims)
+        request = AsyncRequestFactory().post(
+            "/api/analyze-symptoms/batch/", codec.dumps({"patients": items}),
+            content_type="application/json", headers={"Authorization": "Bearer token"},
+        )
+        with mock.patch.object(auth, "authenticator", authenticator):
+            response = asyncio.run(async_views.analyze_symptoms_batch(request))
+        return response.status_code, codec.loads(response.content)
+
+    def filed_under(self):
+        (sessions_, ), _ = self.writer.enqueue_many.call_args
+        return sorted(auth_id for auth_id, _ in sessions_)
+
+    def test_every_invalid_item_is_reported_and_nothing_runs(self):
+        status, body = self.post([patient("fever"), {"age": 500}, "x"])
+        self.assertEqual(status, 400)
+        self.assertEqual([error["index"] for error in body["errors"]], [1, 2])
+        self.assertEqual(self.prompts, [])
+
+    def test_shared_generations_and_doctor_lists(self):
+        status, body = self.post([patient("chest pain"), patient("chest pain"), patient("palpitations")])
+        self.assertEqual((status, body["count"], body["failed"]), (200, 3, 0))
+        self.assertEqual(len(self.prompts), 2)
+        self.assertEqual(self.lookups, ["Cardiologist"])
+        self.assertEqual([result["recommended_doctors"] for result in body["results"]], [[{"name": "Dr A"}]] * 3)
+        self.assertEqual(self.filed_under(), ["caller"] * 3)
+
+    def test_one_failure_does_not_fail_the_batch(self):
+        status, body = self.post([patient("broken arm"), patient("chest pain")])
+        self.assertEqual((status, body["failed"]), (200, 1))
+        self.assertEqual(body["results"][0], {"index": 0, "error": "model failed"})
+
+    def test_only_the_service_role_files_sessions_for_others(self):
+        items = [patient("chest pain", auth_id="caller"), patient("fever", auth_id="someone-else"), patient("cough")]
+        status, body = self.post(items)
+        self.assertEqual(status, 403)
+        self.assertEqual(body["errors"], [{"index": 1, "error": "Only a service-role caller may set auth_id"}])
+        self.assertEqual(self.prompts, [])
+
+        status, body = self.post(items, role="service_role")
+        self.assertEqual(status, 200)
+        self.assertEqual(self.filed_under(), ["caller", "caller", "someone-else"])
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_percentiles(self):
+        samples = [i / 1000 for i in range(1, 101)]
+        summary = benchmark.summarize(samples)
+        self.assertEqual((summary["count"], summary["p50_ms"], summary["p95_ms"], summary["max_ms"]), (100, 50, 95, 100))
+        self.assertEqual(benchmark.summarize([])["p99_ms"], None)
+
+    def test_profiles_and_workloads_are_reproducible(self):
+        draws = lambda: [benchmark.Profile(100, 0.5, 0.3, seed=1).draw() for _ in range(3)]
+        self.assertEqual(draws(), draws())
+        profile = benchmark.Profile(error_rate=0.25, seed=2)
+        failures = sum(profile.draw()[1] for _ in range(4000))
+        self.assertAlmostEqual(failures / 4000, 0.25, delta=0.03)
+        requests = lambda: [benchmark.Workload("analyze", 5, 0.5, 3, ["u1"]).next()[2] for _ in range(5)]
+        self.assertEqual(requests(), requests())
+
+    def test_compare(self):
+        def report(p95, rps):
+            return {"runs": [{"server": "wsgi", "scenario": "analyze", "concurrency": 8,
+                              "latency": {"p95_ms": p95}, "throughput_rps": rps}]}
+        [line] = benchmark.compare(report(90, 110), report(100, 100))
+        self.assertIn("p95 -10.0%  throughput +10.0%", line)
+
+    def test_command_writes_a_report(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "run.json")
+            subprocess.run(
+                [sys.executable, "manage.py", "benchmark", "--servers", "wsgi,asgi", "--scenarios", "analyze,auth",
+                 "--concurrency", "4", "--requests", "10", "--llm-latency-ms", "1", "--db-latency-ms", "0",
+                 "--roster", "50", "--users", "3", "--output", output],
+                cwd=settings.BASE_DIR, check=True, capture_output=True, timeout=120,
+            )
+            with open(output) as f:
+                report = codec.loads(f.read())
+        self.assertEqual([(run["server"], run["scenario"], run["statuses"]) for run in report["runs"]], [
+            ("wsgi", "analyze", {"200": 10}), ("wsgi", "auth", {"200": 10}),
+            ("asgi", "analyze", {"200": 10}), ("asgi", "auth", {"200": 10}),
+        ])
+        self.assertIn("validate", report["runs"][0]["stages"])
+
+
+class MetricsTests(SimpleTestCase):
+    def traced(self, request):
+        time.sleep(0.002)
+        with metrics.span("db"):
+            time.sleep(0.002)
+        with metrics.span("llm"):
+            pass
+        with metrics.span("db"):
+            time.sleep(0.002)
+        return HttpResponse("ok")
+
+    def timings(self, response):
+        return {part.split(";")[0]: float(part.split("dur=")[1]) for part in response["Server-Timing"].split(", ")}
+
+    def test_spans_are_summed_into_server_timing(self):
+        middleware = metrics.ServerTimingMiddleware(self.traced)
+        timings = self.timings(middleware(RequestFactory().get("/api/doctors/")))
+        self.assertEqual(list(timings), ["db", "llm", "total"])
+        self.assertGreaterEqual(timings["db"], 4.0)
+        self.assertGreater(timings["total"], timings["db"] + timings["llm"])
+        self.assertFalse(middleware(RequestFactory().get("/")).has_header("Server-Timing"))
+
+    def test_async_requests_are_timed_too(self):
+        async def view(request):
+            with metrics.span("cache"):
+                await asyncio.sleep(0.001)
+            with metrics.without_server_timing(), metrics.span("hidden"):
+                pass
+            return HttpResponse("ok")
+
+        response = asyncio.run(metrics.ServerTimingMiddleware(view)(AsyncRequestFactory().get("/api/x/")))
+        self.assertEqual(list(self.timings(response)), ["cache", "total"])
+
+    def test_histogram_text(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", ["stage"], buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(seconds, 'say "hi"')
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 1',
+            'test_seconds_bucket{stage="say \\"hi\\"",le="1.0"} 3',
+            'test_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 4',
+            'test_seconds_sum{stage="say \\"hi\\""} 4.05',
+            'test_seconds_count{stage="say \\"hi\\""} 4',
+        ])
+
+    def test_metrics_endpoint(self):
+        with metrics.span("rules"):
+            pass
+        response = self.client.get("/api/metrics")
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('bookmydoc_stage_seconds_count{stage="rules"}', text)
+        self.assertIn("# TYPE bookmydoc_requests_in_flight gauge", text)
+        self.assertIn("Server-Timing", response)
+
+
+class WarmUpTests(SimpleTestCase):
+    def setUp(self):
+        self.ran = []
+        steps = {name: (lambda name=name: self.ran.append(name)) for name in ("first", "second")}
+        steps["broken"] = lambda: 1 / 0
+        self.warmup = warmup.WarmUp(steps)
+        patches = [
+            mock.patch.dict(warmup.config, ENABLED=True, STEPS=["first", "broken", "second"]),
+            mock.patch.object(views, "warmup", self.warmup),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_not_ready_until_every_step_has_run(self):
+        response = self.client.get("/api/ready/")
+        self.assertEqual((response.status_code, response.json()["started"]), (503, False))
+        self.assertTrue(self.warmup.start(background=False))
+        self.assertEqual(self.ran, ["first", "second"])
+        response = self.client.get("/api/ready/")
+        self.assertEqual(response.status_code, 200)
+        steps = response.json()["steps"]
+        self.assertEqual(list(steps), ["first", "broken", "second"])
+        self.assertIn("division by zero", steps["broken"]["error"])
+        self.assertIsNone(steps["first"]["error"])
+
+    def test_runs_once_per_process(self):
+        self.assertTrue(self.warmup.start(background=False))
+        self.assertFalse(self.warmup.start(background=False))
+        self.assertEqual(self.ran, ["first", "second"])
+        # A forked worker does not inherit the parent's warm-up
+        with mock.patch.object(warmup.os, "getpid", return_value=-1):
+            self.assertFalse(self.warmup.ready)
+            self.assertTrue(self.warmup.start(background=False))
+        self.assertEqual(self.ran, ["first", "second"] * 2)
+
+    def test_first_triage_is_recorded_once(self):
+        self.warmup.record_triage()
+        first = self.warmup.first_triage_at
+        self.warmup.record_triage()
+        self.assertEqual(self.warmup.first_triage_at, first)
+        self.assertIsNotNone(self.warmup.stats()["first_triage_seconds"])
+
+    def test_disabled_warmup_is_always_ready(self):
+        with mock.patch.dict(warmup.config, ENABLED=False):
+            self.assertEqual(self.client.get("/api/ready/").status_code, 200)
+
+
+class SpaShellTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "index.html")
+        self.write("<html><body>" + "app " * 200 + "</body></html>")
+        patcher = mock.patch.object(spa, "shell", spa.Shell(self.path, reload=True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, html, mtime=None):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(html)
+        if mtime is not None:
+            os.utime(self.path, ns=(mtime, mtime))
+
+    def get(self, **headers):
+        return spa.index(RequestFactory().get("/", headers=headers))
+
+    def test_picks_the_accepted_encoding(self):
+        plain = self.get()
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertIn(b"app app", plain.content)
+        zipped = self.get(accept_encoding="gzip, deflate")
+        self.assertEqual(zipped["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        self.assertEqual(zipped["Content-Length"], str(len(zipped.content)))
+        if spa.brotli is not None:
+            self.assertEqual(self.get(accept_encoding="gzip, br")["Content-Encoding"], "br")
+        self.assertEqual(len({plain["ETag"], zipped["ETag"]}), 2)
+        for response in (plain, zipped):
+            self.assertEqual(response["Cache-Control"], "no-cache")
+            self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get(accept_encoding="gzip")["ETag"]
+        response = self.get(accept_encoding="gzip", if_none_match=etag)
+        self.assertEqual((response.status_code, response.content), (304, b""))
+        self.assertEqual(response["ETag"], etag)
+        # The plain body has another ETag, so it is sent in full
+        self.assertEqual(self.get(if_none_match=etag).status_code, 200)
+
+    def test_reloads_when_the_file_changes(self):
+        first = self.get()["ETag"]
+        self.write("<html>new build</html>", mtime=os.stat(self.path).st_mtime_ns + 10**9)
+        response = self.get()
+        self.assertNotEqual(response["ETag"], first)
+        self.assertEqual(response.content, b"<html>new build</html>")
+
+    def test_missing_build_is_a_404(self):
+        os.remove(self.path)
+        with mock.patch.object(spa, "shell", spa.Shell(self.path)), self.assertRaises(Http404):
+            self.get()
@@ -0,0 +1,261 @@
+"""
+Building blocks of the symptom triage pipeline.
+
+These helpers hold no I/O of their own, so the sync view in ``views.py`` and
+the async view in ``async_views.py`` run exactly the same validation, prompt,
+parsing and formatting steps and only differ in how they wait on Gemini and
+Supabase.
+"""
+from datetime import datetime
+
+from . import codec, specialties, symptoms as symptom_normalizer
+from .cache import cache_key
+from .schema import Any, Integer, Number, Schema, String
+
+VALID_GENDERS = {'male', 'female', 'trans'}
+
+# Nested select used for the specialty -> doctors lookup
+DOCTOR_SELECT = """
+    *,
+    doctor_specialties!inner(
+        specialties!inner(name)
+    )
+"""
+DOCTOR_LIMIT = 10
+
+# Fields of a doctor row that are returned to the client
+DOCTOR_FIELDS = (
+    "full_name",
+    "clinic_name",
+    "experience",
+    "phone",
+    "consultation_fee",
+    "latitude",
+    "longitude",
+)
+
+# Specialists the model is allowed to recommend (see the prompt)
+ALLOWED_SPECIALISTS = [
+    "General Physician", "Cardiologist", "Neurologist", "Pulmonologist", "Ent Specialist",
+    "Gastroenterologist", "Dermatologist", "Orthopedic", "Endocrinologist",
+    "Psychiatrist", "Gynecologist", "Urologist",
+]
+
+# Disease to specialist mapping
+DISEASE_SPECIALIST_MAP = {
+    "asthma": "Pulmonologist",
+    "heart disease": "Cardiologist",
+    "respiratory infection": "Pulmonologist",
+    "skin infection": "Dermatologist",
+    "allergy": "Dermatologist",
+    "dengue": "General Physician",
+    "viral infection": "General Physician",
+    "anemia": "General Physician",
+    "arthritis": "Orthopedic",
+    "sinusitis": "ENT Specialist",
+    "diabetes": "Endocrinologist",
+    "hypertension": "Cardiologist",
+    "migraine": "Neurologist",
+    "depression": "Psychiatrist",
+    "anxiety": "Psychiatrist"
+}
+
+# -----------------------------
+# Request validation
+# -----------------------------
+PATIENT_SCHEMA = Schema(
+    age=Integer(gt=0, lt=120, message="Invalid age value: {value}. Must be an integer >0 and <120."),
+    height=Number(gt=30, lt=300, message="Invalid height value: {value}. Must be >30 and <300 (cm)."),
+    weight=Number(gt=2, lt=600, message="Invalid weight value: {value}. Must be >2 and <600 (kg)."),
+    gender=String(
+        choices=VALID_GENDERS, lower=True,
+        message="Invalid gender value: {value}. Valid values are: male, female, trans.",
+    ),
+    symptoms=Any(types=(str, list), required=True, required_message="Please provide your symptoms"),
+    location=Any(),
+    latitude=Number(ge=-90, le=90, message="Invalid latitude value: {value}. Must be between -90 and 90."),
+    longitude=Number(ge=-180, le=180, message="Invalid longitude value: {value}. Must be between -180 and 180."),
+)
+
+
+def extract_patient_info(data):
+    """Validate an analyze-symptoms payload.
+
+    Returns ``(info, None)`` on success or ``(None, errors)`` where
+    ``errors`` maps each invalid field to its message. Numbers in ``info``
+    are already coerced.
+    """
+    info, errors = PATIENT_SCHEMA.validate(data)
+    if errors:
+        return None, errors
+    # Canonical complaint list for the cache key and, next to the patient's
+    # own words, the prompt; the stored session keeps what the patient wrote
+    info["normalized_symptoms"] = symptom_normalizer.normalize(info["symptoms"])
+    info["bmi"] = compute_bmi(info["height"], info["weight"])
+    return info, None
+
+
+def compute_bmi(height, weight):
+    if not (height and weight):
+        return None
+    try:
+        h_m = float(height) / 100
+        w_kg = float(weight)
+        return round(w_kg / (h_m ** 2), 1)
+    except (ValueError, TypeError, ZeroDivisionError):
+        return None
+
+
+def patient_location(info):
+    """``(lat, lng)`` floats from the request, or ``(None, None)``."""
+    try:
+        lat, lng = float(info["latitude"]), float(info["longitude"])
+    except (TypeError, ValueError):
+        return None, None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, None
+    return lat, lng
+
+
+# -----------------------------
+# Prompt
+# -----------------------------
+def format_symptoms(symptoms):
+    return symptoms if isinstance(symptoms, str) else ", ".join(symptoms)
+
+
+def standard_terms(info):
+    """Prompt line with the normalized complaints, unless they add nothing."""
+    terms = info.get("normalized_symptoms")
+    if not terms or ", ".join(terms).lower() == format_symptoms(info["symptoms"]).strip().lower():
+        return ""
+    return f"\nStandard terms (spelling-corrected; the patient's words above take precedence): {', '.join(terms)}"
+
+
+def build_prompt(info, today=None):
+    today = today or datetime.today()
+    date_str = today.strftime("%Y-%m-%d")
+    month = today.month
+    bmi = info["bmi"]
+
+    return f"""
+You are a clinical triage assistant used in a digital healthcare platform for patients in India.
+Your task is to assess urgency and recommend the correct first medical specialist.
+Your role is to provide a **preliminary medical assessment only**.
+Do NOT provide treatment, lifestyle, or wellness advice.
+
+[PATIENT DATA]
+Age: {info["age"]}, Gender: {info["gender"]}, Location: {info["location"]}
+Height: {info["height"]}, Weight: {info["weight"]}, BMI: {bmi if bmi else "unknown"}
+Date: {date_str} (Month: {month})
+Symptoms: {format_symptoms(info["symptoms"])}{standard_terms(info)}
+
+[LOGIC RULES]
+- onsider age-specific risk groups (pediatric, adult, geriatric).
+- Adjust risk based on BMI category if provided (underweight, normal, overweight, obese).
+- Consider seasonal or regional illnesses based on location and month
+- Use only common, clinically recognized conditions
+- If symptoms are unclear, choose statistically likely likely conditions in India.
+
+[ALLOWED SPECIALISTS — CHOOSE ONE ONLY]
+["General Physician","Cardiologist","Neurologist","Pulmonologist","Ent Specialist",
+ "Gastroenterologist","Dermatologist","Orthopedic","Endocrinologist",
+ "Psychiatrist","Gynecologist","Urologist"]
+
+[OUTPUT — JSON ONLY]
+{{
+  "possible_diseases": ["Disease1","Disease2"],
+  "severity": "mild | moderate | severe | emergency",
+  "doctor_recommendation": "one allowed specialist",
+  "advice": "Short, friendly, clinical next step"
+}}
+"""
+
+
+# -----------------------------
+# Model output
+# -----------------------------
+def parse_reply(raw_text, bmi):
+    """Turn model text into the reply dict, tolerating code fences."""
+    raw_text = raw_text.strip()
+    if raw_text.startswith("```"):
+        raw_text = raw_text.strip("`")
+        if raw_text.startswith("json"):
+            raw_text = raw_text[4:].strip()
+    try:
+        return codec.loads(raw_text)
+    except codec.DecodeError:
+        return {"message": raw_text, "bmi": bmi}
+
+
+def search_term_for(recommended_specialty):
+    """Substring used to ``ilike``-search doctors for the model's specialty."""
+    if not recommended_specialty:
+        return None
+    ids = specialties.normalize(recommended_specialty)
+    # if not recognised, use the original suggestion in search
+    return specialties.BY_ID[ids[0]].search if ids else recommended_specialty
+
+
+# -----------------------------
+# Doctors
+# -----------------------------
+def doctor_query(client, search_term):
+    """Doctors query builder for ``client`` (sync or async Supabase)."""
+    return client.table("doctors") \
+        .select(DOCTOR_SELECT) \
+        .ilike("doctor_specialties.specialties.name", f"%{search_term}%") \
+        .order("experience", desc=True) \
+        .limit(DOCTOR_LIMIT)
+
+
+def format_doctors(rows):
+    return [{field: doc.get(field) for field in DOCTOR_FIELDS} for doc in rows or []]
+
+
+def attach_doctors(reply_json, recommended_specialty, doctors_list):
+    reply_json["recommended_doctors"] = doctors_list
+    reply_json["recommended_specialization"] = recommended_specialty
+    return reply_json
+
+
+# -----------------------------
+# Single-flight keys
+# -----------------------------
+def triage_flight_key(info):
+    """Requests with the same cache key would get the same generation."""
+    return ("triage", cache_key(info))
+
+
+def doctors_flight_key(recommended_specialty, info):
+    latitude, longitude = patient_location(info)
+    ids = specialties.normalize(recommended_specialty)
+    return ("doctors", ids or str(recommended_specialty).strip().lower(), latitude, longitude)
+
+
+# -----------------------------
+# Symptom sessions
+# -----------------------------
+def session_record(patient_id, info, reply_json, doctors_list):
+    symptoms = info["symptoms"]
+    now = datetime.utcnow().isoformat()
+    return {
+        "patient_id": patient_id,
+        "started_at": now,
+        "ended_at": now,
+        "symptoms": symptoms.split(",") if isinstance(symptoms, str) else symptoms,
+        "personal_info": {
+            "age": info["age"],
+            "gender": info["gender"],
+            "height": info["height"],
+            "weight": info["weight"]
+        },
+        "location": {
+            "location": info["location"],
+            "latitude": info["latitude"],
+            "longitude": info["longitude"]
+        },
+        "analysis_result": reply_json,
+        "recommended_doctors": doctors_list,
+        "created_at": now
+    }
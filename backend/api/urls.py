@@ -1,7 +1,29 @@
 from django.urls import path
-from .views import analyze_symptoms, recommend_doctor
+from .views import (
+    analyze_symptoms,
+    recommend_doctor,
+    list_available_models,
+    search_doctors,
+    list_doctors,
+    refresh_doctor_directory,
+    triage_stats,
+    prometheus_metrics,
+    readiness,
+    export_sessions,
+)
+from .async_views import analyze_symptoms_async, analyze_symptoms_batch
 
 urlpatterns = [
     path("analyze-symptoms/", analyze_symptoms, name="analyze_symptoms"),
+    path("analyze-symptoms/async/", analyze_symptoms_async, name="analyze_symptoms_async"),
+    path("analyze-symptoms/batch/", analyze_symptoms_batch, name="analyze_symptoms_batch"),
     path("recommend-doctor/", recommend_doctor, name="recommend_doctor"),
+    path("doctors/", list_doctors, name="list_doctors"),
+    path("doctors/search/", search_doctors, name="search_doctors"),
+    path("doctors/refresh/", refresh_doctor_directory, name="refresh_doctor_directory"),
+    path("sessions/export/", export_sessions, name="export_sessions"),
+    path("triage/stats/", triage_stats, name="triage_stats"),
+    path("metrics", prometheus_metrics, name="metrics"),
+    path("ready/", readiness, name="readiness"),
+    path("models/", list_available_models, name="list_available_models"),
 ]
@@ -1,369 +1,186 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-import json
+import base64
+import itertools
 import os
 import math
-import google.generativeai as genai
-from dotenv import load_dotenv
 from datetime import datetime
-import jwt
-from supabase import create_client, Client
-from functools import wraps
+
+from . import admission, codec, db, export, gemini, metrics, rules, specialties, streaming, triage
+from .admission import llm_gate, rate_limit
+from .auth import authenticator, require_admin, require_auth
+from .codec import JsonResponse
+from .cache import triage_cache
+from .directory import LISTING_FIELDS, directory
+from .responses import conditional_json
+from .schema import Integer, Number, Schema, String, error_body
+from .sessions import session_writer
+from .singleflight import flights
+from .warmup import warmup
 
 # -----------------------------
-# Load environment variables
+# Triage steps shared by the JSON and streaming responses
 # -----------------------------
-load_dotenv()
-GEN_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEN_API_KEY)
+def generate_reply(info, deadline=None):
+    # Fastest healthy model from the registry, within the concurrency cap
+    deadline = deadline or gemini.Deadline()
+    prompt = triage.build_prompt(info)
+    response, _ = llm_gate.run(lambda: gemini.registry.generate(prompt, deadline), deadline.remaining())
+    reply_json = triage.parse_reply(response.text, info["bmi"])
+    reply_json["source"] = "llm"
+    triage_cache.set(info, reply_json)
+    return reply_json
+
+
+def run_triage(info, deadline=None):
+    """Rule-based, cached or freshly generated triage reply for ``info``.
+
+    Identical requests arriving while a generation is in flight wait for it
+    instead of starting their own. Raises ``gemini.AllModelsFailed`` when no
+    model answers (``gemini.DeadlineExceeded`` when none did before
+    ``deadline``).
+    """
+    with metrics.span("rules"):
+        reply_json = rules.local_triage(info)
+    if reply_json is not None:
+        metrics.triage_sources.inc("rules")
+        return reply_json
+    with metrics.span("cache"):
+        reply_json = triage_cache.get(info)
+    if reply_json is not None:
+        metrics.triage_sources.inc("cache")
+        return reply_json
+    with metrics.span("llm"):
+        reply_json = flights.do(triage.triage_flight_key(info), lambda: generate_reply(info, deadline))
+    metrics.triage_sources.inc("llm")
+    return reply_json
+
+
+def fetch_doctors(recommended_specialty, info):
+    """Doctors for the specialty, nearest first when the patient shared a location."""
+    if not recommended_specialty:
+        return []
+    with metrics.span("doctors"):
+        return flights.do(
+            triage.doctors_flight_key(recommended_specialty, info),
+            lambda: lookup_doctors(recommended_specialty, info),
+        )
+
+
+def lookup_doctors(recommended_specialty, info):
+    search_term = triage.search_term_for(recommended_specialty)
+    latitude, longitude = triage.patient_location(info)
+    try:
+        return directory.search(
+            recommended_specialty, limit=triage.DOCTOR_LIMIT, latitude=latitude, longitude=longitude,
+        )
+    except Exception as e:
+        # Directory could not load; fall back to querying Supabase directly
+        metrics.swallowed("doctor_directory", f"Doctor directory unavailable: {e}")
+    metrics.fallbacks.inc("doctor_query")
+    try:
+        doctors_data = db.execute(triage.doctor_query(db.get_supabase(), search_term))
+        return triage.format_doctors(doctors_data.data)
+    except Exception as e:
+        metrics.swallowed("doctor_query", f"Error fetching doctors: {e}")
+        return []
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 
-# -----------------------------
-# Optional JWT authentication
-# -----------------------------
-def require_auth(view_func):
-    @wraps(view_func)
-    def wrapper(request, *args, **kwargs):
-        auth_header = request.META.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return JsonResponse({"error": "Authorization header missing or invalid"}, status=401)
-        token = auth_header.split(' ')[1]
-        try:
-            # Decode without verifying signature (for dev/testing)
-            payload = jwt.decode(token, options={"verify_signature": False})
-            request.user_id = payload.get('sub')
-        except jwt.ExpiredSignatureError:
-            return JsonResponse({"error": "Token expired"}, status=401)
-        except jwt.InvalidTokenError:
-            return JsonResponse({"error": "Invalid token"}, status=401)
-        return view_func(request, *args, **kwargs)
-    return wrapper
+def save_session(request, info, reply_json, doctors_list):
+    """Queue the symptom session record; the write happens in the background."""
+    # patient_id is resolved from auth_id (request.user_id) by the writer
+    with metrics.span("session"):
+        session_writer.enqueue(
+            getattr(request, "user_id", None),
+            triage.session_record(None, info, reply_json, doctors_list),
+        )
+
+
+def triage_events(request, info, after_close, deadline):
+    """SSE events for one triage: ``triage``, then ``doctors``, then ``done``."""
+    try:
+        reply_json = run_triage(info, deadline)
+    except admission.Rejected as e:
+        yield streaming.sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        return
+    except Exception as e:
+        yield streaming.sse_event("error", {"error": str(e)})
+        return
+    yield streaming.sse_event("triage", reply_json)
+
+    recommended_specialty = reply_json.get("doctor_recommendation")
+    doctors_list = fetch_doctors(recommended_specialty, info)
+    yield streaming.sse_event("doctors", {
+        "recommended_specialization": recommended_specialty,
+        "recommended_doctors": doctors_list,
+    })
+
+    triage.attach_doctors(reply_json, recommended_specialty, doctors_list)
+    after_close.append(lambda: save_session(request, info, reply_json, doctors_list))
+    yield streaming.sse_event("done", {})
+
 
 # -----------------------------
 # Main endpoint
 # -----------------------------
 @csrf_exempt
-# @require_auth  # Uncomment after login/signup setup
+@require_auth
+@rate_limit("analyze")
 def analyze_symptoms(request):
     if request.method != "POST":
         return JsonResponse({"error": "Only POST requests allowed"}, status=405)
 
+    # End-to-end budget for the Gemini call, counted from here
+    deadline = gemini.Deadline()
     try:
-        data = json.loads(request.body)
-
-        # -----------------------------
-        # Extract user info
-        # -----------------------------
-        height = data.get("height", None)
-        weight = data.get("weight", None)
-        age = data.get("age", None)
-        gender = data.get("gender", None)
-        symptoms = data.get("symptoms", "")
-        location = data.get("location", None)
-        user_lat = data.get("latitude", None)
-        user_lng = data.get("longitude", None)
-
-        # -----------------------------
-        # Validate gender value
-        # -----------------------------
-        if gender:
-            valid_genders = {'male', 'female', 'trans'}
-            if gender.lower() not in valid_genders:
-                return JsonResponse({"error": f"Invalid gender value: {gender}. Valid values are: male, female, trans."}, status=400)
-
-        # -----------------------------
-        # Validate age
-        # -----------------------------
-        if age is not None:
-            try:
-                age_n = int(age)
-                if age_n <= 0 or age_n >= 120:
-                    return JsonResponse({"error": f"Invalid age value: {age}. Must be an integer >0 and <120."}, status=400)
-            except (ValueError, TypeError):
-                return JsonResponse({"error": f"Invalid age value: {age}. Must be an integer >0 and <120."}, status=400)
+        data = codec.loads(request.body)
 
         # -----------------------------
-        # Validate height
+        # Extract and validate user info
         # -----------------------------
-        if height is not None:
-            try:
-                height_n = float(height)
-                if height_n <= 30 or height_n >= 300:
-                    return JsonResponse({"error": f"Invalid height value: {height}. Must be >30 and <300 (cm)."}, status=400)
-            except (ValueError, TypeError):
-                return JsonResponse({"error": f"Invalid height value: {height}. Must be >30 and <300 (cm)."}, status=400)
+        with metrics.span("validate"):
+            info, errors = triage.extract_patient_info(data)
+        if errors:
+            return JsonResponse(error_body(errors), status=400)
 
         # -----------------------------
-        # Validate weight
+        # Streaming mode: send the diagnosis as soon as it parses,
+        # the doctor list when it arrives and save the session afterwards
         # -----------------------------
-        if weight is not None:
-            try:
-                weight_n = float(weight)
-                if weight_n <= 2 or weight_n >= 600:
-                    return JsonResponse({"error": f"Invalid weight value: {weight}. Must be >2 and <600 (kg)."}, status=400)
-            except (ValueError, TypeError):
-                return JsonResponse({"error": f"Invalid weight value: {weight}. Must be >2 and <600 (kg)."}, status=400)
-
-        if not symptoms:
-            return JsonResponse({"error": "Please provide your symptoms"}, status=400)
+        if streaming.wants_event_stream(request):
+            after_close = []
+            # Under ASGI a blocking stream would be read to the end before sending
+            stream_class = streaming.AsyncEventStream if isinstance(request, ASGIRequest) else streaming.EventStream
+            stream = stream_class(triage_events(request, info, after_close, deadline), after_close)
+            return streaming.event_stream_response(stream)
 
         # -----------------------------
-        # Calculate BMI
-        # -----------------------------
-        bmi = None
-        if height and weight:
-            try:
-                h_m = float(height) / 100
-                w_kg = float(weight)
-                bmi = round(w_kg / (h_m ** 2), 1)
-            except:
-                bmi = None
-
-        # -----------------------------
-        # Prepare Gemini prompt
-        # -----------------------------
-        today = datetime.today()
-        date_str = today.strftime("%Y-%m-%d")
-        month = today.month
-
-#         prompt = f"""
-# Hello! I am your AI health assistant.
-# Height: {height}, Weight: {weight}, Age: {age}, Gender: {gender}, BMI: {bmi if bmi else 'null'}, Location: {location}, Date: {date_str} (month: {month})
-# Symptoms: {symptoms}
-# Respond ONLY with valid JSON like:
-# {{"possible_diseases": ["Disease1"], "severity": "mild/moderate/severe", "doctor_recommendation": "Specialization", "advice": "Advice text"}}
-# """
-
-        prompt = f"""
-You are a clinical triage assistant used in a digital healthcare platform for patients in India.
-Your task is to assess urgency and recommend the correct first medical specialist.
-Your role is to provide a **preliminary medical assessment only**.
-Do NOT provide treatment, lifestyle, or wellness advice.
-
-[PATIENT DATA]
-Age: {age}, Gender: {gender}, Location: {location}
-Height: {height}, Weight: {weight}, BMI: {bmi if bmi else "unknown"}
-Date: {date_str} (Month: {month})
-Symptoms: {symptoms}
-
-[LOGIC RULES]
-- onsider age-specific risk groups (pediatric, adult, geriatric).
-- Adjust risk based on BMI category if provided (underweight, normal, overweight, obese).
-- Consider seasonal or regional illnesses based on location and month
-- Use only common, clinically recognized conditions
-- If symptoms are unclear, choose statistically likely likely conditions in India.
-
-[ALLOWED SPECIALISTS — CHOOSE ONE ONLY]
-["General Physician","Cardiologist","Neurologist","Pulmonologist","Ent Specialist",
- "Gastroenterologist","Dermatologist","Orthopedic","Endocrinologist",
- "Psychiatrist","Gynecologist","Urologist"]
-
-[OUTPUT — JSON ONLY]
-{{
-  "possible_diseases": ["Disease1","Disease2"],
-  "severity": "mild | moderate | severe | emergency",
-  "doctor_recommendation": "one allowed specialist",
-  "advice": "Short, friendly, clinical next step"
-}}
-"""
-
-
-# "clinical_logic": "Short medical reasoning",
-        # -----------------------------
-        # Call Gemini API (try dynamic list of supported models)
-        # -----------------------------
-        response = None
-        last_error = None
-        try:
-            # Get models supporting 'generateContent'
-            available_models = [
-                model.name for model in genai.list_models() 
-                if 'generateContent' in model.supported_generation_methods
-            ]
-        except Exception as e:
-            available_models = [
-                "gemini-1.5-flash-latest",
-                "gemini-1.5-flash",
-                "gemini-2.0-flash-exp"
-            ]  # Fallback list if list_models call fails
-
-        for model_name in available_models:
-            try:
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(prompt)
-                break
-            except Exception as e:
-                last_error = str(e)
-                # Log the error for better debugging
-                print(f"Model {model_name} failed with error: {last_error}")
-                continue
-
-        if response is None:
-            return JsonResponse({"error": f"All models failed. Last error: {last_error}"}, status=500)
-
-        raw_text = response.text.strip()
-
-        # -----------------------------
-        # Clean markdown/code fences
-        # -----------------------------
-        if raw_text.startswith("```"):
-            raw_text = raw_text.strip("`")
-            if raw_text.startswith("json"):
-                raw_text = raw_text[4:].strip()
-
-        # -----------------------------
-        # Parse JSON safely
+        # Call Gemini API, unless an equivalent request was answered recently
         # -----------------------------
         try:
-            reply_json = json.loads(raw_text)
-        except json.JSONDecodeError:
-            reply_json = {"message": raw_text, "bmi": bmi}
+            reply_json = run_triage(info, deadline)
+        except admission.Rejected as e:
+            return admission.rejection_response(e)
+        except gemini.AllModelsFailed as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
+        warmup.record_triage()
 
         # -----------------------------
         # Fetch recommended doctors from Supabase
         # -----------------------------
-        doctors_list = []
         recommended_specialty = reply_json.get("doctor_recommendation")
-        # Normalize specialty names to match DB canonical values
-        mapped_specialty = None
-        if recommended_specialty:
-            s = str(recommended_specialty).strip().lower()
-            # common synonyms / misspellings map
-            specialty_map = {
-                'general practitioner': 'General Physician',
-                'general practioneer': 'General Physician',
-                'gp': 'General Physician',
-                'general physician': 'General Physician',
-                'internist': 'Internal Medicine',
-                'cardiologist': 'Cardiologist',
-                'ent': 'ENT',
-                'ear nose throat': 'ENT'
-            }
-            # try exact mapping first
-            mapped_specialty = specialty_map.get(s)
-            # fallback: take first token before comma/and/paren and try mapping
-            if not mapped_specialty:
-                token = s.split('(')[0].split(' and ')[0].split(',')[0].strip()
-                mapped_specialty = specialty_map.get(token)
-            # if still not mapped, title-case the original suggestion to use in search
-            if not mapped_specialty:
-                mapped_specialty = recommended_specialty
-        if mapped_specialty:
-            # use mapped_specialty for search
-            search_specialty = mapped_specialty
-        else:
-            search_specialty = None
-        if recommended_specialty:
-            try:
-                query = supabase.table("doctors") \
-                    .select("""
-                        *,
-                        doctor_specialties!inner(
-                            specialties!inner(name)
-                        )
-                    """)
-
-                # choose mapped search specialty if available
-                search_term = search_specialty if search_specialty is not None else recommended_specialty
-                query = query.ilike("doctor_specialties.specialties.name", f"%{search_term}%")
-
-                # Location filter (5km bounding box) temporarily disabled — enable if needed
-                # if user_lat is not None and user_lng is not None:
-                #     # 1 degree latitude ~= 111.32 km
-                #     lat_delta = 5.0 / 111.32
-                #     # longitude delta adjusted by latitude
-                #     try:
-                #         lng_delta = 5.0 / (111.32 * math.cos(math.radians(float(user_lat)))) if float(user_lat) != 0 else lat_delta
-                #     except Exception:
-                #         lng_delta = lat_delta
-
-                #     query = query \
-                #         .gte("latitude", user_lat - lat_delta) \
-                #         .lte("latitude", user_lat + lat_delta) \
-                #         .gte("longitude", user_lng - lng_delta) \
-                #         .lte("longitude", user_lng + lng_delta)
-
-                doctors_data = query \
-                    .order("experience", desc=True) \
-                    .limit(10) \
-                    .execute()
-
-                if doctors_data.data:
-                    for doc in doctors_data.data:
-                        doctors_list.append({
-                            "full_name": doc.get("full_name"),
-                            "clinic_name": doc.get("clinic_name"),
-                            "experience": doc.get("experience"),
-                            "phone": doc.get("phone"),
-                            "consultation_fee": doc.get("consultation_fee"),
-                            "latitude": doc.get("latitude"),
-                            "longitude": doc.get("longitude")
-                        })
-            except Exception as e:
-                print(f"Error fetching doctors: {e}")
-                doctors_list = []
-
-        # ...after building doctors_list and before returning...
+        doctors_list = fetch_doctors(recommended_specialty, info)
+
         # Include the recommended doctors (if any) and the specialty in the response
-        reply_json["recommended_doctors"] = doctors_list
-        reply_json["recommended_specialization"] = recommended_specialty
-
-        # Prepare raw API request data
-        # api_request_data = {
-        #     "height": height,
-        #     "weight": weight,
-        #     "age": age,
-        #     "gender": gender,
-        #     "symptoms": symptoms,
-        #     "location": location,
-        #     "latitude": user_lat,
-        #     "longitude": user_lng
-        # }
-
-        # Prepare raw API response data
-        # api_response_data = reply_json  # The parsed JSON response from the API
+        triage.attach_doctors(reply_json, recommended_specialty, doctors_list)
 
         # Insert symptom session record
-        try:
-            # Fetch patient_id by auth_id (request.user_id)
-            patient_resp = supabase.table("patients").select("id").eq("auth_id", request.user_id).maybe_single().execute()
-            patient_id = None
-            if patient_resp.data and "id" in patient_resp.data:
-                patient_id = patient_resp.data["id"]
-
-            if patient_id:
-                personal_info = {
-                    "age": age,
-                    "gender": gender,
-                    "height": height,
-                    "weight": weight
-                }
-                location_info = {
-                    "location": location,
-                    "latitude": user_lat,
-                    "longitude": user_lng
-                }
-                supabase.table("symptom_sessions").insert({
-                    "patient_id": patient_id,
-                    "started_at": datetime.utcnow().isoformat(),
-                    "ended_at": datetime.utcnow().isoformat(),
-                    "symptoms": symptoms.split(",") if isinstance(symptoms, str) else symptoms,
-                    "personal_info": personal_info,
-                    "location": location_info,
-                    "analysis_result": reply_json,
-                    "recommended_doctors": doctors_list,
-                    "created_at": datetime.utcnow().isoformat()
-                }).execute()
-        except Exception as e:
-            print(f"Failed to insert symptom session: {e}")
+        save_session(request, info, reply_json, doctors_list)
 
         return JsonResponse(reply_json, safe=False)
-    
-    
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
@@ -371,35 +188,22 @@ Symptoms: {symptoms}
 # -----------------------------
 # Recommend doctor endpoint
 # -----------------------------
+RECOMMEND_SCHEMA = Schema(disease=String(lower=True, default=""))
+
+
 @csrf_exempt
+@require_auth
+@rate_limit("recommend")
 def recommend_doctor(request):
     if request.method != "POST":
         return JsonResponse({"error": "Only POST requests allowed"}, status=405)
 
     try:
-        data = json.loads(request.body)
-        disease = data.get("disease", "").strip().lower()
-
-        # Disease to specialist mapping
-        DISEASE_SPECIALIST_MAP = {
-            "asthma": "Pulmonologist",
-            "heart disease": "Cardiologist",
-            "respiratory infection": "Pulmonologist",
-            "skin infection": "Dermatologist",
-            "allergy": "Dermatologist",
-            "dengue": "General Physician",
-            "viral infection": "General Physician",
-            "anemia": "General Physician",
-            "arthritis": "Orthopedic",
-            "sinusitis": "ENT Specialist",
-            "diabetes": "Endocrinologist",
-            "hypertension": "Cardiologist",
-            "migraine": "Neurologist",
-            "depression": "Psychiatrist",
-            "anxiety": "Psychiatrist"
-        }
-
-        specialist = DISEASE_SPECIALIST_MAP.get(disease, "General Physician")
+        params, errors = RECOMMEND_SCHEMA.validate(codec.loads(request.body))
+        if errors:
+            return JsonResponse(error_body(errors), status=400)
+
+        specialist = triage.DISEASE_SPECIALIST_MAP.get(params["disease"], "General Physician")
 
         return JsonResponse({
             "recommended_specialist": specialist
@@ -408,21 +212,254 @@ def recommend_doctor(request):
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
+# -----------------------------
+# Doctor search (answered from the in-memory directory)
+# -----------------------------
+DOCTOR_SEARCH_SCHEMA = Schema(
+    specialty=String(required=True, required_message="Please provide a specialty"),
+    limit=Integer(ge=1, le=100, clamp=True, default=triage.DOCTOR_LIMIT),
+    latitude=Number(ge=-90, le=90),
+    longitude=Number(ge=-180, le=180),
+    radius_km=Number(gt=0),
+    min_experience=Number(ge=0),
+)
+
+
+@csrf_exempt
+@require_auth
+@rate_limit("doctors")
+def search_doctors(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+
+    params, errors = DOCTOR_SEARCH_SCHEMA.validate(request.GET)
+    if errors:
+        return JsonResponse(error_body(errors), status=400)
+    if (params["latitude"] is None) != (params["longitude"] is None):
+        return JsonResponse({"error": "latitude and longitude must be given together"}, status=400)
+
+    specialty = params["specialty"]
+    try:
+        return JsonResponse({
+            "specialty": specialties.canonical_name(specialty) or specialty,
+            "doctors": directory.search(
+                specialty,
+                limit=params["limit"],
+                latitude=params["latitude"],
+                longitude=params["longitude"],
+                max_km=params["radius_km"],
+                min_experience=params["min_experience"],
+            ),
+        })
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+# -----------------------------
+# Doctor listing: keyset pages of the in-memory directory, projected to the
+# requested fields, with an ETag so an unchanged page costs a 304
+# -----------------------------
+LISTING_DEFAULT_FIELDS = ("id",) + triage.DOCTOR_FIELDS
+LISTING_ALLOWED_FIELDS = frozenset(LISTING_DEFAULT_FIELDS + LISTING_FIELDS + ("specialties", "distance_km"))
+
+DOCTOR_LIST_SCHEMA = Schema(
+    specialty=String(),
+    cursor=String(max_length=512),
+    fields=String(),
+    limit=Integer(ge=1, le=100, clamp=True, default=20),
+    min_fee=Number(ge=0),
+    max_fee=Number(ge=0),
+    latitude=Number(ge=-90, le=90),
+    longitude=Number(ge=-180, le=180),
+    radius_km=Number(gt=0),
+)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(codec.dumps(list(key))).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """The directory sort key a cursor points after; raises ``ValueError``."""
+    try:
+        negative_experience, doctor_id = codec.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError(cursor)
+    if not isinstance(negative_experience, (int, float)) or not isinstance(doctor_id, str):
+        raise ValueError(cursor)
+    return (float(negative_experience), doctor_id)
+
+
+def project(distance, entry, fields):
+    doctor = {}
+    for field in fields:
+        if field == "distance_km":
+            doctor[field] = round(distance, 2) if distance is not None else None
+        elif field == "specialties":
+            doctor[field] = [specialties.canonical_name(key) or key for key in entry.specialties]
+        else:
+            doctor[field] = getattr(entry, field)
+    return doctor
+
+
+@csrf_exempt
+@rate_limit("doctors")
+def list_doctors(request):
+    """Public doctor listing, most experienced first (see ``auth.PUBLIC_VIEWS``).
+
+    ``?specialty=&min_fee=&max_fee=&latitude=&longitude=&radius_km=`` filter,
+    ``fields=`` picks the columns and ``cursor`` (from the previous page's
+    ``next_cursor``) continues the list. Filtered pages can be short; the
+    list ends only when ``next_cursor`` is null.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+
+    params, errors = DOCTOR_LIST_SCHEMA.validate(request.GET)
+    if errors:
+        return JsonResponse(error_body(errors), status=400)
+    if (params["latitude"] is None) != (params["longitude"] is None):
+        return JsonResponse({"error": "latitude and longitude must be given together"}, status=400)
+
+    fields = LISTING_DEFAULT_FIELDS
+    if params["fields"]:
+        fields = tuple(dict.fromkeys(name.strip() for name in params["fields"].split(",") if name.strip()))
+        unknown = [name for name in fields if name not in LISTING_ALLOWED_FIELDS]
+        if unknown:
+            return JsonResponse({"error": f"Unknown fields: {', '.join(unknown)}"}, status=400)
+    after = None
+    if params["cursor"]:
+        try:
+            after = decode_cursor(params["cursor"])
+        except ValueError:
+            return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+    try:
+        with metrics.span("doctors"):
+            page, next_after = directory.browse(
+                params["specialty"],
+                after=after,
+                limit=params["limit"],
+                min_fee=params["min_fee"],
+                max_fee=params["max_fee"],
+                latitude=params["latitude"],
+                longitude=params["longitude"],
+                max_km=params["radius_km"],
+            )
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    return conditional_json(request, {
+        "doctors": [project(distance, entry, fields) for distance, entry in page],
+        "next_cursor": encode_cursor(next_after) if next_after is not None else None,
+    })
+
+
+@csrf_exempt
+@require_auth
+@rate_limit("refresh")
+def refresh_doctor_directory(request):
+    """Ask for a background refresh, e.g. right after a doctor registers"""
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST requests allowed"}, status=405)
+    started = directory.request_refresh()
+    return JsonResponse({"refresh_started": started, "directory": directory.stats()}, status=202)
+
+# -----------------------------
+# Session export (admins): NDJSON streamed in keyset chunks
+# -----------------------------
+@csrf_exempt
+@require_auth
+@require_admin
+@rate_limit("export")
+def export_sessions(request):
+    """``symptom_sessions`` as NDJSON; ``?since=&until=&specialty=&severity=&limit=&gzip=1``."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+
+    params, errors = export.EXPORT_SCHEMA.validate(request.GET)
+    if errors:
+        return JsonResponse(error_body(errors), status=400)
+    error = export.check_range(params)
+    if error:
+        return JsonResponse({"error": error}, status=400)
+
+    chunks = export.sessions(params)
+    try:
+        # Fetch the first chunk now so a failing query is still a proper error response
+        first = next(chunks, None)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    blocks = export.ndjson(itertools.chain([first] if first else [], chunks))
+    if params["gzip"]:
+        blocks = export.gzipped(blocks)
+    if isinstance(request, ASGIRequest):
+        blocks = streaming.off_loop(blocks)
+    response = StreamingHttpResponse(
+        blocks, content_type="application/gzip" if params["gzip"] else "application/x-ndjson",
+    )
+    response["Content-Disposition"] = f'attachment; filename="{export.filename(params)}"'
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+# -----------------------------
+# Triage counters: result cache, request coalescing and admission control
+# -----------------------------
+@csrf_exempt
+@require_auth
+def triage_stats(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+    return JsonResponse({
+        "cache": triage_cache.stats(),
+        "coalescing": flights.stats(),
+        "admission": admission.stats(),
+    })
+
+# -----------------------------
+# Readiness: 503 until this worker has finished warming up
+# -----------------------------
+@csrf_exempt
+def readiness(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+    stats = warmup.stats()
+    warning = admission.forwarding_warning(request)
+    if warning:
+        # Reported, not failed: the worker can still serve
+        stats["warnings"] = [warning]
+    return JsonResponse(stats, status=200 if stats["ready"] else 503)
+
+# -----------------------------
+# Prometheus metrics: stage histograms plus component stats
+# -----------------------------
+@csrf_exempt
+def prometheus_metrics(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+    text = metrics.render(
+        components={
+            "triage_cache": triage_cache.stats(),
+            "session_writer": session_writer.stats(),
+            "doctor_directory": directory.stats(),
+            "warmup": warmup.stats(),
+            "auth": authenticator.stats(),
+            "llm_gate": llm_gate.stats(),
+        },
+        # Scrapes must not trigger model discovery
+        models=gemini.registry.snapshot(refresh=False),
+        coalescing=flights.stats(),
+    )
+    return HttpResponse(text, content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # -----------------------------
 # Helper endpoint: list available Gemini models
 # -----------------------------
 @csrf_exempt
+@require_auth
 def list_available_models(request):
-    """Helper endpoint to list available Gemini models"""
+    """Helper endpoint to list available Gemini models and their health"""
     try:
-        models = []
-        for model in genai.list_models():
-            if 'generateContent' in model.supported_generation_methods:
-                models.append({
-                    'name': model.name,
-                    'display_name': model.display_name,
-                    'description': model.description
-                })
-        return JsonResponse({"available_models": models})
+        return JsonResponse({"available_models": gemini.registry.snapshot()})
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
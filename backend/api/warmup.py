@@ -0,0 +1,119 @@
+"""
+Worker warm-up.
+
+The Gemini SDK, model discovery, the auth JWKS, the doctor directory and the
+symptom normalizer are all built lazily on first use, so importing the views is
+cheap. Without warm-up the first patient on a fresh worker pays for all of
+them; ``start()`` (called from ``userapp.wsgi`` / ``userapp.asgi`` when
+``settings.WARMUP["ENABLED"]``) builds them on a background thread as soon
+as the worker has loaded the application. Each step takes the same lock a
+request would, so a request that arrives mid warm-up waits for the step in
+progress instead of repeating it.
+
+``/api/ready`` answers 503 until warm-up has finished and reports how long
+each step took, and how long after boot the first triage reply was served.
+
+Under ``gunicorn --preload`` the WSGI module is imported by the master,
+whose threads do not survive the fork; call ``start()`` from a
+``post_fork`` hook instead.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import db, gemini, metrics, symptoms
+from .auth import authenticator
+from .directory import directory
+
+DEFAULTS = {
+    "ENABLED": True,
+    "STEPS": ["gemini", "models", "supabase", "auth", "symptoms", "directory"],
+}
+config = {**DEFAULTS, **getattr(settings, "WARMUP", {})}
+
+STEPS = {
+    "gemini": gemini.client,
+    "models": lambda: gemini.registry.refresh(force=True),
+    "supabase": db.get_supabase,
+    "auth": authenticator.keys.refresh,
+    "symptoms": symptoms.get_normalizer,
+    "directory": directory.ensure_loaded,
+}
+
+BOOTED_AT = time.monotonic()
+
+
+class WarmUp:
+    def __init__(self, steps):
+        self.steps = steps
+        self._lock = threading.Lock()
+        self._pid = None
+        self.started_at = None
+        self.finished_at = None
+        self.results = {}  # step -> {"seconds", "error"}
+        self.first_triage_at = None
+
+    def start(self, background=True):
+        """Run the steps once per process; ``False`` if already started here."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+            self.started_at = time.monotonic()
+            self.finished_at = None
+            self.results = {}
+        if background:
+            threading.Thread(target=self.run, name="warmup", daemon=True).start()
+        else:
+            self.run()
+        return True
+
+    def run(self):
+        for name in config["STEPS"]:
+            started = time.monotonic()
+            error = None
+            try:
+                self.steps[name]()
+            except Exception as e:
+                # The step is retried lazily by the first request that needs it
+                error = str(e)
+                metrics.swallowed("warmup", f"Warm-up step {name} failed: {e}")
+            self.results[name] = {"seconds": round(time.monotonic() - started, 3), "error": error}
+        self.finished_at = time.monotonic()
+
+    def record_triage(self):
+        if self.first_triage_at is None:
+            self.first_triage_at = time.monotonic()
+
+    @property
+    def ready(self):
+        if not config["ENABLED"]:
+            return True
+        return self._pid == os.getpid() and self.finished_at is not None
+
+    def stats(self):
+        started_here = self._pid == os.getpid()
+        return {
+            "enabled": config["ENABLED"],
+            "ready": self.ready,
+            "started": started_here,
+            "seconds": (
+                round(self.finished_at - self.started_at, 3)
+                if started_here and self.finished_at is not None else None
+            ),
+            "first_triage_seconds": (
+                round(self.first_triage_at - BOOTED_AT, 3) if self.first_triage_at is not None else None
+            ),
+            "steps": dict(self.results) if started_here else {},
+        }
+
+
+warmup = WarmUp(STEPS)
+
+
+def start():
+    """Warm this worker up in the background, if enabled."""
+    if config["ENABLED"]:
+        warmup.start()
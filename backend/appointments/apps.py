@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class AppointmentsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'appointments'
+
+    def ready(self):
+        # Let worker warm-up load the bookings window before the first query
+        from api import warmup
+        from . import checks  # noqa: F401 (registers the slot index check)
+        from .availability import availability
+
+        warmup.STEPS["appointments"] = availability.ensure_loaded
@@ -0,0 +1,373 @@
+"""
+Appointment availability and booking.
+
+Every doctor works the same hours: ``WORKING_HOURS`` on ``WORKING_DAYS`` in
+the clinics' ``TIME_ZONE``, in ``SLOT_MINUTES`` slots. These are the slots
+the booking page offers. Bookings are what varies. Each worker keeps the
+pending and confirmed appointments from now to ``HORIZON_DAYS`` ahead as one
+sorted array of start times per doctor. A slot is taken if a booking starts
+less than one slot length before the slot ends, which is a single bisect.
+Past appointments are never loaded: the select is a range on
+``appointment_date``, so the cost of a query does not grow with the history
+in the table.
+
+The window is reloaded in the background every ``REFRESH_INTERVAL`` seconds,
+which picks up cancellations and bookings made elsewhere. Bookings made
+through ``book()`` are applied to the index immediately.
+
+``book()`` checks and claims the slot under a per-doctor lock, then inserts
+with the lock released, so a slow insert never holds up other doctors that
+share the lock's stripe. A slot that the index already shows as taken (or
+claimed by a booking in flight here) is refused without a round trip. Across
+workers, the partial unique index on ``appointments (doctor_id,
+appointment_date)`` (see the README) makes the insert itself the arbiter,
+and a duplicate comes back as ``SlotTaken``. A claim whose insert fails for
+any other reason is released.
+"""
+import bisect
+import datetime
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from postgrest.exceptions import APIError
+
+from api import db, metrics
+from api.directory import directory, entry_as_dict
+
+DEFAULTS = {
+    "TIME_ZONE": "Asia/Kolkata",
+    "SLOT_MINUTES": 30,
+    "WORKING_HOURS": [("09:00", "12:00"), ("14:00", "18:00")],
+    "WORKING_DAYS": [0, 1, 2, 3, 4, 5, 6],  # Monday is 0
+    # Earliest bookable slot, counted from now
+    "MIN_NOTICE_MINUTES": 60,
+    "HORIZON_DAYS": 60,
+    # Longest range one availability query may cover
+    "MAX_DAYS": 14,
+    "ACTIVE_STATUSES": ["pending", "confirmed"],
+    "REFRESH_INTERVAL": 60,
+    "PAGE_SIZE": 1000,
+    # Doctors looked at per doctor wanted in a specialty search
+    "CANDIDATE_FACTOR": 5,
+}
+
+UNIQUE_VIOLATION = "23505"
+FOREIGN_KEY_VIOLATION = "23503"
+
+LOCK_STRIPES = 64
+
+
+class BookingError(Exception):
+    status = 400
+
+
+class SlotTaken(BookingError):
+    status = 409
+
+    def __init__(self):
+        super().__init__("This slot has just been booked, please pick another one")
+
+
+def _minutes(hh_mm):
+    hours, minutes = str(hh_mm).split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _epoch(value):
+    """Supabase timestamp (ISO 8601 string) as whole epoch seconds."""
+    return int(datetime.datetime.fromisoformat(value).timestamp())
+
+
+def _iso_utc(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat()
+
+
+class Availability:
+    def __init__(self, client_factory, config=None):
+        self._client_factory = client_factory
+        self.config = {**DEFAULTS, **(config or {})}
+        self.zone = ZoneInfo(self.config["TIME_ZONE"])
+        self.slot_seconds = int(self.config["SLOT_MINUTES"]) * 60
+        self.working_days = frozenset(self.config["WORKING_DAYS"])
+        self.slot_times = self._slot_times()
+        self._day_slots_cache = {}  # date -> (epoch, ...)
+        self._booked = {}  # str(doctor id) -> sorted [start epoch]
+        self._loaded_at = None
+        self._during_load = None  # reservations made while a reload is running
+        self._load_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._background_lock = threading.Lock()
+        self._doctor_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.counters = {"booked": 0, "conflicts": 0}
+
+    # -----------------------------
+    # Working hours
+    # -----------------------------
+    def _slot_times(self):
+        slot_minutes = int(self.config["SLOT_MINUTES"])
+        times = []
+        for start, end in self.config["WORKING_HOURS"]:
+            minute, end = _minutes(start), _minutes(end)
+            while minute + slot_minutes <= end:
+                times.append(datetime.time(minute // 60, minute % 60))
+                minute += slot_minutes
+        return tuple(times)
+
+    def day_slots(self, date):
+        """Start times (epoch seconds) of every working slot on ``date``."""
+        slots = self._day_slots_cache.get(date)
+        if slots is None:
+            if date.weekday() in self.working_days:
+                slots = tuple(
+                    int(datetime.datetime.combine(date, at, self.zone).timestamp())
+                    for at in self.slot_times
+                )
+            else:
+                slots = ()
+            if len(self._day_slots_cache) > 4 * int(self.config["HORIZON_DAYS"]):
+                self._day_slots_cache = {}
+            self._day_slots_cache[date] = slots
+        return slots
+
+    def today(self):
+        return datetime.datetime.now(self.zone).date()
+
+    def _bookable_range(self):
+        now = time.time()
+        return (
+            now + int(self.config["MIN_NOTICE_MINUTES"]) * 60,
+            now + int(self.config["HORIZON_DAYS"]) * 86400,
+        )
+
+    def format(self, epoch):
+        return datetime.datetime.fromtimestamp(epoch, self.zone).isoformat()
+
+    # -----------------------------
+    # Loading
+    # -----------------------------
+    def _fetch(self, since, until):
+        """Active appointments starting in ``[since, until)``, page by page."""
+        client = self._client_factory()
+        page_size = int(self.config["PAGE_SIZE"])
+        rows, start = [], 0
+        while True:
+            query = (
+                client.table("appointments")
+                .select("id, doctor_id, appointment_date")
+                .gte("appointment_date", _iso_utc(since))
+                .lt("appointment_date", _iso_utc(until))
+                .in_("status", self.config["ACTIVE_STATUSES"])
+            )
+            page = db.execute(
+                query.order("appointment_date").order("id").range(start, start + page_size - 1)
+            ).data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+            start += page_size
+
+    def load(self):
+        """Reload the bookings window."""
+        now = time.time()
+        with self._write_lock:
+            self._during_load = []
+        try:
+            rows = self._fetch(
+                now - self.slot_seconds, now + (int(self.config["HORIZON_DAYS"]) + 1) * 86400,
+            )
+        except Exception:
+            with self._write_lock:
+                self._during_load = None
+            raise
+        booked = {}
+        for row in rows:
+            booked.setdefault(str(row["doctor_id"]), []).append(_epoch(row["appointment_date"]))
+        for starts in booked.values():
+            starts.sort()
+        with self._write_lock:
+            # Bookings made here while the select was running may be missing from it
+            for doctor_id, start in self._during_load:
+                starts = booked.setdefault(doctor_id, [])
+                if start not in starts:
+                    bisect.insort(starts, start)
+            self._during_load = None
+            self._booked = booked
+        self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self.load()
+
+    def _refresh_in_background(self):
+        try:
+            with self._load_lock:
+                self.load()
+        except Exception as e:
+            metrics.swallowed("appointments_refresh", f"Appointment index refresh failed: {e}")
+        finally:
+            self._background_lock.release()
+
+    def request_refresh(self):
+        if not self._background_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return True
+
+    def _maybe_refresh(self):
+        if self._loaded_at is None:
+            self.ensure_loaded()
+        elif time.monotonic() - self._loaded_at >= self.config["REFRESH_INTERVAL"]:
+            self.request_refresh()
+
+    def _reserve(self, doctor_id, start):
+        # Copy-on-write, so readers walking the old list are unaffected
+        with self._write_lock:
+            starts = list(self._booked.get(doctor_id, ()))
+            if start not in starts:
+                bisect.insort(starts, start)
+            self._booked[doctor_id] = starts
+            if self._during_load is not None:
+                self._during_load.append((doctor_id, start))
+
+    def _release(self, doctor_id, start):
+        # Undoes a claim whose insert failed
+        with self._write_lock:
+            starts = [booked for booked in self._booked.get(doctor_id, ()) if booked != start]
+            self._booked[doctor_id] = starts
+            if self._during_load is not None:
+                self._during_load = [claim for claim in self._during_load if claim != (doctor_id, start)]
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+    def is_booked(self, doctor_id, start):
+        starts = self._booked.get(str(doctor_id), ())
+        i = bisect.bisect_right(starts, start - self.slot_seconds)
+        return i < len(starts) and starts[i] < start + self.slot_seconds
+
+    def free_slots(self, doctor_id, first_day, days, limit=None):
+        """Free slot starts (epoch seconds) for one doctor, earliest first."""
+        self._maybe_refresh()
+        starts = self._booked.get(str(doctor_id), ())
+        earliest, latest = self._bookable_range()
+        slot = self.slot_seconds
+        found = []
+        i = 0
+        for offset in range(days):
+            for start in self.day_slots(first_day + datetime.timedelta(days=offset)):
+                if start < earliest:
+                    continue
+                if start >= latest:
+                    return found
+                # Slots only move forward, so the search can too
+                i = bisect.bisect_right(starts, start - slot, i)
+                if i < len(starts) and starts[i] < start + slot:
+                    continue
+                found.append(start)
+                if limit is not None and len(found) >= limit:
+                    return found
+        return found
+
+    def search(self, specialty, first_day, days, latitude=None, longitude=None, max_km=None,
+               limit=10, slots=5):
+        """Doctors for ``specialty`` with their first free slots.
+
+        Nearest doctors first when the patient shared a location, otherwise
+        the most experienced; doctors with no free slot in the range are
+        skipped.
+        """
+        pool = limit * int(self.config["CANDIDATE_FACTOR"])
+        if latitude is None or longitude is None:
+            candidates = [(None, entry) for entry in directory.lookup(specialty, pool)]
+        else:
+            candidates = directory.nearest(specialty, latitude, longitude, pool, max_km=max_km)
+        results = []
+        for distance, entry in candidates:
+            free = self.free_slots(entry.id, first_day, days, slots)
+            if not free:
+                continue
+            doctor = {"id": entry.id, **entry_as_dict(entry)}
+            if distance is not None:
+                doctor["distance_km"] = round(distance, 2)
+            results.append({"doctor": doctor, "slots": [self.format(start) for start in free]})
+            if len(results) == limit:
+                break
+        return results
+
+    # -----------------------------
+    # Booking
+    # -----------------------------
+    def check_slot(self, start):
+        local_date = datetime.datetime.fromtimestamp(start, self.zone).date()
+        if start not in self.day_slots(local_date):
+            raise BookingError("That time is not one of the doctor's appointment slots")
+        earliest, latest = self._bookable_range()
+        if start < time.time():
+            raise BookingError("That slot is in the past")
+        if start < earliest:
+            raise BookingError("That slot is too soon to book")
+        if start >= latest:
+            raise BookingError("That slot is too far ahead to book")
+
+    def book(self, doctor_id, patient_id, starts_at, reason=None):
+        """Reserve the slot starting at ``starts_at``; returns the appointment row.
+
+        Raises ``SlotTaken`` if it is already booked and ``BookingError`` if
+        it is not a bookable slot.
+        """
+        start = int(starts_at.timestamp())
+        self.check_slot(start)
+        self._maybe_refresh()
+        doctor_key = str(doctor_id)
+        # The lock only covers the check and the claim, never the round trip
+        with self._doctor_locks[hash(doctor_key) % LOCK_STRIPES]:
+            if self.is_booked(doctor_key, start):
+                self._count("conflicts")
+                raise SlotTaken()
+            self._reserve(doctor_key, start)
+        row = {
+            "doctor_id": doctor_id,
+            "patient_id": patient_id,
+            "appointment_date": _iso_utc(start),
+            "status": "pending",
+            "reason": reason,
+        }
+        query = self._client_factory().table("appointments").insert(row)
+        try:
+            result = db.execute(query, retries=0)
+        except APIError as e:
+            if e.code == UNIQUE_VIOLATION:
+                # Another worker won the race; the slot stays claimed here
+                self._count("conflicts")
+                raise SlotTaken()
+            self._release(doctor_key, start)
+            if e.code == FOREIGN_KEY_VIOLATION:
+                raise BookingError("Unknown doctor")
+            raise
+        except BaseException:
+            self._release(doctor_key, start)
+            raise
+        self._count("booked")
+        return (result.data or [row])[0]
+
+    def _count(self, name):
+        with self._write_lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        booked = self._booked
+        return {
+            "loaded": self._loaded_at is not None,
+            "doctors": len(booked),
+            "bookings": sum(len(starts) for starts in booked.values()),
+            "horizon_days": int(self.config["HORIZON_DAYS"]),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            **self.counters,
+        }
+
+
+availability = Availability(db.get_supabase, getattr(settings, "APPOINTMENTS", None))
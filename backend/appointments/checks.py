@@ -0,0 +1,49 @@
+"""
+Deploy check for the slot index.
+
+Two workers can only be kept from booking the same slot by the partial
+unique index on ``appointments (doctor_id, appointment_date)`` (see the
+README), and nothing fails visibly without it. This database check looks it
+up in ``pg_indexes``. It runs with ``manage.py migrate`` and with
+``manage.py check --database default``.
+"""
+from django.core.checks import Error, Tags, register
+from django.db import connections
+
+SLOT_INDEX = "appointments_slot_key"
+SLOT_COLUMNS = "(doctor_id, appointment_date)"
+
+HINT = "Create it in the Supabase SQL editor (see Appointments in the README)."
+
+
+def slot_index_problem(connection):
+    """Why the slot index is not in place, or ``None`` if it is.
+
+    Databases other than Postgres (the test database) are not checked.
+    """
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "select indexdef from pg_indexes where tablename = 'appointments' and indexname = %s",
+            [SLOT_INDEX],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return f"The {SLOT_INDEX} index is missing, so two bookings can take the same slot."
+    definition = " ".join(row[0].lower().split())
+    if not definition.startswith("create unique index") or SLOT_COLUMNS not in definition:
+        return f"{SLOT_INDEX} is not a unique index on appointments {SLOT_COLUMNS}: {row[0]}"
+    if " where " not in definition:
+        return f"{SLOT_INDEX} is not partial, so a cancelled booking blocks its slot: {row[0]}"
+    return None
+
+
+@register(Tags.database)
+def check_slot_index(app_configs=None, databases=None, **kwargs):
+    errors = []
+    for alias in databases or ():
+        problem = slot_index_problem(connections[alias])
+        if problem:
+            errors.append(Error(problem, hint=HINT, id="appointments.E001"))
+    return errors
@@ -0,0 +1,159 @@
+import datetime
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+from postgrest.exceptions import APIError
+
+from api.tests import FakeSupabase
+
+from . import checks
+from .availability import UNIQUE_VIOLATION, Availability, SlotTaken
+
+
+class SlotTable(FakeSupabase):
+    """``appointments`` with the ``appointments_slot_key`` partial unique index."""
+
+    def __init__(self, **rows):
+        self.lock = threading.Lock()
+        super().__init__(**rows)
+
+    def add(self, table, row):
+        if table != "appointments":
+            return super().add(table, row)
+        time.sleep(0.01)  # let concurrent inserts overlap
+        with self.lock:
+            for existing in self.rows.get("appointments", []):
+                if (existing["doctor_id"], existing["appointment_date"]) == (row["doctor_id"], row["appointment_date"]) \
+                        and existing["status"] in ("pending", "confirmed"):
+                    raise APIError({"code": UNIQUE_VIOLATION, "message": "duplicate key value"})
+            return super().add(table, row)
+
+
+class ConcurrentBookingTests(SimpleTestCase):
+    def setUp(self):
+        self.table = SlotTable(appointments=[])
+        self.workers = [Availability(lambda: self.table) for _ in range(4)]
+        tomorrow = self.workers[0].today() + datetime.timedelta(days=2)
+        self.slot = datetime.datetime.fromtimestamp(self.workers[0].day_slots(tomorrow)[0], datetime.timezone.utc)
+
+    def race(self, workers, patients=8):
+        barrier = threading.Barrier(patients)
+        outcomes = []
+
+        def book(worker, patient_id):
+            barrier.wait()
+            try:
+                outcomes.append(worker.book(7, patient_id, self.slot))
+            except SlotTaken as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=book, args=(workers[i % len(workers)], i)) for i in range(patients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        return outcomes
+
+    def assert_one_booking(self, outcomes):
+        booked = [outcome for outcome in outcomes if isinstance(outcome, dict)]
+        self.assertEqual(len(booked), 1)
+        self.assertEqual(len(outcomes), 8)
+        self.assertEqual(len(self.table.rows["appointments"]), 1)
+        self.assertEqual(self.table.rows["appointments"][0]["patient_id"], booked[0]["patient_id"])
+
+    def test_one_worker(self):
+        self.assert_one_booking(self.race(self.workers[:1]))
+        self.assertEqual(self.workers[0].counters, {"booked": 1, "conflicts": 7})
+
+    def test_several_workers_are_settled_by_the_index(self):
+        self.assert_one_booking(self.race(self.workers))
+        # Every worker now shows the slot as taken
+        for worker in self.workers:
+            self.assertTrue(worker.is_booked(7, int(self.slot.timestamp())))
+
+    def test_a_cancelled_booking_frees_the_slot(self):
+        self.table.add("appointments", {"doctor_id": 7, "patient_id": 1, "status": "cancelled",
+                                        "appointment_date": self.slot.isoformat()})
+        self.assertEqual(self.workers[0].book(7, 2, self.slot)["patient_id"], 2)
+
+    def test_the_insert_runs_outside_the_doctor_lock(self):
+        worker = self.workers[0]
+        lock = worker._doctor_locks[hash("7") % len(worker._doctor_locks)]
+        held = []
+        add = self.table.add
+
+        def spy(table, row):
+            held.append(lock.locked())
+            return add(table, row)
+
+        with mock.patch.object(self.table, "add", spy):
+            worker.book(7, 1, self.slot)
+        self.assertEqual(held, [False])
+
+    def test_a_failed_insert_releases_the_claim(self):
+        worker = self.workers[0]
+        with mock.patch.object(self.table, "add", side_effect=APIError({"code": "57014", "message": "timeout"})):
+            with self.assertRaises(APIError):
+                worker.book(7, 1, self.slot)
+        self.assertFalse(worker.is_booked(7, int(self.slot.timestamp())))
+        self.assertEqual(worker.book(7, 2, self.slot)["patient_id"], 2)
+
+
+class FakeConnection:
+    def __init__(self, definition, vendor="postgresql"):
+        self.vendor = vendor
+        self.definition = definition
+        self.queries = []
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params):
+                connection.queries.append(params)
+
+            def fetchone(self):
+                return None if connection.definition is None else (connection.definition,)
+
+        return Cursor()
+
+
+class SlotIndexCheckTests(SimpleTestCase):
+    INDEX = (
+        "CREATE UNIQUE INDEX appointments_slot_key ON public.appointments USING btree "
+        "(doctor_id, appointment_date) WHERE ((status)::text = ANY "
+        "((ARRAY['pending'::character varying, 'confirmed'::character varying])::text[]))"
+    )
+
+    def test_index_in_place(self):
+        connection = FakeConnection(self.INDEX)
+        self.assertIsNone(checks.slot_index_problem(connection))
+        self.assertEqual(connection.queries, [[checks.SLOT_INDEX]])
+
+    def test_missing_or_wrong_index(self):
+        for definition in (
+            None,
+            self.INDEX.replace("UNIQUE ", ""),
+            self.INDEX.replace("(doctor_id, appointment_date)", "(appointment_date)"),
+            self.INDEX[:self.INDEX.index(" WHERE")],
+        ):
+            with self.subTest(definition=definition):
+                self.assertIsNotNone(checks.slot_index_problem(FakeConnection(definition)))
+
+    def test_only_postgres_is_checked(self):
+        self.assertIsNone(checks.slot_index_problem(FakeConnection(None, vendor="sqlite")))
+
+    def test_registered_as_a_database_check(self):
+        connections = {"default": FakeConnection(None)}
+        with mock.patch.object(checks, "connections", connections):
+            errors = checks.check_slot_index(databases=["default"])
+        self.assertEqual([error.id for error in errors], ["appointments.E001"])
+        self.assertEqual(checks.check_slot_index(databases=None), [])
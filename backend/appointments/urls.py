@@ -0,0 +1,14 @@
+from django.urls import path
+from .views import (
+    appointment_stats,
+    book_appointment,
+    doctor_slots,
+    search_availability,
+)
+
+urlpatterns = [
+    path("availability/", search_availability, name="search_availability"),
+    path("doctors/<str:doctor_id>/slots/", doctor_slots, name="doctor_slots"),
+    path("book/", book_appointment, name="book_appointment"),
+    path("stats/", appointment_stats, name="appointment_stats"),
+]
@@ -0,0 +1,150 @@
+from django.views.decorators.csrf import csrf_exempt
+
+from api import codec, db, metrics
+from api.admission import rate_limit
+from api.auth import require_auth
+from api.codec import JsonResponse
+from api.schema import Any, Date, DateTime, Integer, Number, Schema, String, error_body
+
+from .availability import BookingError, availability
+
+MAX_DAYS = int(availability.config["MAX_DAYS"])
+
+
+def date_range(params):
+    """First day and number of days asked for; never before today."""
+    today = availability.today()
+    first_day = max(params["date"] or today, today)
+    return first_day, params["days"]
+
+
+# -----------------------------
+# Free slots of one doctor
+# -----------------------------
+SLOTS_SCHEMA = Schema(
+    date=Date(),
+    days=Integer(ge=1, le=MAX_DAYS, clamp=True, default=7),
+)
+
+
+@csrf_exempt
+@require_auth
+@rate_limit("availability")
+def doctor_slots(request, doctor_id):
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+
+    params, errors = SLOTS_SCHEMA.validate(request.GET)
+    if errors:
+        return JsonResponse(error_body(errors), status=400)
+
+    first_day, days = date_range(params)
+    try:
+        with metrics.span("slots"):
+            free = availability.free_slots(doctor_id, first_day, days)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    return JsonResponse({
+        "doctor_id": doctor_id,
+        "from": first_day.isoformat(),
+        "days": days,
+        "slot_minutes": availability.slot_seconds // 60,
+        "slots": [availability.format(start) for start in free],
+    })
+
+# -----------------------------
+# Free slots across a specialty ("cardiologists near me this week")
+# -----------------------------
+AVAILABILITY_SCHEMA = Schema(
+    specialty=String(required=True, required_message="Please provide a specialty"),
+    date=Date(),
+    days=Integer(ge=1, le=MAX_DAYS, clamp=True, default=7),
+    latitude=Number(ge=-90, le=90),
+    longitude=Number(ge=-180, le=180),
+    radius_km=Number(gt=0),
+    limit=Integer(ge=1, le=50, clamp=True, default=10),
+    slots=Integer(ge=1, le=50, clamp=True, default=5),
+)
+
+
+@csrf_exempt
+@require_auth
+@rate_limit("availability")
+def search_availability(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+
+    params, errors = AVAILABILITY_SCHEMA.validate(request.GET)
+    if errors:
+        return JsonResponse(error_body(errors), status=400)
+    if (params["latitude"] is None) != (params["longitude"] is None):
+        return JsonResponse({"error": "latitude and longitude must be given together"}, status=400)
+
+    first_day, days = date_range(params)
+    try:
+        with metrics.span("slots"):
+            doctors = availability.search(
+                params["specialty"],
+                first_day,
+                days,
+                latitude=params["latitude"],
+                longitude=params["longitude"],
+                max_km=params["radius_km"],
+                limit=params["limit"],
+                slots=params["slots"],
+            )
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    return JsonResponse({
+        "specialty": params["specialty"],
+        "from": first_day.isoformat(),
+        "days": days,
+        "slot_minutes": availability.slot_seconds // 60,
+        "doctors": doctors,
+    })
+
+# -----------------------------
+# Booking: atomic check-and-reserve of one slot
+# -----------------------------
+BOOKING_SCHEMA = Schema(
+    doctor_id=Any(types=(str, int), required=True, required_message="Please choose a doctor"),
+    start=DateTime(required=True, required_message="Please choose a time slot"),
+    reason=String(max_length=1000),
+)
+
+
+@csrf_exempt
+@require_auth
+@rate_limit("book")
+def book_appointment(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST requests allowed"}, status=405)
+
+    try:
+        params, errors = BOOKING_SCHEMA.validate(codec.loads(request.body))
+    except codec.DecodeError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if errors:
+        return JsonResponse(error_body(errors), status=400)
+
+    try:
+        patient_id = db.patient_id_for(getattr(request, "user_id", None))
+        if patient_id is None:
+            return JsonResponse({"error": "Please complete your patient profile before booking"}, status=403)
+        with metrics.span("book"):
+            appointment = availability.book(
+                params["doctor_id"], patient_id, params["start"], params["reason"],
+            )
+    except BookingError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    return JsonResponse(appointment, status=201)
+
+
+@csrf_exempt
+@require_auth
+def appointment_stats(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET requests allowed"}, status=405)
+    return JsonResponse(availability.stats())
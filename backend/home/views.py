@@ -1,15 +1,42 @@
-from django.http import JsonResponse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
-import json
+
+from api import codec
+from api.codec import JsonResponse
+from api.schema import Schema, String
+
+REGISTER_SCHEMA = Schema(
+    username=String(required=True, max_length=150),
+    email=String(),
+    password=String(required=True, strip=False),
+    confirm_password=String(required=True, strip=False),
+)
+LOGIN_SCHEMA = Schema(
+    username=String(required=True),
+    password=String(required=True, strip=False),
+)
+
+
+def parse(request, schema):
+    """``(values, None)`` or ``(None, error response)`` for a JSON body."""
+    try:
+        data = codec.loads(request.body)
+    except codec.DecodeError:
+        return None, JsonResponse({"success": False, "error": "Invalid JSON"})
+    values, errors = schema.validate(data)
+    if errors:
+        return None, JsonResponse({"success": False, "error": " ".join(errors.values()), "errors": errors})
+    return values, None
 
 def register(request):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        username = data.get('username')
-        email = data.get('email')
-        password = data.get('password')
-        confirm = data.get('confirm_password')
+        data, error_response = parse(request, REGISTER_SCHEMA)
+        if error_response:
+            return error_response
+        username = data['username']
+        email = data['email']
+        password = data['password']
+        confirm = data['confirm_password']
 
         if password != confirm:
             return JsonResponse({"success": False, "error": "Passwords do not match"})
@@ -25,9 +52,11 @@ def register(request):
 
 def login(request):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        username = data.get('username')
-        password = data.get('password')
+        data, error_response = parse(request, LOGIN_SCHEMA)
+        if error_response:
+            return error_response
+        username = data['username']
+        password = data['password']
 
         user = authenticate(request, username=username, password=password)
         if user is not None:
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'userapp.settings')
 
 application = get_asgi_application()
+
+# Build the Gemini client, model list, symptom index and doctor directory
+# in the background before the first request (see api/warmup.py)
+from api import warmup  # noqa: E402
+
+warmup.start()
@@ -5,6 +5,7 @@ Generated by 'django-admin startproject' using Django 5.2.4.
 """
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url  # ✅ Added
@@ -39,11 +40,18 @@ INSTALLED_APPS = [
     'rest_framework',
     'corsheaders',
     'api',
+    'appointments',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
 
+    # Per-stage timings: Server-Timing header and /api/metrics histograms
+    'api.metrics.ServerTimingMiddleware',
+
+    # Brotli/gzip for large /api/ responses (api/responses.py)
+    'api.responses.CompressionMiddleware',
+
     # ✅ Added whitenoise for static files on Render
     'whitenoise.middleware.WhiteNoiseMiddleware',
 
@@ -106,6 +114,13 @@ DATABASES = {
     )
 }
 
+# manage.py test without a Postgres URL runs on a throwaway SQLite database
+if not DATABASES['default'] and 'test' in sys.argv[1:2]:
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+
 
 # ---------------------------------------------------------
 # PASSWORDS (unchanged)
@@ -142,7 +157,161 @@ STATIC_URL = '/assets/'
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
 # ✅ Whitenoise for production static handling
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+# (STATICFILES_STORAGE is ignored since Django 5.1, so it is set through
+# STORAGES; collectstatic writes .gz and, with brotli installed, .br files)
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
+
+# Vite fingerprints everything it emits into dist/assets (index-3Fq9xZ1a.js),
+# and collectstatic adds its own hash (.0123456789ab.js), so a name never
+# changes content: cache them for a year as immutable
+WHITENOISE_IMMUTABLE_FILE_TEST = r"(-[A-Za-z0-9_-]{8}|\.[0-9a-f]{12})\.[A-Za-z0-9]+$"
+
+# The React shell (index.html) is kept in memory, precompressed (userapp/views.py)
+SPA = {
+    "INDEX": os.path.join(BASE_DIR, '..', 'react-frontend', 'dist', 'index.html'),
+    "CACHE_CONTROL": "no-cache",
+    # Re-read index.html when it changes (after a local vite build)
+    "RELOAD": DEBUG,
+}
+
+
+# ---------------------------------------------------------
+# TRIAGE RESULT CACHE
+# "local" keeps an in-process LRU per worker, "django" uses the
+# Django cache named by ALIAS so workers share entries.
+# ---------------------------------------------------------
+TRIAGE_CACHE = {
+    "BACKEND": os.getenv("TRIAGE_CACHE_BACKEND", "local"),
+    "TTL": int(os.getenv("TRIAGE_CACHE_TTL", 6 * 3600)),
+    "MAX_ENTRIES": int(os.getenv("TRIAGE_CACHE_MAX_ENTRIES", 5000)),
+    "ALIAS": os.getenv("TRIAGE_CACHE_ALIAS", "default"),
+}
+
+
+# ---------------------------------------------------------
+# SYMPTOM NORMALIZATION
+# Known typos come from the frontend's dictionary; the normalized list feeds
+# the cache key and is added to the prompt next to the patient's own words.
+# ---------------------------------------------------------
+SYMPTOM_NORMALIZER = {
+    "ENABLED": os.getenv("SYMPTOM_NORMALIZER_ENABLED", "true").lower() == "true",
+    "DICTIONARY": os.getenv(
+        "SYMPTOM_DICTIONARY",
+        os.path.join(BASE_DIR.parent, "react-frontend", "src", "data", "medical_dictionary.json"),
+    ),
+    "MIN_FUZZY_LENGTH": 7,
+}
+
+
+# ---------------------------------------------------------
+# RULE-BASED TRIAGE FAST PATH
+# Common complaints scoring at least CONFIDENCE_THRESHOLD are
+# answered locally instead of by Gemini.
+# ---------------------------------------------------------
+TRIAGE_RULES = {
+    "ENABLED": os.getenv("TRIAGE_RULES_ENABLED", "true").lower() == "true",
+    "CONFIDENCE_THRESHOLD": float(os.getenv("TRIAGE_RULES_THRESHOLD", 0.85)),
+}
+
+
+# ---------------------------------------------------------
+# BATCH TRIAGE (/api/analyze-symptoms/batch/)
+# ---------------------------------------------------------
+BATCH_TRIAGE = {
+    "MAX_ITEMS": int(os.getenv("BATCH_TRIAGE_MAX_ITEMS", 500)),
+    # Gemini generations in flight per batch
+    "CONCURRENCY": int(os.getenv("BATCH_TRIAGE_CONCURRENCY", 8)),
+}
+
+
+# ---------------------------------------------------------
+# JSON CODEC for API requests and responses
+# "auto" uses orjson when it is installed, else the json module
+# ---------------------------------------------------------
+JSON_CODEC = {
+    "BACKEND": os.getenv("JSON_CODEC", "auto"),
+}
+
+
+# ---------------------------------------------------------
+# WORKER WARM-UP (readiness at /api/ready/)
+# ---------------------------------------------------------
+WARMUP = {
+    "ENABLED": os.getenv("WARMUP_ENABLED", "true").lower() == "true",
+    # Run in this order on a background thread when a worker boots
+    "STEPS": ["gemini", "models", "supabase", "auth", "symptoms", "directory", "appointments"],
+}
+
+
+# ---------------------------------------------------------
+# METRICS (/api/metrics, Prometheus text format)
+# ---------------------------------------------------------
+METRICS = {
+    "ENABLED": os.getenv("METRICS_ENABLED", "true").lower() == "true",
+    # Adds per-stage durations to API responses as a Server-Timing header
+    "SERVER_TIMING": os.getenv("METRICS_SERVER_TIMING", "true").lower() == "true",
+}
+
+
+# ---------------------------------------------------------
+# DOCTOR DIRECTORY (in-memory specialty -> doctors index)
+# ---------------------------------------------------------
+DOCTOR_DIRECTORY = {
+    "REFRESH_INTERVAL": int(os.getenv("DOCTOR_DIRECTORY_REFRESH", 300)),
+    "FULL_RELOAD_INTERVAL": int(os.getenv("DOCTOR_DIRECTORY_FULL_RELOAD", 3600)),
+    "CHANGE_FIELD": os.getenv("DOCTOR_DIRECTORY_CHANGE_FIELD", "created_at"),
+    "PAGE_SIZE": 1000,
+    # Grid cell size of the nearest-doctor index (~5.5 km)
+    "GEO_CELL_DEG": float(os.getenv("DOCTOR_DIRECTORY_GEO_CELL_DEG", 0.05)),
+    # Entries one /api/doctors/ page may look at before returning short
+    "MAX_SCAN": int(os.getenv("DOCTOR_DIRECTORY_MAX_SCAN", 2000)),
+}
+
+
+# ---------------------------------------------------------
+# APPOINTMENT AVAILABILITY (appointments/availability.py)
+# ---------------------------------------------------------
+APPOINTMENTS = {
+    # Slot grid shared by every doctor, in the clinics' local time
+    "TIME_ZONE": os.getenv("APPOINTMENTS_TIME_ZONE", "Asia/Kolkata"),
+    "SLOT_MINUTES": 30,
+    "WORKING_HOURS": [("09:00", "12:00"), ("14:00", "18:00")],
+    "WORKING_DAYS": [0, 1, 2, 3, 4, 5, 6],
+    "MIN_NOTICE_MINUTES": int(os.getenv("APPOINTMENTS_MIN_NOTICE_MINUTES", 60)),
+    # Bookings from now to this many days ahead are held in memory
+    "HORIZON_DAYS": int(os.getenv("APPOINTMENTS_HORIZON_DAYS", 60)),
+    "MAX_DAYS": 14,
+    "REFRESH_INTERVAL": int(os.getenv("APPOINTMENTS_REFRESH", 60)),
+}
+
+
+# ---------------------------------------------------------
+# API RESPONSE COMPRESSION (brotli when installed, else gzip)
+# ---------------------------------------------------------
+COMPRESSION = {
+    "ENABLED": os.getenv("API_COMPRESSION", "true").lower() == "true",
+    # Smaller bodies are sent as they are
+    "MIN_SIZE": 1024,
+    "BROTLI_QUALITY": 5,
+    "GZIP_LEVEL": 6,
+}
+
+
+# ---------------------------------------------------------
+# SYMPTOM SESSION WRITE-BEHIND QUEUE
+# ---------------------------------------------------------
+SESSION_WRITER = {
+    "BATCH_SIZE": int(os.getenv("SESSION_WRITER_BATCH_SIZE", 100)),
+    "FLUSH_INTERVAL": float(os.getenv("SESSION_WRITER_FLUSH_INTERVAL", 2.0)),
+    "MAX_QUEUE": 10000,
+    "MAX_RETRIES": 4,
+    "RETRY_BACKOFF": 0.5,
+    # Unwritten sessions are spooled here on shutdown and replayed on start
+    "SPOOL_DIR": os.getenv("SESSION_WRITER_SPOOL_DIR", os.path.join(BASE_DIR, "spool")),
+}
 
 
 # ---------------------------------------------------------
@@ -156,4 +325,73 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # ---------------------------------------------------------
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
\ No newline at end of file
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+# Connection pool, timeouts (seconds) and retries for the API's Supabase client
+SUPABASE_CLIENT = {
+    "CONNECT_TIMEOUT": float(os.getenv("SUPABASE_CONNECT_TIMEOUT", 3.0)),
+    "READ_TIMEOUT": float(os.getenv("SUPABASE_READ_TIMEOUT", 10.0)),
+    "WRITE_TIMEOUT": 10.0,
+    "POOL_TIMEOUT": 3.0,
+    "MAX_CONNECTIONS": int(os.getenv("SUPABASE_MAX_CONNECTIONS", 20)),
+    "MAX_KEEPALIVE": 10,
+    "KEEPALIVE_EXPIRY": 30.0,
+    "RETRIES": 2,
+    "RETRY_BACKOFF": 0.2,
+    "LOOKUP_CACHE_SIZE": 10000,
+    "LOOKUP_CACHE_TTL": 3600,
+}
+
+# Verification of Supabase access tokens on the API views (api/auth.py)
+SUPABASE_AUTH = {
+    # Off: requests without a token are served anonymously (tokens sent are still verified)
+    "REQUIRED": os.getenv("AUTH_REQUIRED", "true").lower() == "true",
+    # Legacy HS256 projects: Settings -> API -> JWT secret
+    "JWT_SECRET": os.getenv("SUPABASE_JWT_SECRET"),
+    # Asymmetric signing keys; defaults to <SUPABASE_URL>/auth/v1/.well-known/jwks.json
+    "JWKS_URL": os.getenv("SUPABASE_JWKS_URL"),
+    "AUDIENCE": "authenticated",
+    "JWKS_REFRESH": int(os.getenv("SUPABASE_JWKS_REFRESH", 600)),
+    # Verified tokens remembered for up to CACHE_TTL seconds (never past exp)
+    "CACHE_SIZE": 10000,
+    "CACHE_TTL": 300,
+    # app_metadata.role values allowed on admin endpoints (service-role tokens always are)
+    "ADMIN_ROLES": ["admin"],
+}
+
+# Per-user rate limits and the Gemini concurrency cap (api/admission.py)
+ADMISSION = {
+    "ENABLED": os.getenv("ADMISSION_ENABLED", "true").lower() == "true",
+    # Token buckets per endpoint and user (or client IP): RATE tokens/second, BURST size
+    "RATE_LIMITS": {
+        "default": {"RATE": 5.0, "BURST": 30},
+        "analyze": {"RATE": float(os.getenv("ANALYZE_RATE_LIMIT", 0.2)), "BURST": 10},
+        "batch": {"RATE": 0.02, "BURST": 2},
+        "recommend": {"RATE": 5.0, "BURST": 30},
+        "doctors": {"RATE": 10.0, "BURST": 60},
+        "refresh": {"RATE": 0.1, "BURST": 3},
+        "availability": {"RATE": 5.0, "BURST": 30},
+        "book": {"RATE": 0.1, "BURST": 5},
+        "export": {"RATE": 0.01, "BURST": 3},
+    },
+    # Concurrent Gemini generations per worker, and how many may wait for a slot
+    "LLM_CONCURRENCY": int(os.getenv("LLM_CONCURRENCY", 8)),
+    "LLM_QUEUE": int(os.getenv("LLM_QUEUE", 16)),
+    "LLM_QUEUE_TIMEOUT": 5.0,
+    # Proxies that append to X-Forwarded-For (Render: 1); 0 uses REMOTE_ADDR
+    "TRUSTED_PROXY_COUNT": int(os.getenv("TRUSTED_PROXY_COUNT", 0)),
+}
+
+# manage.py import_records (api/bulk_import.py)
+BULK_IMPORT = {
+    "BATCH_SIZE": 1000,
+    # Password hashing processes; None means one per CPU
+    "HASH_WORKERS": None,
+}
+
+# symptom_sessions NDJSON export (api/export.py)
+SESSION_EXPORT = {
+    # Rows per keyset select; one chunk is in memory at a time
+    "CHUNK_SIZE": int(os.getenv("SESSION_EXPORT_CHUNK", 1000)),
+    "GZIP_LEVEL": 6,
+}
@@ -18,8 +18,9 @@ from django.contrib import admin
 from django.urls import path, include ,re_path
 from django.conf import settings
 
-from django.views.generic import TemplateView
 from django.conf.urls.static import static
+
+from .views import index
 # urlpatterns = [
 #     path('admin/', admin.site.urls),
 #     path('', include('home.urls')),  # Include URLs from the home app
@@ -33,6 +34,7 @@ from django.conf.urls.static import static
 # ]
 
 urlpatterns = [
- path('',TemplateView.as_view(template_name="index.html")),  # <-- serves the React app
+ path('', index),  # <-- serves the React app (cached, precompressed shell)
    path('api/', include('api.urls')),  # Include URLs from the api app
+   path('api/appointments/', include('appointments.urls')),  # Slot availability and booking
 ]+ static(settings.STATIC_URL, document_root=settings.STATICFILES_DIRS[0])
\ No newline at end of file
@@ -1,4 +1,100 @@
-from django.shortcuts import render
+"""
+The React app's shell.
 
+``index.html`` is the same bytes for every visitor, so it is read once per
+worker and kept in memory along with its gzip and Brotli encodings. Each
+encoding has its own strong ETag. ``index`` picks the one the browser
+accepts and answers ``304 Not Modified`` when ``If-None-Match`` already
+holds it. The shell itself is sent ``no-cache`` so a deploy is picked up on
+the next visit, while the fingerprinted files under ``/assets/`` it points to
+are cached as immutable by WhiteNoise (see ``WHITENOISE_IMMUTABLE_FILE_TEST``
+in settings).
+
+With ``SPA["RELOAD"]`` (on under ``DEBUG``) the file is re-read whenever it
+changes on disk, so a ``vite build`` shows up without a restart.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
+
+from api.responses import accepted, brotli, etag_matches
+
+DEFAULTS = {
+    "INDEX": os.path.join(settings.BASE_DIR, "..", "react-frontend", "dist", "index.html"),
+    "CACHE_CONTROL": "no-cache",
+    "RELOAD": settings.DEBUG,
+}
+config = {**DEFAULTS, **getattr(settings, "SPA", {})}
+
+
+class Shell:
+    """``index.html`` and its encodings: ``{encoding or None: (body, etag)}``."""
+
+    def __init__(self, path, reload=False):
+        self.path = path
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._variants = None
+        self._mtime = None
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()[:32]
+        variants = {None: (raw, f'"{digest}"')}
+        variants["gzip"] = (gzip.compress(raw, compresslevel=9, mtime=0), f'"{digest}-gzip"')
+        if brotli is not None:
+            variants["br"] = (brotli.compress(raw, quality=11), f'"{digest}-br"')
+        return variants
+
+    def variants(self):
+        mtime = None
+        if self.reload:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+        if self._variants is None or mtime != self._mtime:
+            with self._lock:
+                if self._variants is None or mtime != self._mtime:
+                    self._variants = self._load()
+                    self._mtime = mtime
+        return self._variants
+
+    def pick(self, accept_encoding):
+        """``(body, etag, encoding)`` for a request's ``Accept-Encoding``."""
+        variants = self.variants()
+        names = accepted(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in variants and encoding in names:
+                return (*variants[encoding], encoding)
+        return (*variants[None], None)
+
+
+shell = Shell(config["INDEX"], reload=config["RELOAD"])
+
+
+@require_safe
 def index(request):
-    return render(request, "index.html")
\ No newline at end of file
+    try:
+        body, etag, encoding = shell.pick(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    except FileNotFoundError:
+        raise Http404("The React app has not been built (run npm run build in react-frontend)")
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match and etag_matches(if_none_match, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="text/html; charset=utf-8")
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["Content-Length"] = str(len(body))
+    response["ETag"] = etag
+    response["Cache-Control"] = config["CACHE_CONTROL"]
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
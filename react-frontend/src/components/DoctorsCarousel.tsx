@@ -1,6 +1,6 @@
 import { DoctorCard } from "@/components/ui/DoctorCard";
 import { useState, useEffect } from "react";
-import { supabase } from "@/lib/supabaseClient";
+import { listDoctors } from "@/lib/api";
 
 interface Doctor {
   id: number;
@@ -21,18 +21,20 @@ const DoctorsCarousel = () => {
   const [doctors, setDoctors] = useState<Doctor[]>([]);
   const [loading, setLoading] = useState(true);
 
-  // Fetch real doctors from Supabase
+  // Fetch the most experienced doctors from the backend listing
   const fetchDoctors = async () => {
-    const { data, error } = await supabase
-      .from("doctors")
-      .select("*")
-      .not("full_name", "is", null); // Only real doctors
-
-    if (error) {
+    let data;
+    try {
+      ({ doctors: data } = await listDoctors({
+        limit: 30,
+        fields: ["id", "full_name", "specialties", "experience", "location", "consultation_fee", "profile_photo"],
+      }));
+    } catch (error) {
       console.error("Error loading doctors:", error);
       setLoading(false);
       return;
     }
+    data = data.filter((doc: any) => doc.full_name); // Only real doctors
 
     // Shuffle doctors randomly
     const shuffled = data.sort(() => Math.random() - 0.5);
@@ -44,13 +46,13 @@ const DoctorsCarousel = () => {
     const formatted = limited.map((doc: any) => ({
       id: doc.id,
       name: doc.full_name || doc.name,
-      specialty: doc.specialty || "General Physician",
+      specialty: doc.specialties?.[0] || "General Physician",
       rating: doc.rating || 4.8,
       experience: doc.experience || "5+ years",
       location: doc.location || "Your City",
       distance: "",
       availableSlots: ["09:00 AM", "11:30 AM", "02:00 PM"],
-      image: doc.image_url || "/doctors/doctor1.jpg",
+      image: doc.profile_photo || "/doctors/doctor1.jpg",
       consultationFee: doc.consultation_fee || 500,
       patients: doc.patients || "1000+",
       awards: doc.awards || ""
@@ -93,6 +93,40 @@ export const recommendDoctor = async (data: {
     }
 };
 
+// Doctor listing (keyset pages; pass next_cursor back as cursor)
+export const listDoctors = async (params: {
+    specialty?: string;
+    cursor?: string | null;
+    limit?: number;
+    fields?: string[];
+    min_fee?: number;
+    max_fee?: number;
+    latitude?: number;
+    longitude?: number;
+    radius_km?: number;
+} = {}) => {
+    const { fields, cursor, ...rest } = params;
+    const response = await api.get('/doctors/', {
+        params: { ...rest, cursor: cursor || undefined, fields: fields?.join(',') },
+    });
+    return response.data as { doctors: any[]; next_cursor: string | null };
+};
+
+// Appointment slots and booking
+export const getDoctorSlots = async (doctorId: string, date: string, days = 1) => {
+    const response = await api.get(`/appointments/doctors/${doctorId}/slots/`, { params: { date, days } });
+    return response.data as { slots: string[]; slot_minutes: number };
+};
+
+export const bookAppointment = async (data: {
+    doctor_id: string;
+    start: string;
+    reason?: string | null;
+}) => {
+    const response = await api.post('/appointments/book/', data);
+    return response.data;
+};
+
 // Auth functions
 export const signUp = async (email: string, password: string) => {
     const { data, error } = await supabase.auth.signUp({
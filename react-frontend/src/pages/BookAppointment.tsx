@@ -23,6 +23,7 @@ import {
   startOfDay
 } from 'date-fns';
 import { supabase } from '@/lib/supabaseClient';
+import { bookAppointment, getDoctorSlots } from '@/lib/api';
 import { DoctorProfileCard } from '@/components/appointment/DoctorProfileCard';
 import { ReviewsSection } from '@/components/appointment/ReviewsSection';
 import emailjs from "@emailjs/browser";
@@ -84,11 +85,9 @@ const BookAppointment = () => {
   const [emailSent, setEmailSent] = useState<boolean | null>(null);
   const [emailErrorMessage, setEmailErrorMessage] = useState<string | null>(null);
 
-  const timeSlots = [
-    '09:00 AM','09:30 AM','10:00 AM','10:30 AM',
-    '11:00 AM','11:30 AM','02:00 PM','02:30 PM',
-    '03:00 PM','03:30 PM','04:00 PM','04:30 PM','05:00 PM','05:30 PM'
-  ];
+  // Free slots of the selected day, from the backend's availability index
+  const [timeSlots, setTimeSlots] = useState<{ label: string; start: string }[]>([]);
+  const [slotsLoading, setSlotsLoading] = useState(false);
 
   useEffect(() => {
     fetchData();
@@ -159,10 +158,25 @@ const BookAppointment = () => {
 
   const isDateDisabled = (date: Date) => isBefore(date, today);
 
+  const loadSlots = async (date: Date) => {
+    if (!doctorId) return;
+    try {
+      setSlotsLoading(true);
+      const { slots } = await getDoctorSlots(doctorId, format(date, 'yyyy-MM-dd'));
+      setTimeSlots(slots.map(start => ({ label: format(new Date(start), 'hh:mm a'), start })));
+    } catch (err) {
+      console.error(err);
+      setTimeSlots([]);
+    } finally {
+      setSlotsLoading(false);
+    }
+  };
+
   const handleDateSelect = (date: Date) => {
     if (isDateDisabled(date)) return;
     setSelectedDate(date);
     setSelectedTime(null);
+    loadSlots(date);
   };
 
   const handleTimeSelect = (time: string) => setSelectedTime(time);
@@ -179,31 +193,20 @@ const BookAppointment = () => {
 
   const handleBookAppointment = async () => {
     if (!selectedDate || !selectedTime) return alert('Please select date and time.');
+    const slot = timeSlots.find(s => s.label === selectedTime);
+    if (!slot || !doctorId) return alert('Please select an available time.');
     try {
       setSubmitting(true);
       setEmailSent(null);
       setEmailErrorMessage(null);
 
-      // Convert time to 24h
-      const [time, period] = selectedTime.split(' ');
-      let [hours, minutes] = time.split(':').map(Number);
-      if (period === 'PM' && hours !== 12) hours += 12;
-      if (period === 'AM' && hours === 12) hours = 0;
-      const appointmentDate = new Date(selectedDate);
-      appointmentDate.setHours(hours, minutes, 0, 0);
-
-      const { data: appointmentData, error: appointmentError } = await supabase
-        .from('appointments')
-        .insert({
-          doctor_id: doctorId,
-          patient_id: patient?.id,
-          appointment_date: appointmentDate.toISOString(),
-          status: 'pending',
-          reason: patientInfo.reason || null
-        })
-        .select()
-        .single();
-      if (appointmentError) throw appointmentError;
+      // The backend reserves the slot atomically; a 409 means someone was faster
+      const appointmentDate = new Date(slot.start);
+      await bookAppointment({
+        doctor_id: doctorId,
+        start: slot.start,
+        reason: patientInfo.reason || null
+      });
 
       // EmailJS integration
       try {
@@ -230,7 +233,11 @@ const BookAppointment = () => {
       setStep(3);
     } catch (err: any) {
       console.error(err);
-      alert(err?.message || 'Failed to book appointment.');
+      if (err?.response?.status === 409) {
+        setSelectedTime(null);
+        loadSlots(selectedDate);
+      }
+      alert(err?.response?.data?.error || err?.message || 'Failed to book appointment.');
     } finally {
       setSubmitting(false);
     }
@@ -312,7 +319,10 @@ const BookAppointment = () => {
                         <Clock className="w-5 h-5 mr-2 text-blue-500"/>Available Slots - {format(selectedDate,'MMM d, yyyy')}
                       </h3>
                       <div className="grid grid-cols-2 sm:grid-cols-3 md:grid-cols-4 gap-3">
-                        {timeSlots.map(time=>(
+                        {!slotsLoading && timeSlots.length === 0 && (
+                          <p className="col-span-full text-sm text-gray-500">No free slots on this day.</p>
+                        )}
+                        {timeSlots.map(({ label: time })=>(
                           <motion.button
                             key={time}
                             whileHover={{scale:1.05}} whileTap={{scale:0.95}}